@@ -0,0 +1,53 @@
+"""
+Gunicorn preload deployment profile.
+
+    gunicorn -c gunicorn.conf.py promptvision_app.wsgi
+
+The app is imported once in the master and workers are forked from it, so
+Django, the templates and the Python modules are shared copy-on-write. This is
+safe because no client is created at import time: each worker builds its own
+Supabase client and Cloudinary HTTP pools on first use (see
+rest_app/config/lifecycle.py), and drains its AI jobs before exiting.
+"""
+import multiprocessing
+import os
+import signal
+import threading
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+preload_app = True
+workers = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+# Threads let a worker keep serving page loads while AI jobs are running
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+# Synchronous AI runs can take minutes
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 660))
+# Time a stopping worker gets to drain its AI jobs
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 60))
+# Recycle workers now and then to bound memory growth
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = 100
+
+
+def post_fork(server, worker):
+    from rest_app.config.lifecycle import after_fork
+    after_fork()
+
+
+def post_worker_init(worker):
+    # Stop admitting queued AI jobs as soon as a graceful shutdown starts,
+    # while the requests already running are allowed to finish
+    from rest_app.config.lifecycle import shutdown
+    previous_handler = signal.getsignal(signal.SIGTERM)
+
+    def handle_term(signum, frame):
+        threading.Thread(target=shutdown, kwargs={'timeout': graceful_timeout}, daemon=True).start()
+        if callable(previous_handler):
+            previous_handler(signum, frame)
+
+    signal.signal(signal.SIGTERM, handle_term)
+
+
+def worker_exit(server, worker):
+    from rest_app.config.lifecycle import shutdown
+    shutdown(timeout=graceful_timeout)
@@ -12,10 +12,14 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 
 from pathlib import Path
 import os
+from dotenv import load_dotenv
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# Environment variables are loaded once, here; the rest of the app reads settings
+load_dotenv(BASE_DIR / ".env")
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.1/howto/deployment/checklist/
@@ -45,12 +49,15 @@ INSTALLED_APPS = [
     "django.contrib.contenttypes",
     "django.contrib.sessions",
     "django.contrib.messages",
+    "whitenoise.runserver_nostatic",
     "django.contrib.staticfiles",
     'rest_app.apps.RestAppConfig',
 ]
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
+    # Serves hashed/precompressed static files before any auth middleware runs
+    "whitenoise.middleware.WhiteNoiseMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -58,6 +65,8 @@ MIDDLEWARE = [
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
     # "rest_app.middleware.SupabaseAuthenticatedMiddleware",
+    # Request-scoped identity map / batched loader of Supabase reads
+    "rest_app.middleware.RequestLoaderMiddleware",
     "rest_app.middleware.SupabaseAuthMiddleware",
 ]
 
@@ -93,6 +102,42 @@ DATABASES = {
     }
 }
 
+# Caches shared by every worker process, whose values are only correct if all workers
+# see the same ones:
+# - "default": cached page data and Cloudinary listings, safe to evict.
+# - "state": content version tokens (page ETags) and idempotency keys, which must not be
+#   culled to make room for page data (see rest_app/config/cache_config.py).
+# Redis (REDIS_URL) is required in production. Configure it with an eviction policy
+# that spares keys without expiry (e.g. volatile-lru), as version tokens never expire.
+# Without it, file caches stand in for a single-host development setup: every write
+# lists the cache directory, and the default one culls past PAGE_CACHE_MAX_ENTRIES.
+if os.getenv("REDIS_URL"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.getenv("REDIS_URL"),
+        },
+        "state": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.getenv("REDIS_URL"),
+            "KEY_PREFIX": "state",
+        },
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": BASE_DIR / "django_cache",
+            "OPTIONS": {"MAX_ENTRIES": int(os.getenv("PAGE_CACHE_MAX_ENTRIES", 20000))},
+        },
+        "state": {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": BASE_DIR / "django_state",
+            # Never reached in practice: losing a version token breaks ETags
+            "OPTIONS": {"MAX_ENTRIES": 10_000_000},
+        },
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -131,6 +176,20 @@ STATIC_URL = "static/"
 STATIC_FILES_DIRS = {
     os.path.join(BASE_DIR, 'static'),
 }
+# collectstatic output, served by WhiteNoise
+STATIC_ROOT = BASE_DIR / "staticfiles"
+
+# Fingerprinted filenames (style.<hash>.css) plus precompressed .gz/.br variants,
+# generated once at collectstatic time. WhiteNoise serves the hashed files with a
+# far-future "immutable" Cache-Control header.
+STORAGES = {
+    "default": {
+        "BACKEND": "django.core.files.storage.FileSystemStorage",
+    },
+    "staticfiles": {
+        "BACKEND": "whitenoise.storage.CompressedManifestStaticFilesStorage",
+    },
+}
 
 
 # Default primary key field type
@@ -146,12 +205,61 @@ LOGIN_URL = 'login'
 LOGIN_REDIRECT_URL = 'conversation_list'
 LOGOUT_REDIRECT_URL = 'home'
 
+# Supabase settings
+SUPABASE_URL = os.getenv('SUPABASE_HOST_URL')
+SUPABASE_KEY = os.getenv('SUPABASE_API_SECRET')
+SUPABASE_JWT_SECRET = os.getenv('SUPABASE_JWT_SECRET')
+# Direct Postgres connection string, only used by the schema migrator
+SUPABASE_DB_URL = os.getenv('SUPABASE_DB_URL')
+
 # Cloudinary settings
 CLOUDINARY = {
     'cloud_name': os.getenv('CLOUDINARY_CLOUD_NAME', ''),
     'api_key': os.getenv('CLOUDINARY_API_KEY', ''),
     'api_secret': os.getenv('CLOUDINARY_API_SECRET', ''),
 }
+CLOUDINARY_FOLDER_NAME = os.getenv('CLOUDINARY_FOLDER_NAME', 'default_folder')
+# Seconds a Cloudinary folder listing page stays cached
+CLOUDINARY_LISTING_CACHE_TTL = 60
+# Seconds a signed direct-to-Cloudinary browser upload stays acceptable
+CLOUDINARY_DIRECT_UPLOAD_TTL = 600
+# Conversations without activity for this many days are moved to cold storage
+# by the archive_conversations command
+ARCHIVE_AFTER_DAYS = 90
+# On-disk LRU cache of downloaded asset bytes, shared by the workers of a host
+ASSET_CACHE_DIR = BASE_DIR / "asset_cache"
+ASSET_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# Seconds a prompt submission's idempotency key is remembered (in the shared state cache)
+PROMPT_IDEMPOTENCY_TTL = 600
+# Seconds the main pages' data (conversation list, conversation bundle) stays cached in
+# the shared default cache. Entries are keyed by content versions, so writes never
+# serve stale data on any worker.
+PAGE_DATA_CACHE_TTL = 300
+# Rows requested per page when iterating over large Supabase result sets. PostgREST
+# caps responses at its max-rows setting (1000 on Supabase); larger values are safe
+# but only cost memory, the iterators follow up until a page comes back empty.
+SUPABASE_PAGE_SIZE = int(os.getenv('SUPABASE_PAGE_SIZE', 1000))
+
+# AI inpainting service, and the secret its completion callbacks are signed with
+# (callback mode is disabled when unset)
+AI_INPAINT_API_URL = os.getenv('AI_INPAINT_API_URL')
+AI_CALLBACK_SECRET = os.getenv('AI_CALLBACK_SECRET', '')
+# Seconds a dispatched callback-mode prompt may wait for its final callback before it is marked failed
+AI_CALLBACK_TIMEOUT = int(os.getenv('AI_CALLBACK_TIMEOUT', 900))
+
+# AI job scheduling: overall concurrency towards the AI service, seconds a job may
+# wait for a slot, and per-plan limits. All limits are per worker process: with
+# N gunicorn workers, users and the AI service see up to N times these values.
+# Plans come from the Supabase user's app_metadata.plan, read at login.
+AI_MAX_CONCURRENT_JOBS = 4
+AI_QUEUE_TIMEOUT = 300
+# Seconds a stopping worker waits for its running AI jobs
+AI_DRAIN_TIMEOUT = 30
+AI_PLAN_LIMITS = {
+    'default': {'rate_per_minute': 6, 'burst': 3, 'max_concurrent': 1, 'weight': 1},
+    'pro': {'rate_per_minute': 30, 'burst': 10, 'max_concurrent': 3, 'weight': 3},
+}
 
 AUTHENTICATION_BACKENDS = [
     'rest_app.utils.auth_backends.SupabaseAuthBackend',
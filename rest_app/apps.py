@@ -9,6 +9,9 @@ class RestAppConfig(AppConfig):
         """
         Initialize services when the app is ready
         """
-        # # Import and initialize Cloudinary
-        # from rest_app.config.cloudinary_config import initialize_cloudinary
-        # initialize_cloudinary()
+        # Clients are created lazily on first use; forked workers get their own
+        from rest_app.config.lifecycle import register_fork_hooks
+        register_fork_hooks()
+
+        # Registers the shared cache check
+        from rest_app import checks  # noqa: F401
@@ -0,0 +1,57 @@
+from django.core.cache import caches
+from django.core.checks import Error, Warning, register
+from rest_app.config.cache_config import STATE_CACHE_ALIAS
+
+# Backends whose entries only exist in the process that wrote them
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+# Backends whose add() is atomic across processes: the store itself rejects an existing key
+ATOMIC_ADD_CACHES = (
+    'django.core.cache.backends.redis.RedisCache',
+    'django.core.cache.backends.memcached.PyMemcacheCache',
+    'django.core.cache.backends.memcached.PyLibMCCache',
+    'django.core.cache.backends.db.DatabaseCache',
+)
+
+
+def cache_backend(alias):
+    return f"{type(caches[alias]).__module__}.{type(caches[alias]).__name__}"
+
+
+@register()
+def check_shared_cache(app_configs, **kwargs):
+    """
+    Cached page data (default cache), content versions (page ETags) and
+    idempotency keys (state cache) must be shared by all workers.
+    """
+    warnings = []
+    for alias in ('default', STATE_CACHE_ALIAS):
+        backend = cache_backend(alias)
+        if backend in PROCESS_LOCAL_CACHES:
+            warnings.append(Warning(
+                f"The {alias} cache ({backend}) is local to each process.",
+                hint="Workers would serve stale pages (ETag 304s) after writes handled by another worker. "
+                     "Set REDIS_URL or use the file-based caches of settings.py.",
+                id='rest_app.W001',
+            ))
+    return warnings
+
+
+@register(deploy=True)
+def check_atomic_claims(app_configs, **kwargs):
+    """
+    Idempotency keys are claimed with cache.add() on the state cache: two
+    concurrent duplicates only get one True if the backend's add is atomic.
+    The file-based development cache checks then writes, so deployments
+    (manage.py check --deploy) refuse it.
+    """
+    backend = cache_backend(STATE_CACHE_ALIAS)
+    if backend in ATOMIC_ADD_CACHES:
+        return []
+    return [Error(
+        f"The {STATE_CACHE_ALIAS} cache ({backend}) has no atomic add().",
+        hint="Concurrent duplicate prompt submissions could both be accepted. Set REDIS_URL.",
+        id='rest_app.E002',
+    )]
@@ -0,0 +1,9 @@
+from django.core.cache import caches
+from django.utils.connection import ConnectionProxy
+
+# Cache alias of the state that must survive page data pressure: content version
+# tokens and idempotency keys (see CACHES in settings.py)
+STATE_CACHE_ALIAS = 'state'
+
+# Used like django.core.cache.cache, for the state cache
+state_cache = ConnectionProxy(caches, STATE_CACHE_ALIAS)
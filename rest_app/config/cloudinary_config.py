@@ -1,30 +1,72 @@
-import cloudinary
-import cloudinary.uploader
-import cloudinary.api
 from django.conf import settings
-import os
-from dotenv import load_dotenv
+from django.core.cache import cache
+import hashlib
+import re
+import sys
+import threading
+import time
 
-# Load environment variables
-load_dotenv()
+_configured = False
+_configure_lock = threading.Lock()
 
 # Initialize Cloudinary
 def initialize_cloudinary():
     """
-    Initialize Cloudinary with credentials from environment variables.
-    This function should be called once when the app starts.
+    Initialize Cloudinary with the credentials from settings.CLOUDINARY.
+    Called lazily by get_cloudinary() before the first API call.
     """
+    import cloudinary
+    import cloudinary.uploader
+    import cloudinary.api
+    import cloudinary.utils
+
     cloudinary.config(
-        cloud_name=os.getenv('CLOUDINARY_CLOUD_NAME'),
-        api_key=os.getenv('CLOUDINARY_API_KEY'),
-        api_secret=os.getenv('CLOUDINARY_API_SECRET'),
+        cloud_name=settings.CLOUDINARY['cloud_name'],
+        api_key=settings.CLOUDINARY['api_key'],
+        api_secret=settings.CLOUDINARY['api_secret'],
         secure=True
     )
     return cloudinary
 
-# Initialize the client
-cloudinary_client = initialize_cloudinary()
-CLOUDINARY_FOLDER_NAME = os.getenv('CLOUDINARY_FOLDER_NAME', 'default_folder')
+def get_cloudinary():
+    """
+    The configured cloudinary package. The SDK is only imported and configured
+    on first use, keeping it off the import path of the app.
+    """
+    global _configured
+    if not _configured:
+        with _configure_lock:
+            if not _configured:
+                initialize_cloudinary()
+                _configured = True
+    import cloudinary
+    return cloudinary
+
+def reset_cloudinary():
+    """
+    Give the current process its own Cloudinary HTTP pools, e.g. in a freshly
+    forked worker. The SDK keeps urllib3 pool managers at module level, which a
+    forked child would otherwise share with its parent.
+    """
+    global _configured, _configure_lock
+    _configure_lock = threading.Lock()
+    _configured = False
+    cloudinary = sys.modules.get('cloudinary')
+    utils = sys.modules.get('cloudinary.utils')
+    if cloudinary is None or utils is None or not hasattr(utils, 'get_http_connector'):
+        return
+    for module_name in ('cloudinary.uploader', 'cloudinary.api_client.call_api'):
+        module = sys.modules.get(module_name)
+        if module is not None and hasattr(module, '_http'):
+            module._http = utils.get_http_connector(cloudinary.config(), getattr(cloudinary, 'CERT_KWARGS', {}))
+
+CLOUDINARY_FOLDER_NAME = settings.CLOUDINARY_FOLDER_NAME
+# Admin API is rate limited, folder listing pages are cached for a short while
+LISTING_CACHE_TTL = getattr(settings, 'CLOUDINARY_LISTING_CACHE_TTL', 60)
+# Largest page the Admin API returns
+LISTING_MAX_PAGE_SIZE = 500
+# Seconds a signed browser upload stays acceptable
+DIRECT_UPLOAD_TTL = getattr(settings, 'CLOUDINARY_DIRECT_UPLOAD_TTL', 600)
 
 # File management functions
 def upload_file(file, folder=None, public_id=None):
@@ -51,13 +93,14 @@ def upload_file(file, folder=None, public_id=None):
         upload_options['public_id'] = public_id
     
     try:
-        result = cloudinary.uploader.upload(file, **upload_options)
+        result = get_cloudinary().uploader.upload(file, **upload_options)
         return {
             'success': True,
             'url': result['secure_url'],
             'public_id': result['public_id'],
             'resource_type': result['resource_type'],
             'format': result.get('format', ''),
+            'bytes': result.get('bytes'),
             'created_at': result['created_at']
         }
     except Exception as e:
@@ -66,6 +109,78 @@ def upload_file(file, folder=None, public_id=None):
             'error': str(e)
         }
 
+def generate_upload_signature(folder):
+    """
+    Generate signed parameters for an upload made directly from the browser
+    to Cloudinary, restricted to a folder
+    
+    Args:
+        folder: Folder (under the app folder) the upload is restricted to
+        
+    Returns:
+        Dictionary with the upload URL and the form fields to post with the file
+    """
+    config = get_cloudinary().config()
+    params = {
+        'timestamp': int(time.time()),
+        'folder': f"{CLOUDINARY_FOLDER_NAME}/{folder}",
+    }
+    return {
+        'upload_url': f"https://api.cloudinary.com/v1_1/{config.cloud_name}/image/upload",
+        'api_key': config.api_key,
+        'signature': get_cloudinary().utils.api_sign_request(params, config.api_secret),
+        **params
+    }
+
+def verify_direct_upload(public_id, version, signature, folder, file_format=''):
+    """
+    Verify the result of a browser upload made with generate_upload_signature
+    
+    The response signature proves Cloudinary created public_id at version; the
+    asset must also live in the expected folder and be recent.
+    
+    Args:
+        public_id: public_id returned by Cloudinary
+        version: version returned by Cloudinary (upload unix timestamp)
+        signature: signature returned by Cloudinary
+        folder: Folder (under the app folder) the upload was restricted to
+        file_format: format returned by Cloudinary, used to build the URL
+        
+    Returns:
+        Dictionary with the same upload information as upload_file. bytes is
+        None when the Admin API could not be reached (backfill_usage fills it in).
+    """
+    try:
+        version = int(version)
+    except (TypeError, ValueError):
+        return {'success': False, 'error': 'Invalid upload version'}
+
+    if not public_id.startswith(f"{CLOUDINARY_FOLDER_NAME}/{folder}/"):
+        return {'success': False, 'error': 'Upload is outside the allowed folder'}
+
+    if time.time() - version > DIRECT_UPLOAD_TTL:
+        return {'success': False, 'error': 'Upload has expired'}
+
+    if not get_cloudinary().utils.verify_api_response_signature(public_id, version, signature):
+        return {'success': False, 'error': 'Invalid upload signature'}
+
+    # Only the public_id and version are signed, the URL is rebuilt from them
+    if not re.fullmatch(r'[a-z0-9]{0,10}', file_format or ''):
+        file_format = ''
+    url, _ = get_cloudinary().utils.cloudinary_url(
+        public_id, resource_type='image', version=version, format=file_format or None, secure=True
+    )
+    # The size in the browser's upload response is not signed either, read it from the stored asset
+    info = get_file_info(public_id, resource_type='image')
+    return {
+        'success': True,
+        'url': url,
+        'public_id': public_id,
+        'resource_type': 'image',
+        'format': file_format,
+        'bytes': info['info'].get('bytes') if info['success'] else None,
+    }
+
 def delete_file(public_id, resource_type='image'):
     """
     Delete a file from Cloudinary
@@ -78,7 +193,7 @@ def delete_file(public_id, resource_type='image'):
         Dictionary with deletion result
     """
     try:
-        result = cloudinary.uploader.destroy(public_id, resource_type=resource_type)
+        result = get_cloudinary().uploader.destroy(public_id, resource_type=resource_type)
         return {
             'success': True,
             'result': result
@@ -89,35 +204,127 @@ def delete_file(public_id, resource_type='image'):
             'error': str(e)
         }
 
-def get_files_in_folder(folder, resource_type='image', max_results=100):
+def delete_files(public_ids, resource_type='image'):
+    """
+    Delete several files from Cloudinary in a single Admin API call
+    
+    Args:
+        public_ids: List of public IDs to delete (at most 100 per call)
+        resource_type: The resource type (image, video, raw)
+        
+    Returns:
+        Dictionary with the per public ID deletion status ('deleted', 'not_found', ...)
+    """
+    try:
+        result = get_cloudinary().api.delete_resources(public_ids, resource_type=resource_type)
+        return {
+            'success': True,
+            'deleted': result.get('deleted', {})
+        }
+    except Exception as e:
+        return {
+            'success': False,
+            'error': str(e)
+        }
+
+def delete_files_by_prefix(prefix, resource_type='image'):
     """
-    Get a list of files in a specific folder
+    Delete every file whose public ID starts with a prefix (e.g. a user folder)
+    
+    Args:
+        prefix: The public ID prefix to delete
+        resource_type: The resource type (image, video, raw)
+        
+    Returns:
+        Dictionary with the deleted public IDs and whether more remain ('partial')
+    """
+    try:
+        result = get_cloudinary().api.delete_resources_by_prefix(prefix, resource_type=resource_type)
+        return {
+            'success': True,
+            'deleted': result.get('deleted', {}),
+            'partial': result.get('partial', False)
+        }
+    except Exception as e:
+        return {
+            'success': False,
+            'error': str(e)
+        }
+
+def get_files_in_folder(folder, resource_type='image', max_results=100, next_cursor=None):
+    """
+    Get one page of files in a specific folder. Pages are cached for
+    CLOUDINARY_LISTING_CACHE_TTL seconds per folder/resource_type/cursor.
     
     Args:
         folder: The folder name to list files from
         resource_type: The resource type (image, video, raw)
-        max_results: Maximum number of results to return
+        max_results: Maximum number of results in the page (at most 500)
+        next_cursor: Cursor returned with the previous page, None for the first page
         
     Returns:
-        List of files in the folder
+        Dictionary with the files of the page and the cursor of the next page
+        (None on the last page)
     """
+    max_results = min(max_results, LISTING_MAX_PAGE_SIZE)
+    cache_key = "cloudinary-listing:" + hashlib.sha256(
+        f"{folder}|{resource_type}|{max_results}|{next_cursor or ''}".encode()
+    ).hexdigest()
+    page = cache.get(cache_key)
+    if page is not None:
+        return page
+
+    options = {}
+    if next_cursor:
+        options['next_cursor'] = next_cursor
+
     try:
-        result = cloudinary.api.resources(
+        result = get_cloudinary().api.resources(
             type='upload',
             prefix=folder,
             resource_type=resource_type,
-            max_results=max_results
+            max_results=max_results,
+            **options
         )
-        return {
-            'success': True,
-            'files': result['resources']
-        }
     except Exception as e:
         return {
             'success': False,
             'error': str(e)
         }
 
+    page = {
+        'success': True,
+        'files': result['resources'],
+        'next_cursor': result.get('next_cursor')
+    }
+    cache.set(cache_key, page, LISTING_CACHE_TTL)
+    return page
+
+def iter_files_in_folder(folder, resource_type='image', page_size=LISTING_MAX_PAGE_SIZE):
+    """
+    Lazily yield every file in a folder, following next_cursor page by page
+    
+    Args:
+        folder: The folder name to list files from
+        resource_type: The resource type (image, video, raw)
+        page_size: Number of files requested per Admin API call
+        
+    Yields:
+        Cloudinary resource dictionaries
+        
+    Raises:
+        RuntimeError if a page cannot be listed
+    """
+    next_cursor = None
+    while True:
+        page = get_files_in_folder(folder, resource_type=resource_type, max_results=page_size, next_cursor=next_cursor)
+        if not page['success']:
+            raise RuntimeError(f"Cloudinary listing of {folder} failed: {page['error']}")
+        yield from page['files']
+        next_cursor = page['next_cursor']
+        if not next_cursor:
+            return
+
 def get_file_info(public_id, resource_type='image'):
     """
     Get detailed information about a specific file
@@ -130,7 +337,7 @@ def get_file_info(public_id, resource_type='image'):
         Dictionary with file information
     """
     try:
-        result = cloudinary.api.resource(public_id, resource_type=resource_type)
+        result = get_cloudinary().api.resource(public_id, resource_type=resource_type)
         return {
             'success': True,
             'info': result
@@ -145,6 +352,9 @@ def update_file(public_id, new_file=None, new_folder=None, new_public_id=None, r
     """
     Update a file in Cloudinary
     
+    Replacing the content is a single overwrite upload with CDN invalidation, so
+    the asset URL never 404s in between. Renames/moves use a single rename call.
+    
     Args:
         public_id: The public ID of the file to update
         new_file: Optional new file to replace the existing one
@@ -155,90 +365,53 @@ def update_file(public_id, new_file=None, new_folder=None, new_public_id=None, r
     Returns:
         Dictionary with update result information
     """
-    # If we're uploading a new file to replace the old one
-    if new_file:
-        # First delete the old file
-        delete_result = delete_file(public_id, resource_type)
-        if not delete_result['success']:
-            return delete_result
-        
-        # Then upload the new file
-        upload_options = {
-            'resource_type': 'auto',
+    if not (new_file or new_folder or new_public_id):
+        # If no changes were requested
+        return {
+            'success': False,
+            'error': 'No update parameters provided'
         }
-        
-        if new_folder:
-            upload_options['folder'] = new_folder
-        elif new_public_id:
-            # If we have a new public ID but no new folder, extract folder from original public_id
-            folder_parts = public_id.split('/')
-            if len(folder_parts) > 1:
-                upload_options['folder'] = '/'.join(folder_parts[:-1])
-        
-        # Use new_public_id if provided, otherwise use the filename part of the original public_id
-        if new_public_id:
-            upload_options['public_id'] = new_public_id
+
+    # Determine the new full public_id
+    folder_parts = public_id.split('/')
+    original_folder = '/'.join(folder_parts[:-1])
+    target_folder = new_folder or original_folder
+    target_name = new_public_id or folder_parts[-1]
+    new_full_public_id = f"{target_folder}/{target_name}" if target_folder else target_name
+
+    try:
+        if new_file:
+            # Overwrite in place (or write to the new location) and purge CDN caches
+            result = get_cloudinary().uploader.upload(
+                new_file,
+                public_id=new_full_public_id,
+                resource_type='auto',
+                overwrite=True,
+                invalidate=True
+            )
+            # Moving while replacing: the old asset goes only after the new one exists
+            if new_full_public_id != public_id:
+                get_cloudinary().uploader.destroy(public_id, resource_type=resource_type, invalidate=True)
         else:
-            upload_options['public_id'] = public_id.split('/')[-1]
-        
-        try:
-            result = cloudinary.uploader.upload(new_file, **upload_options)
-            return {
-                'success': True,
-                'url': result['secure_url'],
-                'public_id': result['public_id'],
-                'resource_type': result['resource_type'],
-                'format': result.get('format', ''),
-                'created_at': result['created_at']
-            }
-        except Exception as e:
-            return {
-                'success': False,
-                'error': str(e)
-            }
-    
-    # If we're just renaming or moving the file (no new file upload)
-    elif new_folder or new_public_id:
-        try:
-            # Determine the new full public_id
-            if new_folder and new_public_id:
-                new_full_public_id = f"{new_folder}/{new_public_id}"
-            elif new_folder:
-                # Keep the original filename but change the folder
-                original_filename = public_id.split('/')[-1]
-                new_full_public_id = f"{new_folder}/{original_filename}"
-            elif new_public_id:
-                # Keep the original folder but change the filename
-                folder_parts = public_id.split('/')
-                if len(folder_parts) > 1:
-                    original_folder = '/'.join(folder_parts[:-1])
-                    new_full_public_id = f"{original_folder}/{new_public_id}"
-                else:
-                    new_full_public_id = new_public_id
-            
-            # Rename the file
-            result = cloudinary.uploader.rename(
-                public_id, 
+            # If we're just renaming or moving the file (no new file upload).
+            # Without overwrite, an existing asset at the target makes this fail instead of being replaced
+            result = get_cloudinary().uploader.rename(
+                public_id,
                 new_full_public_id,
-                resource_type=resource_type
+                resource_type=resource_type,
+                invalidate=True
             )
-            
-            return {
-                'success': True,
-                'url': result['secure_url'],
-                'public_id': result['public_id'],
-                'resource_type': result['resource_type'],
-                'format': result.get('format', ''),
-                'created_at': result.get('created_at')
-            }
-        except Exception as e:
-            return {
-                'success': False,
-                'error': str(e)
-            }
-    
-    # If no changes were requested
-    return {
-        'success': False,
-        'error': 'No update parameters provided'
-    } 
\ No newline at end of file
+
+        return {
+            'success': True,
+            'url': result['secure_url'],
+            'public_id': result['public_id'],
+            'resource_type': result['resource_type'],
+            'format': result.get('format', ''),
+            'created_at': result.get('created_at')
+        }
+    except Exception as e:
+        return {
+            'success': False,
+            'error': str(e)
+        }
@@ -0,0 +1,57 @@
+import logging
+import os
+# Imported up front: importing in the child after a fork can deadlock on an
+# import lock another thread of the parent held at fork time
+from rest_app.config.supabase_config import reset_supabase_client
+from rest_app.config.cloudinary_config import reset_cloudinary
+from rest_app.services.scheduler_service import ai_scheduler
+from rest_app.services.page_cache_service import PageCacheService
+from rest_app.utils.asset_cache import asset_cache
+
+logger = logging.getLogger(__name__)
+
+_fork_hook_registered = False
+
+
+def after_fork():
+    """
+    Give a freshly forked process its own clients and scheduler state.
+
+    Clients are created lazily, so after this the worker builds its own
+    Supabase client and Cloudinary HTTP pools on first use instead of reusing
+    sockets inherited from the parent.
+    """
+    reset_supabase_client()
+    reset_cloudinary()
+    ai_scheduler.reset()
+    asset_cache.after_fork()
+    PageCacheService.after_fork()
+    logger.debug(f"Clients reset after fork in process {os.getpid()}")
+
+
+def register_fork_hooks():
+    """
+    Run after_fork() in every child forked from this process, whatever server
+    does the forking. Safe to call more than once.
+    """
+    global _fork_hook_registered
+    if _fork_hook_registered or not hasattr(os, 'register_at_fork'):
+        return
+    os.register_at_fork(after_in_child=after_fork)
+    _fork_hook_registered = True
+
+
+def shutdown(timeout=None):
+    """
+    Graceful shutdown of a worker: turn away queued AI jobs and wait for the
+    running ones to finish
+
+    Returns:
+        Number of AI jobs still running when timeout expired
+    """
+    remaining = ai_scheduler.drain(timeout)
+    if remaining:
+        logger.warning(f"Worker {os.getpid()} exiting with {remaining} AI job(s) still running")
+    else:
+        logger.info(f"Worker {os.getpid()} drained its AI jobs")
+    return remaining
@@ -1,14 +1,91 @@
-from supabase import create_client
+import asyncio
 import os
-from dotenv import load_dotenv
+import threading
+import weakref
+from django.conf import settings
 
-# Load environment variables
-load_dotenv()
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+# Async clients are bound to the event loop they were created on
+_async_clients = weakref.WeakKeyDictionary()
+# Event loop running async queries on behalf of synchronous code (see run_on_query_loop)
+_query_loop = None
+_query_loop_lock = threading.Lock()
+
+
+def get_supabase_client():
+    """
+    Shared Supabase client of the current process, created on first use.
+    Importing the supabase package and building the client are deferred until
+    a query is actually made, so management commands and workers start fast.
+    A process forked after the client was built gets its own client (and
+    connection pool) instead of sharing the parent's sockets.
+    """
+    global _client, _client_pid
+    if _client is None or _client_pid != os.getpid():
+        with _client_lock:
+            if _client is None or _client_pid != os.getpid():
+                _client = get_new_supabase_client()
+                _client_pid = os.getpid()
+    return _client
+
+
+def reset_supabase_client():
+    """Forget the shared clients and query loop, e.g. in a freshly forked worker"""
+    global _client, _client_lock, _client_pid, _async_clients, _query_loop, _query_loop_lock
+    # The lock may have been held by another thread of the parent at fork time
+    _client_lock = threading.Lock()
+    _client = None
+    _client_pid = None
+    # The parent's loop thread does not exist in the child
+    _async_clients = weakref.WeakKeyDictionary()
+    _query_loop = None
+    _query_loop_lock = threading.Lock()
+
+
+async def get_async_supabase_client():
+    """
+    Async Supabase client of the running event loop, created on first use.
+    Each loop gets its own client: its connection pool cannot be shared
+    across loops.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        from supabase import acreate_client
+        client = await acreate_client(settings.SUPABASE_URL, settings.SUPABASE_KEY)
+        # Another task of the loop may have won the race while we awaited
+        client = _async_clients.setdefault(loop, client)
+    return client
+
+
+def get_query_loop():
+    """
+    Event loop of this process dedicated to async queries issued from
+    synchronous code, running in a daemon thread. Being long-lived, its async
+    client keeps its connections warm across requests.
+    """
+    global _query_loop
+    if _query_loop is None:
+        with _query_loop_lock:
+            if _query_loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name='supabase-queries', daemon=True).start()
+                _query_loop = loop
+    return _query_loop
+
+
+def run_on_query_loop(coroutine):
+    """
+    Run a coroutine on the query loop and wait for its result. For synchronous
+    callers only: async code should await the coroutine directly.
+    """
+    return asyncio.run_coroutine_threadsafe(coroutine, get_query_loop()).result()
 
-# Initialize Supabase client
-supabase_url = os.getenv('SUPABASE_HOST_URL')
-supabase_key = os.getenv('SUPABASE_API_SECRET')
-supabase_client = create_client(supabase_url, supabase_key) 
 
 def get_new_supabase_client():
-    return create_client(supabase_url, supabase_key)
\ No newline at end of file
+    """A fresh Supabase client, e.g. for per-user auth sessions"""
+    from supabase import create_client
+    return create_client(settings.SUPABASE_URL, settings.SUPABASE_KEY)
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+from rest_app.services.archive_service import ArchiveService, ARCHIVE_AFTER_DAYS
+
+
+class Command(BaseCommand):
+    help = "Move conversations without recent activity into compressed snapshots. Safe to rerun."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=ARCHIVE_AFTER_DAYS,
+                            help="Archive conversations inactive for this many days")
+        parser.add_argument('--user', help="Only archive this Supabase user's conversations")
+        parser.add_argument('--dry-run', action='store_true', help="Only list the conversations that would be archived")
+
+    def handle(self, *args, **options):
+        def progress(conversation, result):
+            if result.get('dry_run'):
+                self.stdout.write(f"[would archive] {conversation['id']} {conversation.get('title', '')}")
+            elif result['success']:
+                self.stdout.write(f"[archived] {conversation['id']}: {result['prompts']} prompts, {result['files']} files")
+            else:
+                self.stdout.write(f"[failed] {conversation['id']}: {result.get('error')}")
+
+        result = ArchiveService.archive_inactive(
+            days=options['days'], user_id=options['user'], dry_run=options['dry_run'], progress=progress
+        )
+        if result['failed']:
+            raise CommandError(f"{result['failed']} conversation(s) could not be archived, rerun the command to retry")
+        self.stdout.write(self.style.SUCCESS(f"Archived {result['archived']} conversation(s)"))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+from rest_app.services.usage_service import UsageService
+
+
+class Command(BaseCommand):
+    help = "Rebuild the usage counters (usage_daily, usage_totals) from the prompts and files tables. Safe to rerun."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help="Only rebuild this Supabase user's counters")
+        parser.add_argument('--sizes', action='store_true',
+                            help="First fill in missing file sizes from the Cloudinary listing (Admin API calls)")
+
+    def handle(self, *args, **options):
+        user_ids = [options['user']] if options['user'] else UsageService.iter_user_ids()
+
+        rebuilt, failed = 0, 0
+        for user_id in user_ids:
+            if options['sizes']:
+                try:
+                    sized = UsageService.backfill_sizes(user_id)
+                except RuntimeError as e:
+                    raise CommandError(str(e))
+                self.stdout.write(f"[sizes] {user_id}: {sized} file size(s) filled in")
+            if UsageService.recompute(user_id):
+                rebuilt += 1
+            else:
+                failed += 1
+                self.stderr.write(f"Could not rebuild the usage of {user_id}")
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt the usage of {rebuilt} user(s) ({failed} failed)"))
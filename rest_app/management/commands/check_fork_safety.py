@@ -0,0 +1,35 @@
+import os
+from django.core.management.base import BaseCommand, CommandError
+from rest_app.config import supabase_config
+from rest_app.config.supabase_config import get_supabase_client
+from rest_app.services.scheduler_service import ai_scheduler
+
+
+class Command(BaseCommand):
+    help = "Check that a forked worker gets its own clients and scheduler state (preload deployments)."
+
+    def handle(self, *args, **options):
+        if not hasattr(os, 'fork'):
+            raise CommandError("os.fork is not available on this platform")
+
+        # Build the shared state in the parent, as a preloading master might
+        parent_client = get_supabase_client()
+        parent_condition = ai_scheduler._condition
+
+        pid = os.fork()
+        if pid == 0:
+            failures = []
+            if supabase_config._client is not None:
+                failures.append("the inherited Supabase client was not reset")
+            if get_supabase_client() is parent_client:
+                failures.append("the worker reuses the parent's Supabase client")
+            if ai_scheduler._condition is parent_condition:
+                failures.append("the worker shares the parent's scheduler lock")
+            for failure in failures:
+                os.write(2, f"{failure}\n".encode())
+            os._exit(1 if failures else 0)
+
+        _, status = os.waitpid(pid, 0)
+        if os.waitstatus_to_exitcode(status) != 0:
+            raise CommandError("Forked worker is not isolated from the parent, see the messages above")
+        self.stdout.write(self.style.SUCCESS("Forked workers get their own clients and scheduler state"))
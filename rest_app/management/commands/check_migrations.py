@@ -0,0 +1,49 @@
+import psycopg2
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from rest_app.models import Account
+from rest_app.utils import migrate_to_supabase as migrator
+
+
+class Command(BaseCommand):
+    help = (
+        "Apply the Supabase migrations twice to a scratch Postgres database and check that the schema "
+        "matches the models. The database is modified: never point this at a real one."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('db_url', help="Connection string of a disposable Postgres database")
+
+    def handle(self, *args, **options):
+        db_url = options['db_url']
+        if settings.SUPABASE_DB_URL and db_url == settings.SUPABASE_DB_URL:
+            raise CommandError("Refusing to run against SUPABASE_DB_URL, pass a scratch database")
+
+        connection = psycopg2.connect(db_url)
+        try:
+            # Supabase manages the accounts table, a bare one stands in for it
+            with connection, connection.cursor() as cursor:
+                cursor.execute(f"CREATE TABLE IF NOT EXISTS {migrator.get_table_name(Account)} (id uuid PRIMARY KEY);")
+
+            # The second run must find nothing left to do and must not fail on what the first created
+            for run in (1, 2):
+                if not migrator.migrate_all_models(db_url=db_url):
+                    raise CommandError(f"Migration run {run} failed, see supabase_migration.log")
+
+            with connection, connection.cursor() as cursor:
+                problems = migrator.find_schema_drift(cursor, migrator.MODELS_TO_MIGRATE)
+                for model in migrator.MODELS_TO_MIGRATE:
+                    for statement in migrator.plan_table_changes(cursor, model):
+                        # Index statements are always planned, guarded by IF NOT EXISTS
+                        if not statement.startswith("CREATE INDEX IF NOT EXISTS"):
+                            problems.append(f"still planned after migrating: {statement}")
+        finally:
+            connection.close()
+
+        for problem in problems:
+            self.stderr.write(problem)
+        if problems:
+            raise CommandError(f"Schema does not match the models ({len(problems)} problems)")
+        self.stdout.write(self.style.SUCCESS(
+            f"Migrations applied cleanly to {len(migrator.MODELS_TO_MIGRATE)} tables and {len(migrator.RPC_FUNCTIONS)} functions"
+        ))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from rest_app.services.similarity_service import ImageSimilarityService, HASH_BATCH_SIZE, HASH_WORKERS
+
+
+class Command(BaseCommand):
+    help = "Compute perceptual hashes (pHash/dHash) of output images that have none yet. Safe to rerun."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help="Only hash this Supabase user's images")
+        parser.add_argument('--batch-size', type=int, default=HASH_BATCH_SIZE)
+        parser.add_argument('--workers', type=int, default=HASH_WORKERS)
+        parser.add_argument('--duplicates', action='store_true',
+                            help="Afterwards, list the groups of near-duplicate images of --user")
+
+    def handle(self, *args, **options):
+        def progress(hashed, failed):
+            self.stdout.write(f"[hashes] {hashed} hashed, {failed} failed")
+
+        result = ImageSimilarityService.hash_pending(
+            user_id=options['user'],
+            batch_size=options['batch_size'],
+            max_workers=options['workers'],
+            progress=progress,
+        )
+        self.stdout.write(self.style.SUCCESS(f"Hashed {result['hashed']} images ({result['failed']} failed)"))
+
+        if options['duplicates'] and options['user']:
+            groups = ImageSimilarityService.find_near_duplicates(options['user'])
+            for group in groups:
+                self.stdout.write("Near duplicates: " + ", ".join(str(file_id) for file_id in group))
+            self.stdout.write(f"{len(groups)} group(s) of near duplicates")
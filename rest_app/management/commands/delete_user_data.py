@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+from rest_app.services.deletion_service import BulkDeletionService, DELETION_WORKERS
+
+
+class Command(BaseCommand):
+    help = "Delete a user's (or a single conversation's) files, Cloudinary assets and rows. Safe to rerun."
+
+    def add_arguments(self, parser):
+        parser.add_argument('user_id', help="Supabase user id whose data is deleted")
+        parser.add_argument('--conversation', type=int, help="Only delete this conversation")
+        parser.add_argument('--workers', type=int, default=DELETION_WORKERS)
+
+    def handle(self, *args, **options):
+        def progress(stage, done, total):
+            suffix = f"/{total}" if total is not None else ""
+            self.stdout.write(f"[{stage}] {done}{suffix}")
+
+        if options['conversation']:
+            result = BulkDeletionService.delete_conversation(
+                options['user_id'], options['conversation'], progress=progress, max_workers=options['workers']
+            )
+        else:
+            result = BulkDeletionService.delete_user_data(
+                options['user_id'], progress=progress, max_workers=options['workers']
+            )
+
+        if not result.get('success'):
+            raise CommandError(
+                f"Deletion incomplete ({result.get('error') or str(result.get('failed', 0)) + ' files failed'}), "
+                "rerun the command to resume"
+            )
+        self.stdout.write(self.style.SUCCESS(f"Deleted {result['deleted']} files"))
@@ -0,0 +1,39 @@
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from rest_app.services.export_service import SupabaseExportService, EXPORT_PAGE_SIZE
+
+
+class Command(BaseCommand):
+    help = "Stream a user's conversations, prompts and file metadata as JSONL (or Parquet)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('user_id', help="Supabase user id to export")
+        parser.add_argument('--format', choices=['jsonl', 'parquet'], default='jsonl')
+        parser.add_argument(
+            '--output',
+            help="JSONL: output file (defaults to stdout). Parquet: output directory (required)",
+        )
+        parser.add_argument('--page-size', type=int, default=EXPORT_PAGE_SIZE)
+
+    def handle(self, *args, **options):
+        user_id = options['user_id']
+        page_size = options['page_size']
+
+        if options['format'] == 'parquet':
+            if not options['output']:
+                raise CommandError("--output directory is required for Parquet exports")
+            try:
+                counts = SupabaseExportService.write_parquet(user_id, options['output'], page_size=page_size)
+            except ImportError:
+                raise CommandError("Parquet export requires pyarrow (pip install pyarrow)")
+            for record_type, count in counts.items():
+                self.stderr.write(f"{count} {record_type} rows written")
+            return
+
+        out = open(options['output'], 'w', encoding='utf-8') if options['output'] else sys.stdout
+        try:
+            for line in SupabaseExportService.iter_jsonl(user_id, page_size=page_size):
+                out.write(line)
+        finally:
+            if out is not sys.stdout:
+                out.close()
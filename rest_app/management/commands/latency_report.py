@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+from rest_app.services.latency_service import LatencyService, LATENCY_DAYS, REPORT_BUCKETS
+
+
+class Command(BaseCommand):
+    help = "Show p50/p95 AI latencies per step_type over time (service-reported and measured from dispatch)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=LATENCY_DAYS, help="Report on prompts of the last N days")
+        parser.add_argument('--bucket', choices=REPORT_BUCKETS, default='day', help="Time bucket of each row")
+        parser.add_argument('--step-type', help="Only show this step_type (e.g. inpainting, total)")
+
+    def handle(self, *args, **options):
+        rows = LatencyService.report(days=options['days'], bucket=options['bucket'])
+        if rows is None:
+            raise CommandError("The latency report could not be computed")
+        if options['step_type']:
+            rows = [row for row in rows if row['step_type'] == options['step_type']]
+
+        def ms(value):
+            return f"{value:.0f}" if value is not None else "-"
+
+        self.stdout.write(
+            f"{'bucket':<26} {'step_type':<20} {'samples':>8} "
+            f"{'svc p50':>9} {'svc p95':>9} {'e2e p50':>9} {'e2e p95':>9}"
+        )
+        for row in rows:
+            self.stdout.write(
+                f"{str(row['bucket']):<26} {row['step_type'] or '-':<20} {row['samples']:>8} "
+                f"{ms(row['service_p50_ms']):>9} {ms(row['service_p95_ms']):>9} "
+                f"{ms(row['client_p50_ms']):>9} {ms(row['client_p95_ms']):>9}"
+            )
+        self.stdout.write(self.style.SUCCESS(f"{len(rows)} row(s)"))
@@ -2,8 +2,8 @@ from django.shortcuts import redirect
 from django.urls import reverse
 from django.conf import settings
 from django.contrib.auth import login, logout
-from rest_app.config.supabase_config import supabase_client
 from rest_app.models import Account
+from rest_app.models.loader import request_scope
 from rest_app.services.auth_service import SupabaseAuthService
 
 import logging
@@ -15,7 +15,8 @@ class SupabaseAuthMiddleware:
     def __init__(self, get_response):
         self.get_response = get_response
         # Paths that don't require authentication
-        self.public_paths = ['/login/', '/register/']
+        # (AI callbacks authenticate with their HMAC signature instead of a session)
+        self.public_paths = ['/login/', '/register/', '/ai/callback/']
         
     def __call__(self, request):
         # Don't check authentication for public paths
@@ -34,4 +35,17 @@ class SupabaseAuthMiddleware:
             
         # Process the request and return the response
         response = self.get_response(request)
-        return response
\ No newline at end of file
+        return response
+
+
+class RequestLoaderMiddleware:
+    """
+    Give each request its own identity map and batched loader for model reads
+    (rest_app/models/loader.py), dropped when the response is returned
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with request_scope():
+            return self.get_response(request)
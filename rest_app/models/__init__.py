@@ -1,4 +1,6 @@
 from .user_model import Account
 from .file_model import CloudinaryFile
 from .conversation_model import Conversation 
-from .prompt_model import Prompt 
\ No newline at end of file
+from .prompt_model import Prompt
+from .archive_model import ConversationArchive
+from .usage_model import UsageDaily, UsageTotals
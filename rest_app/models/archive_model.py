@@ -0,0 +1,23 @@
+# models/archive_model.py
+from django.db import models
+from .user_model import Account
+from .conversation_model import Conversation
+from .model import SupabaseModelMixin
+
+class ConversationArchive(models.Model, SupabaseModelMixin):
+    table_name = 'conversation_archives'
+
+    user = models.ForeignKey(Account, on_delete=models.CASCADE, related_name='conversation_archives')
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='archives')
+    # base64 of the zlib-compressed JSON {"prompts": [...], "files": [...]} (see ArchiveService)
+    snapshot = models.TextField()
+    prompt_count = models.IntegerField(default=0)
+    file_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=False)
+
+    class Meta:
+        # Rehydration: select_by_fields({'conversation_id': ...})
+        indexes = [models.Index(fields=['conversation'], name='archives_conversation_idx')]
+
+    def __str__(self):
+        return f"Archive of conversation {self.conversation_id}"
@@ -10,6 +10,14 @@ class Conversation(models.Model, SupabaseModelMixin):
     user = models.ForeignKey(Account, on_delete=models.CASCADE, related_name='conversations')
     title = models.CharField(max_length=255)
     created_at = models.DateTimeField(auto_now_add=False)
+    # Archived conversations keep only this row; prompts and files live in a ConversationArchive
+    is_archived = models.BooleanField(default=False)
+    # Last time the conversation was restored from its archive, counts as activity
+    restored_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        # Sidebar listing: select_by_fields({'user_id': ...}, order_by='created_at')
+        indexes = [models.Index(fields=['user', 'created_at'], name='conversations_user_created_idx')]
 
     def __str__(self):
         return self.title
\ No newline at end of file
@@ -18,6 +18,19 @@ class CloudinaryFile(models.Model, SupabaseModelMixin):
     
     step_type = models.CharField(max_length=50, blank=True, null=True)  # e.g., object_detection, segmentation, inpainting
     step_index = models.IntegerField(default=0)
+    reasoning_info = models.TextField(blank=True, null=True)  # JSON-encoded reasoning from the AI step
+    # 64-bit perceptual hashes of output images as 16 hex digits (see utils/image_hash.py)
+    phash = models.CharField(max_length=16, blank=True, null=True)
+    dhash = models.CharField(max_length=16, blank=True, null=True)
+    # Asset size as reported by Cloudinary (upload result or AI step), for storage usage
+    bytes = models.BigIntegerField(blank=True, null=True)
+    # AI step timing: duration reported by the AI service, and time from dispatch until we received the step
+    duration_ms = models.IntegerField(blank=True, null=True)
+    elapsed_ms = models.IntegerField(blank=True, null=True)
+
+    class Meta:
+        # Conversation page: select_by_field_in_list('prompt_id', prompt_ids)
+        indexes = [models.Index(fields=['prompt'], name='files_prompt_idx')]
 
     def __str__(self):
         return self.filename
\ No newline at end of file
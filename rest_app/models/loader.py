@@ -0,0 +1,226 @@
+"""
+Request-scoped identity map and batched loader for SupabaseModelMixin reads.
+
+While a RequestLoader is active (RequestLoaderMiddleware, or request_scope()),
+the mixin's reads go through it:
+
+- select_by_id / select_many_by_id serve rows already fetched during the
+  request (by any read of the table) from an identity map, and only query
+  the ids still missing, in a single IN query.
+- aselect_by_id calls made in the same event loop tick (e.g. from
+  gather_queries) are coalesced into one IN query per table, DataLoader
+  style.
+- select_by_fields / aselect_by_fields results are remembered per
+  arguments, so identical queries run once, even when they are awaited
+  concurrently. Failed reads are not remembered.
+
+Every write through the mixin forgets what the loader knows about its
+table (deletes forget everything, they may cascade). Writes made outside
+the mixin (SQL functions) are not seen. Callers always get copies of the
+rows, so mutating a result never leaks into another.
+
+The loader lives in a context variable: request threads do not share it,
+background threads start without one, and tasks run on the query loop on
+behalf of a request inherit it.
+"""
+import asyncio
+import contextvars
+from contextlib import contextmanager
+
+_current = contextvars.ContextVar('request_loader', default=None)
+
+
+def get_loader():
+    """The RequestLoader of the current context, or None"""
+    return _current.get()
+
+
+@contextmanager
+def request_scope():
+    """Activate a fresh RequestLoader for the duration of the block"""
+    token = _current.set(RequestLoader())
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def bypass():
+    """Run reads straight against Supabase, e.g. the loader's own fetches"""
+    token = _current.set(None)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def _copy(value):
+    if isinstance(value, list):
+        return [dict(row) for row in value]
+    if isinstance(value, dict):
+        return dict(value)
+    return value
+
+
+def _hashable(value):
+    return tuple(value) if isinstance(value, list) else value
+
+
+def _frozen(mapping):
+    # Values keep their type: a filter on 1 and one on "1" are different queries
+    return tuple(sorted((key, _hashable(value)) for key, value in mapping.items())) if mapping else ()
+
+
+def query_key(*args, **options):
+    """Hashable key of a read's arguments"""
+    return args + tuple(
+        (name, _frozen(value) if isinstance(value, dict) else _hashable(value))
+        for name, value in sorted(options.items())
+    )
+
+
+class RequestLoader:
+    def __init__(self):
+        # table -> {str(id): row}
+        self._rows = {}
+        # table -> {query key: result}
+        self._queries = {}
+        # (loop, table) -> {str(id): future}, the batch collected during the current tick
+        self._batches = {}
+        # (loop, table) -> {query key: task}, aquery fetches still running
+        self._inflight = {}
+        self._tasks = set()
+
+    def _remember(self, table, rows):
+        by_id = self._rows.setdefault(table, {})
+        for row in rows if isinstance(rows, list) else [rows]:
+            if isinstance(row, dict) and 'id' in row:
+                by_id[str(row['id'])] = row
+
+    def invalidate(self, table=None):
+        """Forget the rows and query results of a table, or of every table"""
+        if table is None:
+            self._rows.clear()
+            self._queries.clear()
+            self._inflight.clear()
+        else:
+            self._rows.pop(table, None)
+            self._queries.pop(table, None)
+            for loop_table in [loop_table for loop_table in self._inflight if loop_table[1] == table]:
+                del self._inflight[loop_table]
+
+    def query(self, table, key, fetch, raise_errors=False):
+        """
+        Result of fetch(), run once per key during the request. fetch() must
+        raise on errors: a failure is not remembered, the caller gets an empty
+        list (or the error with raise_errors), like the mixin's own reads.
+        """
+        queries = self._queries.setdefault(table, {})
+        if key not in queries:
+            try:
+                with bypass():
+                    result = fetch()
+            except Exception:
+                if raise_errors:
+                    raise
+                return []
+            queries[key] = result
+            self._remember(table, result)
+        return _copy(queries[key])
+
+    async def aquery(self, table, key, fetch, raise_errors=False):
+        """query() for a coroutine function. Callers of a key that is still being fetched share its task."""
+        queries = self._queries.setdefault(table, {})
+        if key in queries:
+            return _copy(queries[key])
+
+        loop = asyncio.get_running_loop()
+        inflight = self._inflight.setdefault((loop, table), {})
+        task = inflight.get(key)
+        if task is None:
+            async def run():
+                with bypass():
+                    return await fetch()
+
+            task = inflight[key] = loop.create_task(run())
+            task.add_done_callback(lambda done: self._settle(loop, table, key, done))
+
+        try:
+            result = await asyncio.shield(task)
+        except Exception:
+            if raise_errors:
+                raise
+            return []
+        return _copy(result)
+
+    def _settle(self, loop, table, key, task):
+        """Remember a finished aquery fetch, unless it failed or the table was invalidated meanwhile"""
+        inflight = self._inflight.get((loop, table), {})
+        if inflight.get(key) is not task:
+            return
+        del inflight[key]
+        if not task.cancelled() and task.exception() is None:
+            self._queries.setdefault(table, {})[key] = task.result()
+            self._remember(table, task.result())
+
+    def load(self, model, id_value):
+        """A row by id, fetched at most once per request"""
+        row = self._rows.get(model.table_name, {}).get(str(id_value))
+        if row is None:
+            with bypass():
+                row = model.select_by_id(id_value)
+            self._remember(model.table_name, row)
+        return _copy(row)
+
+    def load_many(self, model, ids):
+        """
+        Rows by id, the missing ones fetched in one IN query
+
+        Returns:
+            Dictionary of id (as given) to row, without the ids that do not exist
+        """
+        known = self._rows.setdefault(model.table_name, {})
+        missing = [id_value for id_value in dict.fromkeys(ids) if str(id_value) not in known]
+        if missing:
+            with bypass():
+                rows = model.select_by_field_in_list('id', missing)
+            self._remember(model.table_name, rows)
+        return {id_value: dict(known[str(id_value)]) for id_value in ids if str(id_value) in known}
+
+    async def aload(self, model, id_value):
+        """load() for async code: ids requested in the same loop tick share one IN query"""
+        table = model.table_name
+        row = self._rows.get(table, {}).get(str(id_value))
+        if row is not None:
+            return dict(row)
+
+        loop = asyncio.get_running_loop()
+        batch = self._batches.get((loop, table))
+        if batch is None:
+            batch = self._batches[(loop, table)] = {}
+            loop.call_soon(self._dispatch, loop, model)
+        if str(id_value) not in batch:
+            batch[str(id_value)] = loop.create_future()
+        return _copy(await asyncio.shield(batch[str(id_value)]))
+
+    def _dispatch(self, loop, model):
+        batch = self._batches.pop((loop, model.table_name))
+
+        async def fetch():
+            by_id = {}
+            try:
+                with bypass():
+                    rows = await model.aselect_by_field_in_list('id', list(batch))
+                self._remember(model.table_name, rows)
+                by_id = {str(row['id']): row for row in rows}
+            finally:
+                # Waiters always wake up; a failed read gives None, as aselect_by_id does
+                for id_value, future in batch.items():
+                    if not future.done():
+                        future.set_result(by_id.get(id_value))
+
+        task = loop.create_task(fetch())
+        # Keep a reference until done, the loop only holds weak ones
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
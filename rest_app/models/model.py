@@ -1,9 +1,20 @@
-from rest_app.config.supabase_config import supabase_client
+from django.conf import settings
+from rest_app.config.supabase_config import get_supabase_client, get_async_supabase_client, run_on_query_loop
+from rest_app.models.loader import get_loader, query_key
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import heapq
 import logging
-import uuid
 
 logger = logging.getLogger(__name__)
 
+# Values per IN filter: keeps request URLs well under PostgREST/proxy limits
+IN_LIST_CHUNK_SIZE = 100
+# Concurrent requests when an IN list spans several chunks
+IN_LIST_WORKERS = 4
+# Rows per request of the paging iterators (iter_by_fields, iter_pages_by_fields)
+DEFAULT_PAGE_SIZE = getattr(settings, 'SUPABASE_PAGE_SIZE', 1000)
+
 class SupabaseModelMixin:
     """
     Mixin that provides common Supabase database operations.
@@ -12,6 +23,16 @@ class SupabaseModelMixin:
     # Subclasses should override this with their Supabase table name
     table_name = None
 
+    @classmethod
+    def _invalidate_loader(cls, cascade=False):
+        """
+        Make the request loader (see loader.py) forget this table before a
+        write, or every table when the write may cascade
+        """
+        loader = get_loader()
+        if loader is not None:
+            loader.invalidate(None if cascade else cls.table_name)
+
     @classmethod
     def select_by_id(cls, id_value):
         """
@@ -25,9 +46,13 @@ class SupabaseModelMixin:
         """
         if not cls.table_name:
             raise ValueError(f"table_name not defined for {cls.__name__}")
+
+        loader = get_loader()
+        if loader is not None:
+            return loader.load(cls, id_value)
         
         try:
-            result = supabase_client.table(cls.table_name)\
+            result = get_supabase_client().table(cls.table_name)\
                 .select('*')\
                 .eq('id', id_value)\
                 .execute()
@@ -39,8 +64,34 @@ class SupabaseModelMixin:
             logger.error(f"Supabase select_by_id error in {cls.table_name}: {str(e)}")
             return None
 
+    @staticmethod
+    def _apply_select_options(query, fields=None, order_by=None, desc=False, limit=None, greater_than=None, is_null=None):
+        """Apply the filters, ordering and limit of select_by_fields to a select query"""
+        # Apply filters
+        if fields:
+            for field, value in fields.items():
+                query = query.eq(field, value)
+        
+        if greater_than:
+            for field, value in greater_than.items():
+                query = query.gt(field, value)
+        
+        if is_null:
+            for field in is_null:
+                query = query.is_(field, 'null')
+        
+        # Apply ordering
+        if order_by:
+            query = query.order(order_by, desc=desc)
+        
+        # Apply limit
+        if limit:
+            query = query.limit(limit)
+        return query
+
     @classmethod
-    def select_by_fields(cls, fields=None, order_by=None, desc=False, limit=None):
+    def select_by_fields(cls, fields=None, order_by=None, desc=False, limit=None, greater_than=None, is_null=None,
+                         raise_errors=False):
         """
         Retrieve records matching the specified fields
         
@@ -49,35 +100,117 @@ class SupabaseModelMixin:
             order_by: Field to order results by
             desc: Whether to order in descending order
             limit: Maximum number of records to return
+            greater_than: Dictionary of field names and exclusive lower bounds
+            is_null: List of field names that must be NULL
+            raise_errors: Re-raise Supabase errors instead of returning an empty list
             
         Returns:
             A list of dictionaries with the record data
         """
         if not cls.table_name:
             raise ValueError(f"table_name not defined for {cls.__name__}")
+
+        loader = get_loader()
+        if loader is not None:
+            key = query_key('select_by_fields', fields=fields, order_by=order_by, desc=desc, limit=limit,
+                            greater_than=greater_than, is_null=is_null)
+            return loader.query(cls.table_name, key, lambda: cls.select_by_fields(
+                fields=fields, order_by=order_by, desc=desc, limit=limit, greater_than=greater_than, is_null=is_null,
+                raise_errors=True
+            ), raise_errors=raise_errors)
         
         try:
-            query = supabase_client.table(cls.table_name).select('*')
-            
-            # Apply filters
-            if fields:
-                for field, value in fields.items():
-                    query = query.eq(field, value)
-            
-            # Apply ordering
-            if order_by:
-                query = query.order(order_by, desc=desc)
-            
-            # Apply limit
-            if limit:
-                query = query.limit(limit)
-            
+            query = cls._apply_select_options(
+                get_supabase_client().table(cls.table_name).select('*'),
+                fields=fields, order_by=order_by, desc=desc, limit=limit, greater_than=greater_than, is_null=is_null,
+            )
             result = query.execute()
             return result.data
         except Exception as e:
             logger.error(f"Supabase select_by_fields error in {cls.table_name}: {str(e)}")
+            if raise_errors:
+                raise
             return []
 
+    @classmethod
+    def iter_pages_by_fields(cls, fields=None, order_by='id', desc=False, page_size=None, greater_than=None, is_null=None):
+        """
+        Lazily retrieve records matching the specified fields, one page at a time.
+        Only a single page is ever held in memory and the first rows are
+        available before the last page is read.
+
+        Pages ordered by id are read by keyset (id after the last one seen), so
+        every page costs the same however deep the iteration goes, and rows
+        that are updated out of the filter or deleted meanwhile do not shift
+        the following pages. Other orderings use range reads.
+
+        Iteration only ends on an empty page: PostgREST silently truncates
+        responses to its max-rows setting, so a page shorter than page_size
+        does not mean the last one was reached.
+
+        Args:
+            fields: Dictionary of field names and values to filter by
+            order_by: Field to order results by (ties are broken by id)
+            desc: Whether to order in descending order
+            page_size: Number of records fetched per request (SUPABASE_PAGE_SIZE by default)
+            greater_than: Dictionary of field names and exclusive lower bounds
+            is_null: List of field names that must be NULL
+
+        Yields:
+            Lists of dictionaries with the record data
+
+        Raises:
+            The underlying Supabase error, so a partial result is never mistaken
+            for a complete one
+        """
+        if not cls.table_name:
+            raise ValueError(f"table_name not defined for {cls.__name__}")
+
+        page_size = page_size or DEFAULT_PAGE_SIZE
+        keyset = order_by == 'id'
+        offset, last_id = 0, None
+        while True:
+            try:
+                query = cls._apply_select_options(
+                    get_supabase_client().table(cls.table_name).select('*'),
+                    fields=fields, greater_than=greater_than, is_null=is_null,
+                )
+
+                # A stable ordering is required for pages not to overlap
+                query = query.order(order_by, desc=desc)
+                if keyset:
+                    if last_id is not None:
+                        query = query.lt('id', last_id) if desc else query.gt('id', last_id)
+                    result = query.limit(page_size).execute()
+                else:
+                    query = query.order('id', desc=desc)
+                    result = query.range(offset, offset + page_size - 1).execute()
+            except Exception as e:
+                logger.error(f"Supabase iter_pages_by_fields error in {cls.table_name}: {str(e)}")
+                raise
+
+            rows = result.data or []
+            if not rows:
+                return
+            yield rows
+            # Advance by what was actually returned, which may be capped below page_size
+            offset += len(rows)
+            last_id = rows[-1]['id']
+
+    @classmethod
+    def iter_by_fields(cls, fields=None, order_by='id', desc=False, page_size=None, greater_than=None, is_null=None):
+        """
+        Lazily retrieve records matching the specified fields, one record at a time.
+        See iter_pages_by_fields for the paging behaviour.
+
+        Yields:
+            Dictionaries with the record data
+        """
+        for page in cls.iter_pages_by_fields(
+            fields=fields, order_by=order_by, desc=desc, page_size=page_size, greater_than=greater_than, is_null=is_null
+        ):
+            yield from page
+
     @classmethod
     def insert(cls, data):
         """
@@ -91,9 +224,11 @@ class SupabaseModelMixin:
         """
         if not cls.table_name:
             raise ValueError(f"table_name not defined for {cls.__name__}")
+
+        cls._invalidate_loader()
         
         try:
-            result = supabase_client.table(cls.table_name)\
+            result = get_supabase_client().table(cls.table_name)\
                 .insert(data)\
                 .execute()
             
@@ -104,6 +239,35 @@ class SupabaseModelMixin:
             logger.error(f"Supabase insert error in {cls.table_name}: {str(e)}")
             return None
 
+    @classmethod
+    def insert_many(cls, data_list, upsert=False):
+        """
+        Insert several records in a single request
+        
+        Args:
+            data_list: List of dictionaries of field names and values to insert
+            upsert: Whether rows whose id already exists are updated instead
+            
+        Returns:
+            The list of inserted records, or None if the operation failed
+        """
+        if not cls.table_name:
+            raise ValueError(f"table_name not defined for {cls.__name__}")
+
+        cls._invalidate_loader()
+        
+        if not data_list:
+            return []
+        
+        try:
+            table = get_supabase_client().table(cls.table_name)
+            query = table.upsert(data_list) if upsert else table.insert(data_list)
+            result = query.execute()
+            return result.data or []
+        except Exception as e:
+            logger.error(f"Supabase insert_many error in {cls.table_name}: {str(e)}")
+            return None
+
     @classmethod
     def update_by_id(cls, id_value, data):
         """
@@ -118,10 +282,12 @@ class SupabaseModelMixin:
         """
         if not cls.table_name:
             raise ValueError(f"table_name not defined for {cls.__name__}")
+
+        cls._invalidate_loader()
         
         try:            
             # Try a different approach with filter - ensuring UUID comparison
-            result = supabase_client.table(cls.table_name) \
+            result = get_supabase_client().table(cls.table_name) \
                 .update(data) \
                 .eq('id', id_value) \
                 .execute()
@@ -133,6 +299,38 @@ class SupabaseModelMixin:
             logger.error(f"Supabase update_by_id error in {cls.table_name}: {str(e)}")
             return None
 
+    @classmethod
+    def update_by_fields(cls, fields, data):
+        """
+        Update every record matching the specified fields in a single request
+        
+        Args:
+            fields: Dictionary of field names and values to filter by
+            data: Dictionary of field names and values to update
+            
+        Returns:
+            A list of the updated records, or None if the operation failed
+        """
+        if not cls.table_name:
+            raise ValueError(f"table_name not defined for {cls.__name__}")
+
+        cls._invalidate_loader()
+        
+        # Never issue an unfiltered update
+        if not fields:
+            raise ValueError("update_by_fields requires at least one filter")
+        
+        try:
+            query = get_supabase_client().table(cls.table_name).update(data)
+            for field, value in fields.items():
+                query = query.eq(field, value)
+            
+            result = query.execute()
+            return result.data or []
+        except Exception as e:
+            logger.error(f"Supabase update_by_fields error in {cls.table_name}: {str(e)}")
+            return None
+
     @classmethod
     def delete_by_id(cls, id_value):
         """
@@ -146,9 +344,11 @@ class SupabaseModelMixin:
         """
         if not cls.table_name:
             raise ValueError(f"table_name not defined for {cls.__name__}")
+
+        cls._invalidate_loader(cascade=True)
         
         try:
-            result = supabase_client.table(cls.table_name)\
+            result = get_supabase_client().table(cls.table_name)\
                 .delete()\
                 .eq('id', id_value)\
                 .execute()
@@ -159,33 +359,308 @@ class SupabaseModelMixin:
             return False 
     
     @classmethod
-    def select_by_field_in_list(cls, field_name, values, order_by=None, desc=False):
+    def delete_by_field_in_list(cls, field_name, values):
         """
-        Retrieve records where a specific field is in a list of values.
+        Delete every record where a specific field is in a list of values
         
         Args:
             field_name: Name of the field to apply the IN filter to
             values: List of values for the IN clause
+            
+        Returns:
+            The number of deleted records, or None if the operation failed
+        """
+        if not cls.table_name:
+            raise ValueError(f"table_name not defined for {cls.__name__}")
+
+        cls._invalidate_loader(cascade=True)
+        
+        # Never issue an unfiltered delete
+        if not values:
+            return 0
+        
+        try:
+            result = get_supabase_client().table(cls.table_name)\
+                .delete()\
+                .in_(field_name, values)\
+                .execute()
+            
+            return len(result.data or [])
+        except Exception as e:
+            logger.error(f"Supabase delete_by_field_in_list error in {cls.table_name}: {str(e)}")
+            return None
+
+    @classmethod
+    def select_by_field_in_list(cls, field_name, values, order_by=None, desc=False, raise_errors=False):
+        """
+        Retrieve records where a specific field is in a list of values.
+
+        Long lists are split into IN filters of IN_LIST_CHUNK_SIZE values,
+        fetched concurrently and merged back: by order_by when given (as the
+        database orders it, NULLs last ascending and first descending),
+        otherwise chunk by chunk in the order of `values`.
+        
+        Args:
+            field_name: Name of the field to apply the IN filter to
+            values: List of values for the IN clause; an empty list matches nothing
             order_by: Optional field to order results
             desc: Descending order if True
+            raise_errors: Re-raise Supabase errors instead of returning an empty list,
+                for callers that must not mistake a failure for "no rows"
 
         Returns:
-            A list of matching records
+            A list of matching records (an empty list if any chunk failed)
         """
         if not cls.table_name:
             raise ValueError(f"table_name not defined for {cls.__name__}")
-        
-        try:
-            query = supabase_client.table(cls.table_name).select('*')
 
-            if values:
-                query = query.in_(field_name, values)
+        loader = get_loader()
+        if loader is not None:
+            if field_name == 'id' and not order_by and not raise_errors:
+                return list(loader.load_many(cls, values or []).values())
+            key = query_key('select_by_field_in_list', field_name, tuple(values or ()), order_by=order_by, desc=desc)
+            return loader.query(cls.table_name, key, lambda: cls.select_by_field_in_list(
+                field_name, values, order_by=order_by, desc=desc, raise_errors=True
+            ), raise_errors=raise_errors)
+
+        # An IN filter on nothing matches nothing, never the whole table
+        values = list(dict.fromkeys(values or []))
+        if not values:
+            return []
+        chunks = [values[i:i + IN_LIST_CHUNK_SIZE] for i in range(0, len(values), IN_LIST_CHUNK_SIZE)]
 
+        def fetch(chunk):
+            query = get_supabase_client().table(cls.table_name).select('*').in_(field_name, chunk)
             if order_by:
                 query = query.order(order_by, desc=desc)
-            
-            result = query.execute()
-            return result.data
+            return query.execute().data or []
+
+        try:
+            if len(chunks) == 1:
+                return fetch(chunks[0])
+            with ThreadPoolExecutor(max_workers=min(IN_LIST_WORKERS, len(chunks))) as executor:
+                pages = list(executor.map(fetch, chunks))
+            if not order_by:
+                return [row for page in pages for row in page]
+            # Each page is already sorted: NULLs sort after values, flipped with desc like in Postgres
+            return list(heapq.merge(
+                *pages, key=lambda row: (row.get(order_by) is None, row.get(order_by)), reverse=desc
+            ))
         except Exception as e:
             logger.error(f"Supabase select_by_field_in_list error in {cls.table_name}: {str(e)}")
-            return []
\ No newline at end of file
+            if raise_errors:
+                raise
+            return []
+
+    @classmethod
+    def select_many_by_id(cls, ids):
+        """
+        Retrieve several records by ID with a single IN query. Within a request,
+        records already loaded are not fetched again.
+
+        Args:
+            ids: List of IDs
+
+        Returns:
+            Dictionary of ID (as given) to record, without the IDs that do not exist
+        """
+        loader = get_loader()
+        if loader is not None:
+            return loader.load_many(cls, ids)
+        rows = {str(row['id']): row for row in cls.select_by_field_in_list('id', ids)}
+        return {id_value: rows[str(id_value)] for id_value in ids if str(id_value) in rows}
+
+    # Async twins of the methods above, with the same arguments, results and
+    # error handling. They run on the async client of the current event loop;
+    # await several of them with gather_queries() to overlap their round trips.
+
+    @classmethod
+    async def aselect_by_id(cls, id_value):
+        """Async select_by_id"""
+        if not cls.table_name:
+            raise ValueError(f"table_name not defined for {cls.__name__}")
+
+        loader = get_loader()
+        if loader is not None:
+            return await loader.aload(cls, id_value)
+
+        try:
+            client = await get_async_supabase_client()
+            result = await client.table(cls.table_name).select('*').eq('id', id_value).execute()
+            if result.data and len(result.data) > 0:
+                return result.data[0]
+            return None
+        except Exception as e:
+            logger.error(f"Supabase aselect_by_id error in {cls.table_name}: {str(e)}")
+            return None
+
+    @classmethod
+    async def aselect_by_fields(cls, fields=None, order_by=None, desc=False, limit=None, greater_than=None,
+                                is_null=None, raise_errors=False):
+        """
+        Async select_by_fields
+
+        Args:
+            raise_errors: Re-raise Supabase errors instead of returning an empty list
+        """
+        if not cls.table_name:
+            raise ValueError(f"table_name not defined for {cls.__name__}")
+
+        loader = get_loader()
+        if loader is not None:
+            key = query_key('select_by_fields', fields=fields, order_by=order_by, desc=desc, limit=limit,
+                            greater_than=greater_than, is_null=is_null)
+            return await loader.aquery(cls.table_name, key, lambda: cls.aselect_by_fields(
+                fields=fields, order_by=order_by, desc=desc, limit=limit, greater_than=greater_than,
+                is_null=is_null, raise_errors=True
+            ), raise_errors=raise_errors)
+
+        try:
+            client = await get_async_supabase_client()
+            query = cls._apply_select_options(
+                client.table(cls.table_name).select('*'),
+                fields=fields, order_by=order_by, desc=desc, limit=limit, greater_than=greater_than, is_null=is_null,
+            )
+            result = await query.execute()
+            return result.data
+        except Exception as e:
+            logger.error(f"Supabase aselect_by_fields error in {cls.table_name}: {str(e)}")
+            if raise_errors:
+                raise
+            return []
+
+    @classmethod
+    async def aselect_by_field_in_list(cls, field_name, values, order_by=None, desc=False, raise_errors=False):
+        """Async select_by_field_in_list, its chunks fetched concurrently on the event loop"""
+        if not cls.table_name:
+            raise ValueError(f"table_name not defined for {cls.__name__}")
+
+        loader = get_loader()
+        if loader is not None:
+            key = query_key('select_by_field_in_list', field_name, tuple(values or ()), order_by=order_by, desc=desc)
+            return await loader.aquery(cls.table_name, key, lambda: cls.aselect_by_field_in_list(
+                field_name, values, order_by=order_by, desc=desc, raise_errors=True
+            ), raise_errors=raise_errors)
+
+        values = list(dict.fromkeys(values or []))
+        if not values:
+            return []
+        chunks = [values[i:i + IN_LIST_CHUNK_SIZE] for i in range(0, len(values), IN_LIST_CHUNK_SIZE)]
+
+        async def fetch(client, chunk):
+            query = client.table(cls.table_name).select('*').in_(field_name, chunk)
+            if order_by:
+                query = query.order(order_by, desc=desc)
+            return (await query.execute()).data or []
+
+        try:
+            client = await get_async_supabase_client()
+            pages = await asyncio.gather(*(fetch(client, chunk) for chunk in chunks))
+            if not order_by:
+                return [row for page in pages for row in page]
+            return list(heapq.merge(
+                *pages, key=lambda row: (row.get(order_by) is None, row.get(order_by)), reverse=desc
+            ))
+        except Exception as e:
+            logger.error(f"Supabase aselect_by_field_in_list error in {cls.table_name}: {str(e)}")
+            if raise_errors:
+                raise
+            return []
+
+    @classmethod
+    async def ainsert(cls, data):
+        """Async insert"""
+        if not cls.table_name:
+            raise ValueError(f"table_name not defined for {cls.__name__}")
+
+        cls._invalidate_loader()
+
+        try:
+            client = await get_async_supabase_client()
+            result = await client.table(cls.table_name).insert(data).execute()
+            if result.data and len(result.data) > 0:
+                return result.data[0]
+            return None
+        except Exception as e:
+            logger.error(f"Supabase ainsert error in {cls.table_name}: {str(e)}")
+            return None
+
+    @classmethod
+    async def ainsert_many(cls, data_list, upsert=False):
+        """Async insert_many"""
+        if not cls.table_name:
+            raise ValueError(f"table_name not defined for {cls.__name__}")
+
+        cls._invalidate_loader()
+
+        if not data_list:
+            return []
+
+        try:
+            client = await get_async_supabase_client()
+            table = client.table(cls.table_name)
+            query = table.upsert(data_list) if upsert else table.insert(data_list)
+            result = await query.execute()
+            return result.data or []
+        except Exception as e:
+            logger.error(f"Supabase ainsert_many error in {cls.table_name}: {str(e)}")
+            return None
+
+    @classmethod
+    async def aupdate_by_id(cls, id_value, data):
+        """Async update_by_id"""
+        if not cls.table_name:
+            raise ValueError(f"table_name not defined for {cls.__name__}")
+
+        cls._invalidate_loader()
+
+        try:
+            client = await get_async_supabase_client()
+            result = await client.table(cls.table_name).update(data).eq('id', id_value).execute()
+            if result.data and len(result.data) > 0:
+                return result.data[0]
+            return None
+        except Exception as e:
+            logger.error(f"Supabase aupdate_by_id error in {cls.table_name}: {str(e)}")
+            return None
+
+    @classmethod
+    async def adelete_by_id(cls, id_value):
+        """Async delete_by_id"""
+        if not cls.table_name:
+            raise ValueError(f"table_name not defined for {cls.__name__}")
+
+        cls._invalidate_loader(cascade=True)
+
+        try:
+            client = await get_async_supabase_client()
+            result = await client.table(cls.table_name).delete().eq('id', id_value).execute()
+            return True if result.data else False
+        except Exception as e:
+            logger.error(f"Supabase adelete_by_id error in {cls.table_name}: {str(e)}")
+            return False
+
+
+async def gather_queries(*queries):
+    """
+    Await independent queries (coroutines of the async model methods)
+    concurrently: the total wait is that of the slowest one.
+
+    Returns:
+        List of the query results, in argument order
+    """
+    return list(await asyncio.gather(*queries))
+
+
+def run_queries(*queries):
+    """
+    gather_queries() for synchronous code such as views, run on the process'
+    query loop.
+
+    Example:
+        conversation, prompts = run_queries(
+            Conversation.aselect_by_id(conversation_id),
+            Prompt.aselect_by_fields(fields={'conversation_id': conversation_id}),
+        )
+    """
+    return run_on_query_loop(gather_queries(*queries))
@@ -5,12 +5,22 @@ from .model import SupabaseModelMixin
 
 class Prompt(models.Model, SupabaseModelMixin):
     table_name = 'prompts'
+    # Columns indexed for full-text search, most important first (see search_prompts)
+    search_fields = ['text', 'response']
 
     # id = models.UUIDField(primary_key=True)
     conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='prompts')
     text = models.TextField()
     response = models.TextField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=False)
+    # AI call timing: when it was sent, end-to-end time measured by us and total reported by the AI service
+    dispatched_at = models.DateTimeField(blank=True, null=True)
+    duration_ms = models.IntegerField(blank=True, null=True)
+    service_duration_ms = models.IntegerField(blank=True, null=True)
+
+    class Meta:
+        # Conversation page: select_by_fields({'conversation_id': ...}, order_by='created_at')
+        indexes = [models.Index(fields=['conversation', 'created_at'], name='prompts_conv_created_idx')]
 
     def __str__(self):
         return self.text[:30]
\ No newline at end of file
@@ -0,0 +1,39 @@
+# models/usage_model.py
+from django.db import models
+from .user_model import Account
+from .model import SupabaseModelMixin
+
+class UsageDaily(models.Model, SupabaseModelMixin):
+    """Per-user, per-day activity counters, maintained by the increment_usage SQL function"""
+    table_name = 'usage_daily'
+
+    user = models.ForeignKey(Account, on_delete=models.CASCADE, related_name='usage_days')
+    day = models.DateField()
+    prompts = models.IntegerField(default=0)
+    images = models.IntegerField(default=0)  # Final output images
+    steps = models.IntegerField(default=0)  # Intermediate step images
+    bytes_stored = models.BigIntegerField(default=0)  # Net bytes added that day (deletions are negative)
+
+    class Meta:
+        # Dashboard: select_by_fields({'user_id': ...}, greater_than={'day': ...}, order_by='day')
+        constraints = [models.UniqueConstraint(fields=['user', 'day'], name='usage_daily_user_day_key')]
+
+    def __str__(self):
+        return f"{self.user_id} {self.day}"
+
+class UsageTotals(models.Model, SupabaseModelMixin):
+    """Per-user lifetime counters, maintained by the increment_usage SQL function"""
+    table_name = 'usage_totals'
+
+    user = models.ForeignKey(Account, on_delete=models.CASCADE, related_name='usage_totals')
+    prompts = models.IntegerField(default=0)
+    images = models.IntegerField(default=0)
+    steps = models.IntegerField(default=0)
+    bytes_stored = models.BigIntegerField(default=0)  # Current storage used
+    updated_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['user'], name='usage_totals_user_key')]
+
+    def __str__(self):
+        return f"{self.user_id} totals"
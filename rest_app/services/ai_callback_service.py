@@ -0,0 +1,142 @@
+import hashlib
+import hmac
+import json
+import logging
+import time
+from django.conf import settings
+from django.urls import reverse
+from rest_app.models import Conversation, Prompt
+from rest_app.services.file_service import SupabaseFileService
+from rest_app.services.latency_service import LatencyService
+from rest_app.services.version_service import ContentVersionService
+
+logger = logging.getLogger(__name__)
+
+TIMESTAMP_HEADER = 'X-AI-Timestamp'
+SIGNATURE_HEADER = 'X-AI-Signature'
+# Callbacks signed longer ago than this are rejected (replay protection)
+MAX_CALLBACK_AGE = 300
+# Seconds after dispatch a callback-mode prompt without a final response is given up on
+CALLBACK_TIMEOUT = getattr(settings, 'AI_CALLBACK_TIMEOUT', 900)
+# Response stored for prompts the AI service never answered
+FAILED_RESPONSE = {"text_response": "The AI service could not process this prompt."}
+
+
+class AICallbackService:
+    """
+    Completion of AI runs through callbacks instead of a long-held HTTP request.
+
+    The payload sent to AI_INPAINT_API_URL carries a `callback_url`. The AI service
+    POSTs JSON bodies to it, either incrementally or once at the end:
+
+        {"steps": [...], "final_response": {...}, "done": true, "duration_ms": 8400}
+
+    Steps and the final payload may report their duration (`duration_ms`, see
+    LatencyService.reported_duration_ms).
+
+    with the headers
+        X-AI-Timestamp: <unix seconds>
+        X-AI-Signature: hex(HMAC-SHA256(AI_CALLBACK_SECRET, "<timestamp>.<prompt_id>." + body))
+
+    The prompt id of the callback URL is signed too, so a captured callback
+    cannot be replayed against another prompt. Prompts whose final callback
+    does not arrive within AI_CALLBACK_TIMEOUT are marked failed.
+    """
+
+    @staticmethod
+    def get_secret():
+        """Shared secret with the AI service; callbacks are disabled when unset"""
+        return settings.AI_CALLBACK_SECRET or ''
+
+    @staticmethod
+    def is_enabled():
+        return bool(AICallbackService.get_secret())
+
+    @staticmethod
+    def sign(body, timestamp, prompt_id):
+        """Signature of a callback body (bytes) for prompt_id, sent at timestamp"""
+        message = f"{timestamp}.{prompt_id}.".encode() + body
+        return hmac.new(AICallbackService.get_secret().encode(), message, hashlib.sha256).hexdigest()
+
+    @staticmethod
+    def verify(request, prompt_id):
+        """Whether a callback request for prompt_id is signed with the shared secret and recent"""
+        if not AICallbackService.is_enabled():
+            return False
+
+        timestamp = request.headers.get(TIMESTAMP_HEADER, '')
+        signature = request.headers.get(SIGNATURE_HEADER, '')
+        try:
+            if abs(time.time() - int(timestamp)) > MAX_CALLBACK_AGE:
+                return False
+        except ValueError:
+            return False
+
+        expected = AICallbackService.sign(request.body, timestamp, prompt_id)
+        return hmac.compare_digest(expected, signature)
+
+    @staticmethod
+    def build_callback_url(request, prompt_id):
+        return request.build_absolute_uri(reverse('ai_callback', kwargs={'prompt_id': prompt_id}))
+
+    @staticmethod
+    def expire_pending(prompts):
+        """
+        Mark failed the prompts (dictionaries, updated in place) dispatched more than
+        CALLBACK_TIMEOUT ago that still have no response. A late final callback
+        still overwrites the failure.
+
+        Returns:
+            Number of prompts marked failed
+        """
+        expired = 0
+        for prompt in prompts:
+            if prompt.get('response'):
+                continue
+            elapsed_ms = LatencyService.elapsed_since_ms(prompt.get('dispatched_at'))
+            if elapsed_ms is None or elapsed_ms < CALLBACK_TIMEOUT * 1000:
+                continue
+            response = json.dumps(FAILED_RESPONSE)
+            if Prompt.update_by_id(prompt['id'], {"response": response}):
+                prompt['response'] = response
+                expired += 1
+        return expired
+
+    @staticmethod
+    def handle(prompt_id, payload):
+        """
+        Persist the steps and final response delivered by a callback
+
+        Returns:
+            True if the prompt exists and the update was applied, False otherwise
+        """
+        prompt = Prompt.select_by_id(prompt_id)
+        if not prompt:
+            return False
+
+        # Ownership comes from our own records, never from the payload
+        conversation = Conversation.select_by_id(prompt['conversation_id'])
+        if not conversation:
+            return False
+        user_id = conversation['user_id']
+
+        # Time since the run was dispatched, from our own clock
+        elapsed_ms = LatencyService.elapsed_since_ms(prompt.get('dispatched_at'))
+
+        # Incremental deliveries continue numbering after the steps already stored
+        steps = payload.get('steps') or []
+        if steps:
+            SupabaseFileService.create_step_files(user_id, prompt_id, steps, elapsed_ms=elapsed_ms)
+
+        updates = {}
+        if 'final_response' in payload:
+            updates["response"] = json.dumps(payload.get("final_response") or "")
+        if payload.get('done'):
+            updates["duration_ms"] = elapsed_ms
+            updates["service_duration_ms"] = LatencyService.reported_duration_ms(payload)
+        if updates:
+            Prompt.update_by_id(prompt_id, updates)
+
+        ContentVersionService.bump_conversation(prompt['conversation_id'])
+
+        return True
@@ -0,0 +1,220 @@
+import base64
+import json
+import logging
+import zlib
+from datetime import datetime, timedelta, timezone
+from django.conf import settings
+from rest_app.models import Conversation, Prompt, CloudinaryFile, ConversationArchive
+from rest_app.services.version_service import ContentVersionService
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_AFTER_DAYS = getattr(settings, 'ARCHIVE_AFTER_DAYS', 90)
+SNAPSHOT_FORMAT = 1
+# Prompts read (and their ids deleted) per request, bounds the IN lists
+ARCHIVE_PAGE_SIZE = 200
+
+
+def parse_timestamp(value):
+    """Timezone-aware datetime of a Supabase timestamp string, or None"""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+class ArchiveService:
+    """
+    Cold storage of inactive conversations.
+
+    Archiving folds a conversation's prompts and file rows into a single
+    compressed ConversationArchive row and removes them from the hot tables;
+    the conversation row stays as the summary shown in the sidebar. Opening an
+    archived conversation restores its rows from the snapshot.
+
+    Both directions are safe to interrupt: the conversation is flagged as
+    archived before any hot row is deleted, and restoring upserts rows by id,
+    so a rerun restores whatever is missing.
+    """
+
+    @staticmethod
+    def encode_snapshot(prompts, files):
+        payload = json.dumps({'format': SNAPSHOT_FORMAT, 'prompts': prompts, 'files': files}, default=str)
+        return base64.b64encode(zlib.compress(payload.encode(), 9)).decode()
+
+    @staticmethod
+    def decode_snapshot(snapshot):
+        return json.loads(zlib.decompress(base64.b64decode(snapshot)))
+
+    @staticmethod
+    def last_activity(conversation):
+        """Latest of the conversation's creation, last prompt and last restore"""
+        latest = Prompt.select_by_fields(
+            fields={'conversation_id': conversation['id']}, order_by='created_at', desc=True, limit=1
+        )
+        timestamps = [
+            parse_timestamp(conversation.get('created_at')),
+            parse_timestamp(conversation.get('restored_at')),
+            parse_timestamp(latest[0].get('created_at')) if latest else None,
+        ]
+        return max((t for t in timestamps if t), default=None)
+
+    @staticmethod
+    def archive_conversation(conversation):
+        """
+        Move a conversation's prompts and files into a snapshot row
+
+        Returns:
+            Dictionary with success and the number of archived prompts and files
+        """
+        conversation_id = conversation['id']
+        prompts, files = [], []
+        # A failed read must abort: the rows it missed would be deleted with their prompts
+        try:
+            for page in Prompt.iter_pages_by_fields(
+                fields={'conversation_id': conversation_id}, order_by='created_at', page_size=ARCHIVE_PAGE_SIZE
+            ):
+                prompts.extend(page)
+                files.extend(CloudinaryFile.select_by_field_in_list(
+                    'prompt_id', [p['id'] for p in page], order_by='step_index', raise_errors=True
+                ))
+        except Exception as e:
+            return {'success': False, 'error': f"Could not read conversation: {str(e)}"}
+
+        # Leftovers of an interrupted run are replaced
+        if ConversationArchive.delete_by_field_in_list('conversation_id', [conversation_id]) is None:
+            return {'success': False, 'error': "Could not clear previous archive"}
+
+        archive = ConversationArchive.insert({
+            'user_id': conversation['user_id'],
+            'conversation_id': conversation_id,
+            'snapshot': ArchiveService.encode_snapshot(prompts, files),
+            'prompt_count': len(prompts),
+            'file_count': len(files),
+            'created_at': datetime.now(timezone.utc).isoformat(),
+        })
+        if not archive:
+            return {'success': False, 'error': "Could not store archive"}
+
+        # From here on the snapshot is authoritative
+        if not Conversation.update_by_id(conversation_id, {'is_archived': True}):
+            ConversationArchive.delete_by_id(archive['id'])
+            return {'success': False, 'error': "Could not flag conversation"}
+
+        # File rows cascade with their prompts. Only the snapshotted prompts are
+        # removed, and leftovers are harmless: restoring upserts over them.
+        prompt_ids = [p['id'] for p in prompts]
+        for i in range(0, len(prompt_ids), ARCHIVE_PAGE_SIZE):
+            if Prompt.delete_by_field_in_list('id', prompt_ids[i:i + ARCHIVE_PAGE_SIZE]) is None:
+                logger.warning(f"Archived conversation {conversation_id} still has hot prompt rows")
+                break
+
+        ContentVersionService.bump_user(conversation['user_id'])
+        ContentVersionService.bump_conversation(conversation_id)
+        ContentVersionService.bump_similarity(conversation['user_id'])
+        return {'success': True, 'prompts': len(prompts), 'files': len(files)}
+
+    @staticmethod
+    def restore_conversation(conversation):
+        """
+        Move an archived conversation's prompts and files back into the hot tables
+
+        Returns:
+            True if the conversation is hot again
+        """
+        conversation_id = conversation['id']
+        # A failed read must abort: the snapshot is deleted once the conversation is hot again
+        try:
+            archives = ConversationArchive.select_by_fields(
+                fields={'conversation_id': conversation_id}, order_by='id', desc=True, limit=1, raise_errors=True
+            )
+        except Exception:
+            return False
+        # Flagged archived without a snapshot: nothing to restore the rows from
+        if not archives:
+            logger.error(f"Archived conversation {conversation_id} has no archive row")
+            return False
+
+        snapshot = ArchiveService.decode_snapshot(archives[0]['snapshot'])
+        # Upserts: rows left behind by an interrupted archive run are simply overwritten
+        if Prompt.insert_many(snapshot['prompts'], upsert=True) is None:
+            return False
+        if CloudinaryFile.insert_many(snapshot['files'], upsert=True) is None:
+            return False
+
+        restored = Conversation.update_by_id(conversation_id, {
+            'is_archived': False,
+            'restored_at': datetime.now(timezone.utc).isoformat(),
+        })
+        if not restored:
+            return False
+
+        # Only once every row is back; a leftover snapshot is replaced by the next archive run
+        if ConversationArchive.delete_by_field_in_list('conversation_id', [conversation_id]) is None:
+            logger.warning(f"Restored conversation {conversation_id} still has its archive row")
+        ContentVersionService.bump_user(conversation['user_id'])
+        ContentVersionService.bump_conversation(conversation_id)
+        ContentVersionService.bump_similarity(conversation['user_id'])
+        conversation.update(restored)
+        return True
+
+    @staticmethod
+    def iter_archived_records(conversation):
+        """The archived (record_type, record) pairs of a conversation, without restoring it"""
+        archives = ConversationArchive.select_by_fields(
+            fields={'conversation_id': conversation['id']}, order_by='id', desc=True, limit=1, raise_errors=True
+        )
+        if not archives:
+            logger.warning(f"Archived conversation {conversation['id']} has no archive row")
+            return
+        snapshot = ArchiveService.decode_snapshot(archives[0]['snapshot'])
+        for prompt in snapshot['prompts']:
+            yield 'prompt', prompt
+        for file in snapshot['files']:
+            yield 'file', file
+
+    @staticmethod
+    def archive_inactive(days=ARCHIVE_AFTER_DAYS, user_id=None, dry_run=False, progress=None):
+        """
+        Archive every conversation without activity for `days` days
+
+        Args:
+            days: Inactivity threshold
+            user_id: Only archive this user's conversations
+            dry_run: Only count the conversations that would be archived
+            progress: Optional callback progress(conversation, result)
+
+        Returns:
+            Dictionary with the number of archived and failed conversations
+        """
+        cutoff = datetime.now(timezone.utc) - timedelta(days=days)
+        fields = {'is_archived': False}
+        if user_id:
+            fields['user_id'] = user_id
+
+        archived, failed = 0, 0
+        # Collected first: archiving updates the rows the pages are read from
+        candidates = [
+            c for c in Conversation.iter_by_fields(fields=fields)
+            if (parse_timestamp(c.get('created_at')) or cutoff) < cutoff
+        ]
+        for conversation in candidates:
+            activity = ArchiveService.last_activity(conversation)
+            if activity is None or activity >= cutoff:
+                continue
+            if dry_run:
+                result = {'success': True, 'dry_run': True}
+            else:
+                result = ArchiveService.archive_conversation(conversation)
+            if result['success']:
+                archived += 1
+            else:
+                failed += 1
+                logger.error(f"Archiving conversation {conversation['id']} failed: {result.get('error')}")
+            if progress:
+                progress(conversation, result)
+
+        return {'archived': archived, 'failed': failed}
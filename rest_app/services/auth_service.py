@@ -1,25 +1,19 @@
 from django.conf import settings
 from rest_app.models import Account
-from rest_app.config.supabase_config import supabase_client, get_new_supabase_client
+from rest_app.config.supabase_config import get_supabase_client, get_new_supabase_client
 import logging
 import jwt as pyjwt
 import time
-import os
-from dotenv import load_dotenv
-from supabase import create_client
 
 logger = logging.getLogger(__name__)
 
-load_dotenv()
-JWT_SECRET = os.getenv('SUPABASE_JWT_SECRET')
-
 class SupabaseAuthService:
     @staticmethod
     def sign_up(email, password):
         """Register a new user with Supabase"""
         try:
             # Register with Supabase
-            response = supabase_client.auth.sign_up({
+            response = get_supabase_client().auth.sign_up({
                 "email": email,
                 "password": password
             })
@@ -58,7 +52,7 @@ class SupabaseAuthService:
         """Sign in a user with Supabase"""
         try:
             # Sign in with Supabase
-            response = supabase_client.auth.sign_in_with_password({
+            response = get_supabase_client().auth.sign_in_with_password({
                 "email": email,
                 "password": password
             })
@@ -136,7 +130,7 @@ class SupabaseAuthService:
             # Decode token without verification to check expiration
             try:
                 # Use PyJWT correctly
-                decoded = pyjwt.decode(token, JWT_SECRET, options={"verify_signature": False})
+                decoded = pyjwt.decode(token, settings.SUPABASE_JWT_SECRET, options={"verify_signature": False})
                 exp = decoded.get('exp', 0)
                 
                 # If token is valid for more than 5 minutes
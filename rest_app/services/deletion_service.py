@@ -0,0 +1,187 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from rest_app.config.cloudinary_config import delete_files, delete_files_by_prefix, CLOUDINARY_FOLDER_NAME
+from rest_app.models import Conversation, Prompt, CloudinaryFile
+from rest_app.services.archive_service import ArchiveService
+from rest_app.services.usage_service import UsageService
+from rest_app.services.version_service import ContentVersionService
+
+logger = logging.getLogger(__name__)
+
+# Cloudinary's delete_resources accepts at most 100 public IDs per call
+CLOUDINARY_BATCH_SIZE = 100
+# Concurrent Admin API calls; kept small because the Admin API is rate limited
+DELETION_WORKERS = 4
+# Cloudinary statuses meaning the asset is gone
+DELETED_STATUSES = ('deleted', 'not_found')
+
+
+class BulkDeletionService:
+    """
+    Deletes Cloudinary assets and their `files` rows in batches.
+
+    Rows are only removed once Cloudinary confirms their asset is gone, so an
+    interrupted or partially failed run can simply be started again: it picks
+    up whatever rows are left.
+
+    `progress`, when given, is called as progress(stage, done, total) where total
+    may be None when it is not known up front.
+    """
+
+    @staticmethod
+    def delete_files(files, progress=None, max_workers=DELETION_WORKERS):
+        """
+        Delete the assets of the given file rows, then the rows themselves
+
+        Args:
+            files: List of `files` rows
+            progress: Optional progress callback
+            max_workers: Maximum number of concurrent Cloudinary calls
+
+        Returns:
+            Dictionary with the number of deleted and failed files
+        """
+        total = len(files)
+        deleted, failed = 0, 0
+        deleted_files = []
+
+        # Rows without an asset only need their record removed
+        batches = []
+        orphan_ids = [f['id'] for f in files if not f.get('public_id')]
+        by_resource_type = {}
+        for file in files:
+            if file.get('public_id'):
+                by_resource_type.setdefault(file.get('resource_type') or 'image', []).append(file)
+        for resource_type, typed_files in by_resource_type.items():
+            for i in range(0, len(typed_files), CLOUDINARY_BATCH_SIZE):
+                batches.append((resource_type, typed_files[i:i + CLOUDINARY_BATCH_SIZE]))
+
+        if orphan_ids:
+            if CloudinaryFile.delete_by_field_in_list('id', orphan_ids) is None:
+                failed += len(orphan_ids)
+            else:
+                deleted += len(orphan_ids)
+                deleted_files.extend(f for f in files if not f.get('public_id'))
+            if progress:
+                progress('files', deleted + failed, total)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(delete_files, [f['public_id'] for f in batch], resource_type): batch
+                for resource_type, batch in batches
+            }
+            for future in as_completed(futures):
+                batch = futures[future]
+                result = future.result()
+                if result['success']:
+                    statuses = result['deleted']
+                    done_ids = [f['id'] for f in batch if statuses.get(f['public_id']) in DELETED_STATUSES]
+                else:
+                    logger.error(f"Cloudinary batch deletion error: {result['error']}")
+                    done_ids = []
+
+                # Remove only the rows whose asset is confirmed gone
+                if done_ids and CloudinaryFile.delete_by_field_in_list('id', done_ids) is None:
+                    done_ids = []
+                deleted += len(done_ids)
+                failed += len(batch) - len(done_ids)
+                deleted_files.extend(f for f in batch if f['id'] in done_ids)
+
+                if progress:
+                    progress('files', deleted + failed, total)
+
+        # Pages showing these files must be rendered again
+        if deleted:
+            for user_id in {f.get('user_id') for f in files}:
+                ContentVersionService.bump_user(user_id)
+                ContentVersionService.bump_similarity(user_id)
+                UsageService.record_files(user_id, [f for f in deleted_files if f.get('user_id') == user_id], sign=-1)
+
+        logger.info(f"Bulk file deletion finished: {deleted} deleted, {failed} failed")
+        return {'deleted': deleted, 'failed': failed}
+
+    @staticmethod
+    def delete_conversation(user_id, conversation_id, progress=None, max_workers=DELETION_WORKERS):
+        """
+        Delete a conversation with all its prompts, files and Cloudinary assets
+
+        Returns:
+            Dictionary with the deletion counts and whether the conversation row was removed
+        """
+        conversation = Conversation.select_by_id(conversation_id)
+        if not conversation or conversation.get('user_id') != user_id:
+            return {'success': False, 'error': "Conversation not found"}
+
+        # Archived file rows must be back in the hot table for their assets to be found
+        if conversation.get('is_archived') and not ArchiveService.restore_conversation(conversation):
+            return {'success': False, 'error': "Could not restore the archived conversation"}
+
+        # A failed read must abort: the assets it missed would be orphaned by the cascade
+        try:
+            prompt_ids = [p['id'] for p in Prompt.iter_by_fields(fields={'conversation_id': conversation_id})]
+            files = CloudinaryFile.select_by_field_in_list('prompt_id', prompt_ids, raise_errors=True)
+        except Exception as e:
+            return {'success': False, 'error': f"Could not read conversation: {str(e)}"}
+        result = BulkDeletionService.delete_files(files, progress=progress, max_workers=max_workers)
+
+        # Keep the conversation while assets remain so a rerun can find them
+        if result['failed']:
+            return {'success': False, **result}
+
+        # Prompts cascade with the conversation
+        success = Conversation.delete_by_id(conversation_id)
+        ContentVersionService.bump_user(user_id)
+        return {'success': success, **result}
+
+    @staticmethod
+    def delete_user_data(user_id, progress=None, max_workers=DELETION_WORKERS, page_size=1000):
+        """
+        Delete every conversation, prompt, file row and Cloudinary asset of a user.
+        The Supabase account itself is left untouched.
+
+        Returns:
+            Dictionary with the deletion counts
+        """
+        deleted, failed = 0, 0
+
+        # Keyset pages: rows that failed stay behind the cursor instead of being read and counted again
+        try:
+            for files in CloudinaryFile.iter_pages_by_fields(fields={'user_id': user_id}, page_size=page_size):
+                result = BulkDeletionService.delete_files(files, max_workers=max_workers)
+                deleted += result['deleted']
+                failed += result['failed']
+                if progress:
+                    progress('files', deleted + failed, None)
+        except Exception as e:
+            # A failed read must not pass for "no files left": the rows would be dropped with their assets kept
+            logger.error(f"Could not read the files of user {user_id}: {str(e)}")
+            return {'success': False, 'deleted': deleted, 'failed': failed}
+
+        if failed:
+            return {'success': False, 'deleted': deleted, 'failed': failed}
+
+        # Sweep assets that never got a `files` row (e.g. failed inserts)
+        prefix = f"{CLOUDINARY_FOLDER_NAME}/{user_id}/"
+        for resource_type in ('image', 'video', 'raw'):
+            while True:
+                result = delete_files_by_prefix(prefix, resource_type=resource_type)
+                if not result['success']:
+                    logger.error(f"Cloudinary prefix deletion error for {prefix}: {result['error']}")
+                    return {'success': False, 'deleted': deleted, 'failed': failed}
+                if progress:
+                    progress('orphan_assets', len(result['deleted']), None)
+                if not result['partial']:
+                    break
+
+        # Prompts cascade with the conversations
+        if CloudinaryFile.delete_by_field_in_list('user_id', [user_id]) is None:
+            return {'success': False, 'deleted': deleted, 'failed': failed}
+        conversation_count = Conversation.delete_by_field_in_list('user_id', [user_id])
+        ContentVersionService.bump_user(user_id)
+        ContentVersionService.bump_similarity(user_id)
+        if conversation_count is None:
+            return {'success': False, 'deleted': deleted, 'failed': failed}
+        if progress:
+            progress('conversations', conversation_count, conversation_count)
+
+        return {'success': True, 'deleted': deleted, 'failed': failed}
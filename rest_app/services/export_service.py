@@ -0,0 +1,111 @@
+import json
+import logging
+from rest_app.models import Conversation, Prompt, CloudinaryFile
+from rest_app.services.archive_service import ArchiveService
+
+logger = logging.getLogger(__name__)
+
+# Prompt pages also bound the size of the prompt_id IN list used to fetch files
+EXPORT_PAGE_SIZE = 200
+
+# Parquet columns come from the models, rows read early may lack keys set later
+EXPORT_MODELS = {'conversation': Conversation, 'prompt': Prompt, 'file': CloudinaryFile}
+
+
+class SupabaseExportService:
+    @staticmethod
+    def iter_user_records(user_id, page_size=EXPORT_PAGE_SIZE):
+        """
+        Stream a user's full history as (record_type, record) tuples.
+
+        Conversations are read page by page, and for each conversation its prompts
+        are read page by page together with the files of that page of prompts
+        (archived conversations are read from their snapshot).
+        Memory use is bounded by page_size regardless of history size.
+        A failed read raises instead of silently leaving records out.
+        """
+        if not user_id:
+            return
+
+        for conversation in Conversation.iter_by_fields(
+            fields={'user_id': user_id}, order_by='created_at', page_size=page_size
+        ):
+            yield 'conversation', conversation
+
+            if conversation.get('is_archived'):
+                yield from ArchiveService.iter_archived_records(conversation)
+                continue
+
+            for prompts in Prompt.iter_pages_by_fields(
+                fields={'conversation_id': conversation['id']}, order_by='created_at', page_size=page_size
+            ):
+                for prompt in prompts:
+                    yield 'prompt', prompt
+
+                prompt_ids = [p['id'] for p in prompts]
+                for file in CloudinaryFile.select_by_field_in_list(
+                    'prompt_id', prompt_ids, order_by='step_index', raise_errors=True
+                ):
+                    yield 'file', file
+
+    @staticmethod
+    def iter_jsonl(user_id, page_size=EXPORT_PAGE_SIZE):
+        """Stream a user's full history as JSON lines"""
+        for record_type, record in SupabaseExportService.iter_user_records(user_id, page_size=page_size):
+            yield json.dumps({'type': record_type, 'data': record}, default=str) + "\n"
+
+    @staticmethod
+    def write_parquet(user_id, output_dir, page_size=EXPORT_PAGE_SIZE):
+        """
+        Write a user's full history as one Parquet file per record type
+        (conversations.parquet, prompts.parquet, files.parquet) in output_dir.
+
+        Requires pyarrow. Records are buffered per type and flushed as a row group
+        every page_size rows. Each file has one string column per model column, whatever
+keys the first rows happen to carry; nested values are stored as JSON.
+
+        Returns:
+            Dictionary of record type to number of rows written
+        """
+        import os
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        writers, buffers, counts = {}, {}, {}
+
+        def flush(record_type):
+            rows = buffers.get(record_type)
+            if not rows:
+                return
+            if record_type not in writers:
+                fields = EXPORT_MODELS[record_type]._meta.concrete_fields
+                schema = pa.schema([(field.column, pa.string()) for field in fields])
+                path = os.path.join(output_dir, f"{record_type}s.parquet")
+                writers[record_type] = pq.ParquetWriter(path, schema)
+            writer = writers[record_type]
+            columns = {
+                name: [
+                    None if row.get(name) is None
+                    else row[name] if isinstance(row[name], str)
+                    else json.dumps(row[name], default=str)
+                    for row in rows
+                ]
+                for name in writer.schema.names
+            }
+            writer.write_table(pa.Table.from_pydict(columns, schema=writer.schema))
+            buffers[record_type] = []
+
+        os.makedirs(output_dir, exist_ok=True)
+        try:
+            for record_type, record in SupabaseExportService.iter_user_records(user_id, page_size=page_size):
+                buffers.setdefault(record_type, []).append(record)
+                counts[record_type] = counts.get(record_type, 0) + 1
+                if len(buffers[record_type]) >= page_size:
+                    flush(record_type)
+            for record_type in list(buffers):
+                flush(record_type)
+        finally:
+            for writer in writers.values():
+                writer.close()
+
+        return counts
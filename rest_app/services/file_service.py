@@ -1,6 +1,10 @@
-from rest_app.config.supabase_config import supabase_client
+from rest_app.config.cloudinary_config import update_file, CLOUDINARY_FOLDER_NAME
 import logging
+import json
 from rest_app.models import CloudinaryFile, Account
+from rest_app.services.version_service import ContentVersionService
+from rest_app.services.usage_service import UsageService
+from rest_app.services.latency_service import LatencyService
 
 logger = logging.getLogger(__name__)
 
@@ -28,16 +32,114 @@ class SupabaseFileService:
             logger.error(f"File creation error: {str(e)}")
             return None
 
+    @staticmethod
+    def create_step_files(user_id, prompt_id, steps, start_index=None, elapsed_ms=None):
+        """
+        Create the file records of the visual steps and final output returned by the AI service.
+        Steps whose public_id is already recorded for the prompt are skipped, so the same
+        steps can safely be delivered more than once.
+
+        Args:
+            user_id: Owner of the prompt
+            prompt_id: Prompt the steps belong to
+            steps: List of step dictionaries from the AI service
+            start_index: step_index of the first step, unless the step carries its own.
+                Defaults to continuing after the steps already recorded for the prompt
+            elapsed_ms: Milliseconds from dispatching the AI call until these steps were received
+
+        Returns:
+            List of the created file records, already counted in the user's usage
+        """
+        existing = CloudinaryFile.select_by_fields(fields={'prompt_id': prompt_id})
+        known_public_ids = {f.get('public_id') for f in existing if f.get('public_id')}
+        if start_index is None:
+            start_index = len([f for f in existing if f.get('step_type') != 'input']) + 1
+
+        created = []
+        for i, step in enumerate(steps):
+            step_type = step.get("step_type", f"step_{start_index + i}")
+            if step.get("public_id") and step["public_id"] in known_public_ids:
+                continue
+
+            folder_type = "outputs" if step_type == "output" else "steps"
+            cloud_folder = f"{user_id}/{folder_type}"
+
+            result = SupabaseFileService.create_file(user_id, {
+                "public_id": step.get("public_id", ""),
+                "filename": step.get("filename", ""),
+                "url": step.get("url", ""),
+                "resource_type": step.get("resource_type", ""),
+                "format": step.get("format", ""),
+                "folder": cloud_folder,
+                "prompt_id": prompt_id,
+                "user_id": user_id,
+                "step_type": step_type,
+                "step_index": step.get("step_index", start_index + i),
+                "bytes": step.get("bytes"),
+                "duration_ms": LatencyService.reported_duration_ms(step),
+                "elapsed_ms": elapsed_ms,
+                "reasoning_info": json.dumps(step.get("reasoning_info", {})) if "reasoning_info" in step else None
+            })
+            if result:
+                created.append(result)
+        UsageService.record_files(user_id, created)
+        return created
+
+    @staticmethod
+    def iter_user_files(user_id, page_size=None):
+        """
+        Lazily yield every file of a user, newest first, one page of
+        SUPABASE_PAGE_SIZE rows in memory at a time
+
+        Raises:
+            The underlying Supabase error (see SupabaseModelMixin.iter_pages_by_fields)
+        """
+        if not user_id:
+            return
+        yield from CloudinaryFile.iter_by_fields(fields={'user_id': user_id}, order_by='id', desc=True, page_size=page_size)
+
     @staticmethod
     def get_user_files(user_id):
-        """Get all files for a user from Supabase"""
+        """Get all files for a user from Supabase. Prefer iter_user_files for large accounts"""
         try:
-            if not user_id:
-                return []
-                
-            # Use the base model's select_by_fields method
-            fields = {'user_id': user_id}
-            return CloudinaryFile.select_by_fields(fields=fields, order_by='created_at', desc=True)
+            return list(SupabaseFileService.iter_user_files(user_id))
         except Exception as e:
             logger.error(f"Get files error: {str(e)}")
-            return []
\ No newline at end of file
+            return []
+
+    @staticmethod
+    def update_file(public_id, new_file=None, new_folder=None, new_public_id=None, resource_type='image'):
+        """
+        Replace, rename or move a Cloudinary asset and update the public_id, url
+        and folder of every matching file record in one batched write
+        """
+        result = update_file(
+            public_id,
+            new_file=new_file,
+            new_folder=new_folder,
+            new_public_id=new_public_id,
+            resource_type=resource_type
+        )
+        if not result['success']:
+            return result
+
+        # File records store the folder relative to the app's root folder
+        folder = result['public_id'].rsplit('/', 1)[0] if '/' in result['public_id'] else ''
+        root_prefix = f"{CLOUDINARY_FOLDER_NAME}/"
+        if folder.startswith(root_prefix):
+            folder = folder[len(root_prefix):]
+
+        updated = CloudinaryFile.update_by_fields(
+            {'public_id': public_id},
+            {'public_id': result['public_id'], 'url': result['url'], 'folder': folder}
+        )
+        if updated is None:
+            logger.error(f"File records of {public_id} could not be updated after the Cloudinary update")
+            return {**result, 'success': False, 'error': "File records update failed"}
+
+        # Every page of the affected users must be rendered again
+        for user_id in {f.get('user_id') for f in updated}:
+            ContentVersionService.bump_user(user_id)
+            ContentVersionService.bump_similarity(user_id)
+
+        return {**result, 'updated_records': len(updated)}
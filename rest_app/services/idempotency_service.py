@@ -0,0 +1,76 @@
+import logging
+import re
+import time
+from django.conf import settings
+from rest_app.config.cache_config import state_cache
+
+logger = logging.getLogger(__name__)
+
+# Seconds a submission key is remembered
+IDEMPOTENCY_TTL = getattr(settings, 'PROMPT_IDEMPOTENCY_TTL', 600)
+# How long a duplicate waits for the first submission to create its conversation
+PENDING_WAIT_SECONDS = 5
+PENDING_POLL_INTERVAL = 0.2
+KEY_PATTERN = re.compile(r'[A-Za-z0-9-]{8,64}')
+
+
+class IdempotencyService:
+    """
+    Short-lived key -> result table for form submissions, kept in the state cache
+    (see CACHES in settings.py), where page data cannot evict it.
+
+    The first request carrying a key claims it (cache.add) and records the
+    conversation/prompt it creates; duplicates of that request (double clicks,
+    browser retries) find the entry and attach to that run instead of starting a
+    new one. The claim is only atomic on backends whose add() is (Redis,
+    Memcached, database): the file-based development cache checks then writes,
+    so a close enough pair of duplicates can both win there. The
+    rest_app.E002 deployment check (manage.py check --deploy) refuses it.
+    """
+
+    @staticmethod
+    def _cache_key(user_id, key):
+        return f"idempotency:{user_id}:{key}"
+
+    @staticmethod
+    def is_valid_key(key):
+        """Whether a client supplied key is well formed"""
+        return bool(key) and bool(KEY_PATTERN.fullmatch(key))
+
+    @staticmethod
+    def claim(user_id, key):
+        """
+        Claim a key for a new submission
+
+        Returns:
+            True if this request is the first one with the key, False for a duplicate
+        """
+        return state_cache.add(IdempotencyService._cache_key(user_id, key), {'status': 'pending'}, IDEMPOTENCY_TTL)
+
+    @staticmethod
+    def record(user_id, key, **result):
+        """Store the state of the submission (status, conversation_id, prompt_id)"""
+        state_cache.set(IdempotencyService._cache_key(user_id, key), result, IDEMPOTENCY_TTL)
+
+    @staticmethod
+    def release(user_id, key):
+        """Forget a key whose submission was rejected or failed, so it can be retried"""
+        state_cache.delete(IdempotencyService._cache_key(user_id, key))
+
+    @staticmethod
+    def wait_for_result(user_id, key, timeout=PENDING_WAIT_SECONDS):
+        """
+        Wait until the first submission with the key has recorded its conversation
+
+        Returns:
+            The recorded result, or None if it did not show up in time
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            result = state_cache.get(IdempotencyService._cache_key(user_id, key))
+            if result is None or result.get('conversation_id'):
+                return result
+            if time.monotonic() >= deadline:
+                logger.warning(f"Duplicate submission {key} gave up waiting for the original")
+                return None
+            time.sleep(PENDING_POLL_INTERVAL)
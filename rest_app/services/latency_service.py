@@ -0,0 +1,84 @@
+import logging
+from datetime import datetime, timedelta, timezone
+from rest_app.config.supabase_config import get_supabase_client
+from rest_app.services.archive_service import parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+# Days covered by the latency report by default
+LATENCY_DAYS = 30
+# Time buckets accepted by date_trunc in step_latency_report
+REPORT_BUCKETS = ('hour', 'day', 'week', 'month')
+
+
+class LatencyService:
+    """
+    Timing of AI runs, stored with the prompt (whole call) and each step's
+    `files` row, and summarized by the step_latency_report SQL function.
+
+    Two measurements are kept side by side: durations reported by the AI
+    service (`duration_ms` on a step or its reasoning_info, `duration_ms` on
+    the final payload) and times we measure ourselves from dispatch, which
+    also include network and queueing on the AI side.
+    """
+
+    @staticmethod
+    def reported_duration_ms(data):
+        """
+        Duration reported by the AI service for a step or a whole run:
+        `duration_ms`, or `duration` in seconds, on the dictionary or its
+        reasoning_info. None when absent or invalid.
+        """
+        if not isinstance(data, dict):
+            return None
+        sources = [data]
+        if isinstance(data.get('reasoning_info'), dict):
+            sources.append(data['reasoning_info'])
+        for source in sources:
+            for key, scale in (('duration_ms', 1), ('duration', 1000)):
+                value = source.get(key)
+                if value is None:
+                    continue
+                try:
+                    duration = float(value) * scale
+                except (TypeError, ValueError):
+                    continue
+                if duration >= 0:
+                    return int(round(duration))
+        return None
+
+    @staticmethod
+    def elapsed_since_ms(dispatched_at):
+        """Milliseconds since a dispatch timestamp (string or datetime), or None"""
+        if isinstance(dispatched_at, str):
+            dispatched_at = parse_timestamp(dispatched_at)
+        if not dispatched_at:
+            return None
+        if not dispatched_at.tzinfo:
+            dispatched_at = dispatched_at.replace(tzinfo=timezone.utc)
+        return max(int((datetime.now(timezone.utc) - dispatched_at).total_seconds() * 1000), 0)
+
+    @staticmethod
+    def report(days=LATENCY_DAYS, bucket='day'):
+        """
+        p50/p95 latencies per time bucket and step_type over the last `days` days
+
+        Returns:
+            List of rows (bucket, step_type, samples, service_p50_ms, service_p95_ms,
+            client_p50_ms, client_p95_ms), or None if the report failed
+
+        Raises:
+            ValueError if bucket is not one of REPORT_BUCKETS
+        """
+        if bucket not in REPORT_BUCKETS:
+            raise ValueError(f"bucket must be one of {', '.join(REPORT_BUCKETS)}")
+        since = datetime.now(timezone.utc) - timedelta(days=days)
+        try:
+            result = get_supabase_client().rpc('step_latency_report', {
+                'p_since': since.isoformat(),
+                'p_bucket': bucket,
+            }).execute()
+        except Exception as e:
+            logger.error(f"Latency report error: {str(e)}")
+            return None
+        return result.data or []
@@ -0,0 +1,184 @@
+import asyncio
+import logging
+import threading
+import weakref
+from django.conf import settings
+from django.core.cache import cache
+from rest_app.models import Conversation, Prompt, CloudinaryFile
+from rest_app.models.model import gather_queries, run_queries
+from rest_app.services.version_service import ContentVersionService
+
+logger = logging.getLogger(__name__)
+
+PAGE_DATA_CACHE_TTL = getattr(settings, 'PAGE_DATA_CACHE_TTL', 300)
+
+
+class PageCacheService:
+    """
+    Cached reads of the data behind the main pages: a user's conversation
+    list and the bundle (conversation, prompts, files) of one conversation.
+
+    Cache keys embed the content versions, so any write that bumps them makes
+    the old entries unreachable: entries never need to be invalidated and are
+    never stale. Versions are read before querying, so a write landing during
+    a fill only stores data under a key nobody asks for anymore.
+
+    Entries and versions live in the default cache, shared by every worker
+    (CACHES in settings.py, checked by rest_app.W001): the login warm-up fills
+    it for whichever worker serves the landing page, and a write handled by
+    one worker makes the other workers' reads miss too. Only the coalescing
+    of concurrent fills below is per process.
+
+    Missing entries are loaded with the async model methods on the process'
+    query loop: independent queries overlap, and concurrent fills of the same
+    entry share a single run, so a page requested while the login warm-up is
+    still fetching its data waits for it instead of querying again.
+    """
+
+    # Fills in flight, per event loop: key -> task
+    _inflight = weakref.WeakKeyDictionary()
+
+    @classmethod
+    def after_fork(cls):
+        """Forget the parent's fills, e.g. in a forked worker"""
+        cls._inflight = weakref.WeakKeyDictionary()
+
+    @staticmethod
+    def _conversations_key(user_id):
+        return f"page-data:conversations:{user_id}:{ContentVersionService.user_version(user_id)}"
+
+    @staticmethod
+    def _bundle_key(user_id, conversation_id):
+        return (
+            f"page-data:bundle:{conversation_id}:{ContentVersionService.user_version(user_id)}:"
+            f"{ContentVersionService.conversation_version(conversation_id)}"
+        )
+
+    @staticmethod
+    async def _load_conversations(user_id):
+        try:
+            return await Conversation.aselect_by_fields(
+                fields={"user_id": user_id}, order_by="created_at", desc=True, raise_errors=True
+            )
+        except Exception:
+            # Not cached: a transient error must not hide the list until the next write
+            return None
+
+    @staticmethod
+    async def _load_bundle(conversation_id):
+        try:
+            # The prompts query does not depend on the conversation row, both run at once
+            conversation, prompts = await gather_queries(
+                Conversation.aselect_by_id(conversation_id),
+                Prompt.aselect_by_fields(
+                    fields={"conversation_id": conversation_id}, order_by="created_at", raise_errors=True
+                ),
+            )
+            if not conversation:
+                return None
+            if conversation.get("is_archived"):
+                return {"conversation": conversation, "prompts": [], "files": []}
+            files = await CloudinaryFile.aselect_by_field_in_list(
+                "prompt_id", [p["id"] for p in prompts], raise_errors=True
+            )
+        except Exception:
+            return None
+        return {"conversation": conversation, "prompts": prompts, "files": files}
+
+    @classmethod
+    async def _fill(cls, key, loader):
+        """
+        Run loader(), sharing the run with concurrent fills of key. Storing
+        the result is left to the synchronous caller: cache backends may block
+        or refuse to run (async_unsafe) on the shared query loop.
+        """
+        inflight = cls._inflight.setdefault(asyncio.get_running_loop(), {})
+        task = inflight.get(key)
+        if task is None:
+            async def run():
+                try:
+                    return await loader()
+                finally:
+                    inflight.pop(key, None)
+
+            task = inflight[key] = asyncio.ensure_future(run())
+        return await asyncio.shield(task)
+
+    @classmethod
+    def _get_many(cls, entries):
+        """
+        Values of (key, loader) entries: cached ones as they are, missing ones
+        filled concurrently. None for entries that could not be loaded.
+        """
+        values = cache.get_many([key for key, _ in entries])
+        missing = [(key, loader) for key, loader in entries if values.get(key) is None]
+        if missing:
+            filled = dict(zip(
+                (key for key, _ in missing),
+                run_queries(*(cls._fill(key, loader) for key, loader in missing)),
+            ))
+            # Failed loads (None) are not cached
+            cache.set_many({key: value for key, value in filled.items() if value is not None}, PAGE_DATA_CACHE_TTL)
+            values.update(filled)
+        return [values.get(key) for key, _ in entries]
+
+    @staticmethod
+    def get_conversations(user_id):
+        """The user's conversations, most recent first"""
+        key = PageCacheService._conversations_key(user_id)
+        conversations, = PageCacheService._get_many([
+            (key, lambda: PageCacheService._load_conversations(user_id)),
+        ])
+        return conversations or []
+
+    @staticmethod
+    def get_conversation_bundle(user_id, conversation_id):
+        """
+        A conversation with its prompts (oldest first) and their files
+
+        Returns:
+            Dictionary with conversation, prompts and files, or None if the
+            conversation does not exist or cannot be read. Archived
+            conversations come without prompts and files.
+        """
+        key = PageCacheService._bundle_key(user_id, conversation_id)
+        bundle, = PageCacheService._get_many([
+            (key, lambda: PageCacheService._load_bundle(conversation_id)),
+        ])
+        return bundle
+
+    @staticmethod
+    def get_detail_page(user_id, conversation_id):
+        """
+        Data of a conversation page: the bundle (see get_conversation_bundle)
+        and the sidebar's conversation list, loaded concurrently on a miss
+
+        Returns:
+            Tuple of (bundle or None, list of conversations)
+        """
+        bundle, conversations = PageCacheService._get_many([
+            (PageCacheService._bundle_key(user_id, conversation_id),
+             lambda: PageCacheService._load_bundle(conversation_id)),
+            (PageCacheService._conversations_key(user_id),
+             lambda: PageCacheService._load_conversations(user_id)),
+        ])
+        return bundle, conversations or []
+
+    @staticmethod
+    def warm(user_id):
+        """Fill the cache with the user's landing page data and latest conversation"""
+        conversations = PageCacheService.get_conversations(user_id)
+        latest = next((c for c in conversations if not c.get("is_archived")), None)
+        if latest:
+            PageCacheService.get_conversation_bundle(user_id, latest["id"])
+
+    @staticmethod
+    def warm_in_background(user_id):
+        """Start warm() in a daemon thread, e.g. while the login redirect is in flight"""
+        def run():
+            try:
+                PageCacheService.warm(user_id)
+            except Exception as e:
+                logger.warning(f"Cache warm-up failed for user {user_id}: {str(e)}")
+
+        threading.Thread(target=run, name=f"warm-{user_id}", daemon=True).start()
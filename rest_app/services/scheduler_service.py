@@ -0,0 +1,237 @@
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PLAN = 'default'
+DEFAULT_PLAN_LIMITS = {
+    # rate_per_minute/burst: token bucket, max_concurrent: running jobs per user,
+    # weight: share of the AI service when users compete for it
+    DEFAULT_PLAN: {'rate_per_minute': 6, 'burst': 3, 'max_concurrent': 1, 'weight': 1},
+}
+# Initial guess of an AI run's duration, refined as jobs complete
+INITIAL_JOB_SECONDS = 30.0
+# Smoothing factor of the job duration moving average
+DURATION_SMOOTHING = 0.2
+
+
+class AIQueueTimeout(Exception):
+    """Raised when a job waited longer than allowed for an AI slot"""
+
+
+class TokenBucket:
+    """Classic token bucket: `capacity` tokens, refilled at `rate` tokens per second"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def take(self):
+        """
+        Take a token if one is available
+
+        Returns:
+            Tuple of (allowed, seconds until the next token)
+        """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True, 0
+        return False, (1 - self.tokens) / self.rate
+
+
+class AIJobTicket:
+    """A job waiting for, or holding, an AI slot"""
+
+    def __init__(self, user_id, plan, start_tag, finish_tag):
+        self.user_id = user_id
+        self.plan = plan
+        self.start_tag = start_tag
+        self.finish_tag = finish_tag
+        self.enqueued_at = time.monotonic()
+        self.started_at = None
+
+
+class FairAIScheduler:
+    """
+    Gatekeeper in front of the AI inpainting service.
+
+    - Admission: a per-user token bucket limits how fast prompts may be sent.
+    - Fairness: waiting jobs are served by weighted fair queuing. Each job gets a
+      virtual finish tag (start + 1 / plan weight), and the job with the smallest
+      tag among users below their concurrency cap runs next. A user firing twenty
+      prompts therefore queues behind everyone else's first prompt.
+    - Capacity: at most AI_MAX_CONCURRENT_JOBS jobs run at once, and at most the
+      plan's max_concurrent per user.
+
+    State is process-local: every limit above applies per worker process. With
+    N workers a user may send up to N times the plan's rate and run N times its
+    max_concurrent jobs, and the service may get N * AI_MAX_CONCURRENT_JOBS
+    jobs; size the settings for the worker count.
+
+    Plans are read from the "user_plan" session key, set at login from the
+    Supabase user's app_metadata.plan (only the service role can write it).
+    """
+
+    def __init__(self, max_concurrent=None, plan_limits=None):
+        self.max_concurrent = max_concurrent or getattr(settings, 'AI_MAX_CONCURRENT_JOBS', 4)
+        self.plan_limits = plan_limits or getattr(settings, 'AI_PLAN_LIMITS', DEFAULT_PLAN_LIMITS)
+        self.reset()
+
+    def reset(self):
+        """Start over with empty state, e.g. in a freshly forked worker"""
+        self._condition = threading.Condition()
+        self._buckets = {}
+        self._waiting = []
+        self._running = {}
+        self._running_total = 0
+        self._virtual_time = 0.0
+        self._last_finish_tag = {}
+        self._average_job_seconds = INITIAL_JOB_SECONDS
+        self._draining = False
+
+    def _limits(self, plan):
+        return self.plan_limits.get(plan) or self.plan_limits.get(DEFAULT_PLAN) or DEFAULT_PLAN_LIMITS[DEFAULT_PLAN]
+
+    def consume_token(self, user_id, plan=DEFAULT_PLAN):
+        """
+        Charge one prompt against the user's rate limit
+
+        Returns:
+            Tuple of (allowed, seconds to wait before retrying)
+        """
+        limits = self._limits(plan)
+        with self._condition:
+            bucket = self._buckets.get(user_id)
+            if bucket is None:
+                bucket = TokenBucket(limits['rate_per_minute'] / 60.0, limits['burst'])
+                self._buckets[user_id] = bucket
+            return bucket.take()
+
+    def _is_eligible(self, ticket):
+        return self._running.get(ticket.user_id, 0) < self._limits(ticket.plan)['max_concurrent']
+
+    def _queue_order(self):
+        """Waiting tickets in service order, users at their concurrency cap last"""
+        return sorted(self._waiting, key=lambda t: (not self._is_eligible(t), t.finish_tag, t.enqueued_at))
+
+    def _next_ticket(self):
+        if self._running_total >= self.max_concurrent:
+            return None
+        eligible = [t for t in self._waiting if self._is_eligible(t)]
+        return min(eligible, key=lambda t: (t.finish_tag, t.enqueued_at), default=None)
+
+    def acquire(self, user_id, plan=DEFAULT_PLAN, timeout=None):
+        """
+        Wait for an AI slot
+
+        Returns:
+            The running AIJobTicket, to be passed to release()
+
+        Raises:
+            AIQueueTimeout if no slot was granted within timeout seconds
+        """
+        timeout = timeout if timeout is not None else getattr(settings, 'AI_QUEUE_TIMEOUT', 300)
+        deadline = time.monotonic() + timeout
+        weight = self._limits(plan)['weight']
+
+        with self._condition:
+            if self._draining:
+                raise AIQueueTimeout("The server is restarting, please try again shortly.")
+            start_tag = max(self._virtual_time, self._last_finish_tag.get(user_id, 0.0))
+            ticket = AIJobTicket(user_id, plan, start_tag, start_tag + 1.0 / weight)
+            self._last_finish_tag[user_id] = ticket.finish_tag
+            self._waiting.append(ticket)
+
+            while self._next_ticket() is not ticket:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._draining:
+                    self._waiting.remove(ticket)
+                    self._condition.notify_all()
+                    if self._draining:
+                        raise AIQueueTimeout("The server is restarting, please try again shortly.")
+                    raise AIQueueTimeout("The AI service is busy, please try again shortly.")
+                self._condition.wait(remaining)
+
+            self._waiting.remove(ticket)
+            self._running[user_id] = self._running.get(user_id, 0) + 1
+            self._running_total += 1
+            self._virtual_time = max(self._virtual_time, ticket.start_tag)
+            ticket.started_at = time.monotonic()
+            # Waiters that saw this ticket ahead of them may be next now: with several
+            # free slots they would otherwise sleep until the next release
+            self._condition.notify_all()
+            return ticket
+
+    def _release_locked(self, ticket):
+        duration = time.monotonic() - ticket.started_at
+        self._average_job_seconds += DURATION_SMOOTHING * (duration - self._average_job_seconds)
+        self._running[ticket.user_id] -= 1
+        if not self._running[ticket.user_id]:
+            del self._running[ticket.user_id]
+        self._running_total -= 1
+        self._condition.notify_all()
+
+    def release(self, ticket):
+        """Free the slot held by a ticket and wake up waiting jobs"""
+        with self._condition:
+            self._release_locked(ticket)
+
+    def drain(self, timeout=None):
+        """
+        Stop admitting jobs and wait for the running ones to finish. Waiting jobs
+        are turned away with AIQueueTimeout.
+
+        Returns:
+            Number of jobs still running when timeout (AI_DRAIN_TIMEOUT by default) expired
+        """
+        timeout = timeout if timeout is not None else getattr(settings, 'AI_DRAIN_TIMEOUT', 30)
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            self._draining = True
+            self._condition.notify_all()
+            while True:
+                remaining = deadline - time.monotonic()
+                if self._running_total <= 0 or remaining <= 0:
+                    return self._running_total
+                self._condition.wait(remaining)
+
+    @contextmanager
+    def job(self, user_id, plan=DEFAULT_PLAN, timeout=None):
+        """Hold an AI slot for the duration of the with block"""
+        ticket = self.acquire(user_id, plan, timeout)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def status(self, user_id):
+        """
+        Queue position and estimated wait of the user's first waiting job
+
+        Returns:
+            Dictionary with queued, position (1-based), estimated_wait (seconds) and running
+        """
+        with self._condition:
+            running = self._running.get(user_id, 0)
+            for position, ticket in enumerate(self._queue_order(), start=1):
+                if ticket.user_id == user_id:
+                    rounds = math.ceil(position / self.max_concurrent)
+                    return {
+                        'queued': True,
+                        'position': position,
+                        'estimated_wait': round(rounds * self._average_job_seconds),
+                        'running': running,
+                    }
+            return {'queued': False, 'position': 0, 'estimated_wait': 0, 'running': running}
+
+
+ai_scheduler = FairAIScheduler()
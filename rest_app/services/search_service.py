@@ -0,0 +1,58 @@
+import logging
+from django.utils.html import escape
+from rest_app.config.supabase_config import get_supabase_client
+
+logger = logging.getLogger(__name__)
+
+SEARCH_PAGE_SIZE = 20
+# Longer queries are truncated, they only make the tsquery slower
+MAX_QUERY_LENGTH = 200
+# Markers ts_headline puts around matched words (see migrate_to_supabase.py)
+HIGHLIGHT_START = '[[mark]]'
+HIGHLIGHT_STOP = '[[/mark]]'
+
+
+class PromptSearchService:
+    """
+    Full-text search over a user's prompts and AI responses, served by the
+    search_prompts SQL function and its GIN index (created by the migrator).
+    """
+
+    @staticmethod
+    def search(user_id, query, page=1, page_size=SEARCH_PAGE_SIZE):
+        """
+        Search a user's prompts, best matches first
+
+        Args:
+            user_id: Owner of the prompts
+            query: Web-style search query ("quoted phrase", or, -excluded)
+            page: 1-based page number
+            page_size: Number of results per page
+
+        Returns:
+            Dictionary with the results of the page and whether a next page exists,
+            or None if the search failed
+        """
+        query = (query or '').strip()[:MAX_QUERY_LENGTH]
+        if not user_id or not query:
+            return {'results': [], 'has_next': False}
+
+        try:
+            # One extra row tells whether there is a next page
+            result = get_supabase_client().rpc('search_prompts', {
+                'p_user_id': user_id,
+                'p_query': query,
+                'p_limit': page_size + 1,
+                'p_offset': (page - 1) * page_size,
+            }).execute()
+        except Exception as e:
+            logger.error(f"Prompt search error: {str(e)}")
+            return None
+
+        rows = result.data or []
+        return {'results': rows[:page_size], 'has_next': len(rows) > page_size}
+
+    @staticmethod
+    def render_highlight(headline):
+        """HTML of a search excerpt: escaped text with matched words in <mark>"""
+        return escape(headline or '').replace(HIGHLIGHT_START, '<mark>').replace(HIGHLIGHT_STOP, '</mark>')
@@ -0,0 +1,274 @@
+import itertools
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from rest_app.models import CloudinaryFile
+from rest_app.services.version_service import ContentVersionService
+from rest_app.utils.asset_cache import asset_cache
+
+logger = logging.getLogger(__name__)
+
+# Default Hamming radius of "similar edits"
+SIMILAR_RADIUS = 10
+# Both hashes within this radius: the images are near duplicates
+NEAR_DUPLICATE_RADIUS = 4
+# Larger radii match nearly everything and probe too many buckets
+MAX_RADIUS = 16
+# Output rows hashed per batch by the background job
+HASH_BATCH_SIZE = 100
+# Concurrent image downloads while hashing
+HASH_WORKERS = 4
+DOWNLOAD_TIMEOUT = 30
+# Users whose index is kept in memory (per process)
+INDEX_CACHE_SIZE = 64
+
+
+class MultiIndexHashTable:
+    """
+    Hamming-radius search over 64-bit hashes by multi-index hashing.
+
+    Each hash is split into `chunks` substrings, each indexed in its own table.
+    Two hashes within distance r differ in at most r // chunks bits on at least
+    one substring, so a query only probes the buckets within that distance of
+    its own substrings and verifies the few candidates found there, instead of
+    comparing against every hash.
+    """
+
+    def __init__(self, bits=64, chunks=4):
+        self.chunks = chunks
+        self.chunk_bits = bits // chunks
+        self.chunk_mask = (1 << self.chunk_bits) - 1
+        self.tables = [{} for _ in range(chunks)]
+        self.hashes = {}
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def _substrings(self, value):
+        return [(value >> (i * self.chunk_bits)) & self.chunk_mask for i in range(self.chunks)]
+
+    def add(self, key, value):
+        self.hashes[key] = value
+        for table, substring in zip(self.tables, self._substrings(value)):
+            table.setdefault(substring, []).append(key)
+
+    def _probes(self, substring, radius):
+        """Every substring within radius bits of substring"""
+        for distance in range(radius + 1):
+            for positions in itertools.combinations(range(self.chunk_bits), distance):
+                flipped = substring
+                for position in positions:
+                    flipped ^= 1 << position
+                yield flipped
+
+    def search(self, value, radius, exclude=None):
+        """
+        Keys whose hash is within radius bits of value
+
+        Returns:
+            List of (key, distance) tuples, closest first
+        """
+        candidates = set()
+        for table, substring in zip(self.tables, self._substrings(value)):
+            for probe in self._probes(substring, radius // self.chunks):
+                candidates.update(table.get(probe, ()))
+        candidates.discard(exclude)
+
+        matches = []
+        for key in candidates:
+            distance = bin(value ^ self.hashes[key]).count('1')
+            if distance <= radius:
+                matches.append((key, distance))
+        return sorted(matches, key=lambda match: (match[1], match[0]))
+
+
+class ImageSimilarityService:
+    """
+    Perceptual-hash similarity between a user's output images (`files` rows
+    with step_type 'output').
+
+    Hashes are computed by hash_pending() (the compute_image_hashes command)
+    and stored on the rows. Each process keeps a multi-index hash table per
+    user, rebuilt when the user's similarity version changes: on hashing, and
+    when output rows are deleted, archived, restored or moved. Page versions
+    are left alone, hashes are not shown on any page.
+    """
+
+    _indexes = OrderedDict()
+    _indexes_lock = threading.Lock()
+
+    @staticmethod
+    def hash_files(files, max_workers=HASH_WORKERS):
+        """
+        Compute and store the hashes of the given file rows
+
+        Returns:
+            Dictionary with the number of hashed and failed files
+        """
+        from rest_app.utils.image_hash import prepare_pixels, phash_batch, dhash_batch, to_hex
+
+        def load(file):
+            try:
+                return file, prepare_pixels(asset_cache.read(file['url'], timeout=DOWNLOAD_TIMEOUT))
+            except Exception as e:
+                logger.warning(f"Could not hash file {file['id']}: {str(e)}")
+                return file, None
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            loaded = [(file, pixels) for file, pixels in executor.map(load, files) if pixels is not None]
+
+        # All thumbnails of the batch are hashed in a single vectorized pass
+        phashes = phash_batch([pixels[0] for _, pixels in loaded])
+        dhashes = dhash_batch([pixels[1] for _, pixels in loaded])
+
+        hashed = 0
+        for (file, _), phash, dhash in zip(loaded, phashes, dhashes):
+            if CloudinaryFile.update_by_id(file['id'], {'phash': to_hex(phash), 'dhash': to_hex(dhash)}):
+                file['phash'], file['dhash'] = to_hex(phash), to_hex(dhash)
+                hashed += 1
+
+        # Cached indexes of these users must be rebuilt
+        if hashed:
+            for user_id in {file['user_id'] for file, _ in loaded}:
+                ContentVersionService.bump_similarity(user_id)
+
+        return {'hashed': hashed, 'failed': len(files) - hashed}
+
+    @staticmethod
+    def hash_pending(user_id=None, batch_size=HASH_BATCH_SIZE, max_workers=HASH_WORKERS, progress=None):
+        """
+        Hash every output image that has no hash yet, in id order
+
+        Args:
+            user_id: Only hash this user's images
+            batch_size: Rows read and hashed per batch
+            max_workers: Concurrent downloads
+            progress: Optional callback progress(hashed, failed)
+
+        Returns:
+            Dictionary with the number of hashed and failed files
+        """
+        fields = {'step_type': 'output'}
+        if user_id:
+            fields['user_id'] = user_id
+
+        hashed, failed = 0, 0
+        # Keyset pages: hashed rows leave the filter without shifting the next page
+        for page in CloudinaryFile.iter_pages_by_fields(
+            fields=fields, order_by='id', page_size=batch_size, is_null=['phash']
+        ):
+            files = [f for f in page if f.get('url')]
+            if not files:
+                continue
+
+            result = ImageSimilarityService.hash_files(files, max_workers=max_workers)
+            hashed += result['hashed']
+            failed += result['failed']
+            if progress:
+                progress(hashed, failed)
+
+        return {'hashed': hashed, 'failed': failed}
+
+    @staticmethod
+    def get_index(user_id):
+        """
+        The user's hash table and the hashed rows it refers to, built on first
+        use and reused until the user's similarity version changes
+
+        Returns:
+            Tuple of (MultiIndexHashTable, dictionary of file id to file row)
+        """
+        from rest_app.utils.image_hash import from_hex
+
+        version = ContentVersionService.similarity_version(user_id)
+        with ImageSimilarityService._indexes_lock:
+            cached = ImageSimilarityService._indexes.get(user_id)
+            if cached and cached[0] == version:
+                ImageSimilarityService._indexes.move_to_end(user_id)
+                return cached[1], cached[2]
+
+        index, files = MultiIndexHashTable(), {}
+        for file in CloudinaryFile.iter_by_fields(fields={'user_id': user_id, 'step_type': 'output'}):
+            if file.get('phash'):
+                index.add(file['id'], from_hex(file['phash']))
+                files[file['id']] = {
+                    key: file.get(key) for key in ('id', 'prompt_id', 'url', 'public_id', 'phash', 'dhash')
+                }
+
+        with ImageSimilarityService._indexes_lock:
+            ImageSimilarityService._indexes[user_id] = (version, index, files)
+            ImageSimilarityService._indexes.move_to_end(user_id)
+            while len(ImageSimilarityService._indexes) > INDEX_CACHE_SIZE:
+                ImageSimilarityService._indexes.popitem(last=False)
+        return index, files
+
+    @staticmethod
+    def _is_near_duplicate(file, other, phash_distance):
+        from rest_app.utils.image_hash import from_hex, hamming_distance
+
+        if phash_distance > NEAR_DUPLICATE_RADIUS:
+            return False
+        if not (file.get('dhash') and other.get('dhash')):
+            return True
+        return hamming_distance(from_hex(file['dhash']), from_hex(other['dhash'])) <= NEAR_DUPLICATE_RADIUS
+
+    @staticmethod
+    def find_similar(user_id, file_id, radius=SIMILAR_RADIUS, limit=20):
+        """
+        Output images of the user that look like the given one
+
+        Returns:
+            List of file rows with their pHash distance and a near_duplicate flag,
+            closest first, or None if the file is not one of the user's outputs
+            or cannot be hashed
+        """
+        from rest_app.utils.image_hash import from_hex
+
+        file = CloudinaryFile.select_by_id(file_id)
+        if not file or file.get('user_id') != user_id or file.get('step_type') != 'output':
+            return None
+        if not file.get('phash'):
+            # Not reached by the background job yet
+            if not ImageSimilarityService.hash_files([file])['hashed']:
+                return None
+
+        index, files = ImageSimilarityService.get_index(user_id)
+        matches = index.search(from_hex(file['phash']), min(radius, MAX_RADIUS), exclude=file['id'])
+        return [
+            {
+                **files[key],
+                'distance': distance,
+                'near_duplicate': ImageSimilarityService._is_near_duplicate(file, files[key], distance),
+            }
+            for key, distance in matches[:limit]
+        ]
+
+    @staticmethod
+    def find_near_duplicates(user_id):
+        """
+        Groups of near-duplicate output images of a user
+
+        Returns:
+            List of groups, each a list of file ids (groups of one are left out)
+        """
+        index, files = ImageSimilarityService.get_index(user_id)
+
+        # Union-find over near-duplicate pairs
+        parent = {key: key for key in files}
+
+        def find(key):
+            while parent[key] != key:
+                parent[key] = parent[parent[key]]
+                key = parent[key]
+            return key
+
+        for key, value in index.hashes.items():
+            for other, distance in index.search(value, NEAR_DUPLICATE_RADIUS, exclude=key):
+                if ImageSimilarityService._is_near_duplicate(files[key], files[other], distance):
+                    parent[find(other)] = find(key)
+
+        groups = {}
+        for key in files:
+            groups.setdefault(find(key), []).append(key)
+        return [sorted(group) for group in groups.values() if len(group) > 1]
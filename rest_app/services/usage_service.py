@@ -0,0 +1,146 @@
+import logging
+from datetime import timedelta
+from django.utils import timezone
+from rest_app.config.supabase_config import get_supabase_client
+from rest_app.config.cloudinary_config import iter_files_in_folder, CLOUDINARY_FOLDER_NAME
+from rest_app.models import CloudinaryFile, Conversation, UsageDaily, UsageTotals
+
+logger = logging.getLogger(__name__)
+
+# Days shown by the usage dashboard by default
+USAGE_DAYS = 30
+# Longest range the stats endpoint returns
+MAX_USAGE_DAYS = 366
+# File rows read per request while backfilling sizes
+BACKFILL_PAGE_SIZE = 500
+
+
+class UsageService:
+    """
+    Per-user usage counters (prompts, output images, intermediate steps and
+    bytes stored), kept in the usage_daily and usage_totals tables.
+
+    Counters are updated as activity is persisted, through the increment_usage
+    SQL function, so reading them never scans `prompts` or `files`. The
+    recompute_usage function rebuilds them from those tables (backfill_usage
+    command) for history older than the counters or after a missed update.
+    Prompts of archived conversations are not in those tables, so recomputing
+    only counts hot conversations.
+
+    Days are UTC days everywhere (here and in the SQL functions), whatever the
+    server's or the database session's time zone.
+    """
+
+    @staticmethod
+    def record(user_id, prompts=0, images=0, steps=0, bytes_stored=0, day=None):
+        """
+        Add to a user's usage counters. Failures are logged, never raised:
+        usage must not get in the way of the request that caused it.
+
+        Returns:
+            True if the counters were updated
+        """
+        if not user_id or not (prompts or images or steps or bytes_stored):
+            return False
+        try:
+            get_supabase_client().rpc('increment_usage', {
+                'p_user_id': user_id,
+                'p_day': (day or timezone.now().date()).isoformat(),
+                'p_prompts': prompts,
+                'p_images': images,
+                'p_steps': steps,
+                'p_bytes': bytes_stored,
+            }).execute()
+            return True
+        except Exception as e:
+            logger.error(f"Usage update error for user {user_id}: {str(e)}")
+            return False
+
+    @staticmethod
+    def record_files(user_id, files, sign=1):
+        """
+        Count newly created (or, with sign=-1, deleted) file rows of a user
+        """
+        images = sum(1 for f in files if f.get('step_type') == 'output')
+        steps = sum(1 for f in files if f.get('step_type') and f['step_type'] not in ('input', 'output'))
+        bytes_stored = sum(f.get('bytes') or 0 for f in files)
+        if sign < 0:
+            # Deleting files frees storage; images and steps generated stay counted
+            return UsageService.record(user_id, bytes_stored=-bytes_stored)
+        return UsageService.record(user_id, images=images, steps=steps, bytes_stored=bytes_stored)
+
+    @staticmethod
+    def recompute(user_id):
+        """Rebuild a user's counters from the prompts and files tables"""
+        try:
+            get_supabase_client().rpc('recompute_usage', {'p_user_id': user_id}).execute()
+            return True
+        except Exception as e:
+            logger.error(f"Usage recompute error for user {user_id}: {str(e)}")
+            return False
+
+    @staticmethod
+    def iter_user_ids():
+        """Every user owning at least one conversation"""
+        seen = set()
+        for conversation in Conversation.iter_by_fields(order_by='id'):
+            if conversation['user_id'] not in seen:
+                seen.add(conversation['user_id'])
+                yield conversation['user_id']
+
+    @staticmethod
+    def backfill_sizes(user_id):
+        """
+        Fill in the missing `bytes` of a user's file rows from the Cloudinary
+        listing of the user's folder (rows created before sizes were stored)
+
+        Returns:
+            Number of rows updated
+        """
+        sizes = {}
+        for resource_type in ('image', 'video', 'raw'):
+            for resource in iter_files_in_folder(f"{CLOUDINARY_FOLDER_NAME}/{user_id}/", resource_type=resource_type):
+                sizes[resource['public_id']] = resource.get('bytes')
+
+        updated = 0
+        # Keyset pages: rows updated out of the filter do not shift the next page
+        for file in CloudinaryFile.iter_by_fields(
+            fields={'user_id': user_id}, order_by='id', page_size=BACKFILL_PAGE_SIZE, is_null=['bytes']
+        ):
+            size = sizes.get(file.get('public_id'))
+            if size is not None and CloudinaryFile.update_by_id(file['id'], {'bytes': size}):
+                updated += 1
+        return updated
+
+    @staticmethod
+    def get_stats(user_id, days=USAGE_DAYS):
+        """
+        Usage dashboard data of a user: lifetime totals and one row per active
+        day of the last `days` days. Two indexed reads, whatever the history size.
+
+        Returns:
+            Dictionary with totals and daily rows
+        """
+        days = max(1, min(days, MAX_USAGE_DAYS))
+        since = timezone.now().date() - timedelta(days=days)
+
+        totals = UsageTotals.select_by_fields(fields={'user_id': user_id}, limit=1)
+        totals = totals[0] if totals else {}
+        daily = UsageDaily.select_by_fields(
+            fields={'user_id': user_id}, greater_than={'day': since.isoformat()}, order_by='day'
+        )
+
+        def summarize(row):
+            prompts = row.get('prompts') or 0
+            return {
+                'prompts': prompts,
+                'images': row.get('images') or 0,
+                'steps': row.get('steps') or 0,
+                'steps_per_prompt': round((row.get('steps') or 0) / prompts, 2) if prompts else 0,
+                'bytes_stored': row.get('bytes_stored') or 0,
+            }
+
+        return {
+            'totals': {**summarize(totals), 'updated_at': totals.get('updated_at')},
+            'daily': [{'day': row['day'], **summarize(row)} for row in daily],
+        }
@@ -0,0 +1,56 @@
+import logging
+from uuid import uuid4
+from rest_app.config.cache_config import state_cache
+
+logger = logging.getLogger(__name__)
+
+
+class ContentVersionService:
+    """
+    Opaque version tokens for a user's conversation list and for each conversation,
+    kept in the state cache and replaced on every write that changes what the
+    pages show. They make page validators (ETags) free to compute: no Supabase
+    query is needed to know whether a page changed.
+
+    A token missing from the cache is simply recreated, which only costs one
+    extra full render. Tokens culled to make room for page data would however
+    throw away every cached page and ETag of their user, so they live in the
+    "state" cache, which page data never fills. It is shared by every worker
+    (see CACHES in settings.py): a bump must be seen by whichever worker
+    answers the next request.
+    """
+
+    @staticmethod
+    def _get(key):
+        version = state_cache.get(key)
+        if version is None:
+            state_cache.add(key, uuid4().hex, None)
+            version = state_cache.get(key)
+        return version
+
+    @staticmethod
+    def user_version(user_id):
+        """Version of the user's conversation list"""
+        return ContentVersionService._get(f"content-version:user:{user_id}")
+
+    @staticmethod
+    def conversation_version(conversation_id):
+        """Version of a conversation's prompts and files"""
+        return ContentVersionService._get(f"content-version:conversation:{conversation_id}")
+
+    @staticmethod
+    def similarity_version(user_id):
+        """Version of the user's hashed output images (similarity index), independent of the pages"""
+        return ContentVersionService._get(f"content-version:similarity:{user_id}")
+
+    @staticmethod
+    def bump_user(user_id):
+        state_cache.set(f"content-version:user:{user_id}", uuid4().hex, None)
+
+    @staticmethod
+    def bump_conversation(conversation_id):
+        state_cache.set(f"content-version:conversation:{conversation_id}", uuid4().hex, None)
+
+    @staticmethod
+    def bump_similarity(user_id):
+        state_cache.set(f"content-version:similarity:{user_id}", uuid4().hex, None)
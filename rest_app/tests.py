@@ -1,3 +1,1322 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+import unittest
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from rest_app.config import cloudinary_config, supabase_config
+from rest_app.config.cloudinary_config import CLOUDINARY_FOLDER_NAME, verify_direct_upload
+from rest_app.config.lifecycle import after_fork, register_fork_hooks
+from rest_app.models import CloudinaryFile, Conversation, ConversationArchive, Prompt
+from rest_app.models.loader import request_scope
+from rest_app.models.model import gather_queries, run_queries
+from rest_app.services.ai_callback_service import AICallbackService, CALLBACK_TIMEOUT
+from rest_app.services.archive_service import ArchiveService
+from rest_app.services.deletion_service import BulkDeletionService
+from rest_app.services.export_service import SupabaseExportService
+from rest_app.services.idempotency_service import IdempotencyService
+from rest_app.services.latency_service import LatencyService
+from rest_app.services.page_cache_service import PageCacheService
+from rest_app.services.search_service import PromptSearchService
+from rest_app.services.usage_service import UsageService
+from rest_app.services.version_service import ContentVersionService
+from rest_app.services.similarity_service import MultiIndexHashTable
+from rest_app.utils import migrate_to_supabase as migrator
+from rest_app.utils.asset_cache import AssetCache, cache_key
+from rest_app.views.main_views import (
+    conversation_detail_etag, conversation_list_etag, conversation_list_view, conversation_updates_view,
+)
+from rest_app.services.scheduler_service import AIQueueTimeout, FairAIScheduler, TokenBucket, ai_scheduler
+
+
+def cloudinary_stub(resource=None, signature_valid=True):
+    """Stand-in for the cloudinary package: signature checks, URL building and the Admin API"""
+    def api_resource(public_id, resource_type='image'):
+        if resource is None:
+            raise Exception("Admin API unavailable")
+        return resource
+
+    return SimpleNamespace(
+        utils=SimpleNamespace(
+            verify_api_response_signature=lambda public_id, version, signature: signature_valid,
+            cloudinary_url=lambda public_id, **options: (f"https://res.example.com/{public_id}", options),
+        ),
+        api=SimpleNamespace(resource=api_resource),
+    )
+
+
+class VerifyDirectUploadTests(SimpleTestCase):
+    public_id = f"{CLOUDINARY_FOLDER_NAME}/user-1/inputs/photo"
+
+    def verify(self, stub):
+        with mock.patch.object(cloudinary_config, 'get_cloudinary', return_value=stub):
+            return verify_direct_upload(self.public_id, int(time.time()), "signature", "user-1/inputs", "png")
+
+    def test_size_is_read_from_the_stored_asset(self):
+        result = self.verify(cloudinary_stub(resource={'public_id': self.public_id, 'bytes': 2048}))
+        self.assertTrue(result['success'])
+        self.assertEqual(result['bytes'], 2048)
+
+    def test_upload_is_kept_without_size_when_admin_api_fails(self):
+        result = self.verify(cloudinary_stub(resource=None))
+        self.assertTrue(result['success'])
+        self.assertIsNone(result['bytes'])
+
+    def test_invalid_signature_is_rejected(self):
+        result = self.verify(cloudinary_stub(resource={'bytes': 2048}, signature_valid=False))
+        self.assertFalse(result['success'])
+
+
+class UpdateFileTests(SimpleTestCase):
+    result = {'secure_url': 'https://cdn/x', 'public_id': 'pv/u/moved', 'resource_type': 'image'}
+
+    def test_rename_does_not_overwrite_the_target(self):
+        uploader = mock.Mock(**{'rename.return_value': self.result})
+        with mock.patch.object(cloudinary_config, 'get_cloudinary', return_value=SimpleNamespace(uploader=uploader)):
+            self.assertTrue(cloudinary_config.update_file('pv/u/photo', new_public_id='moved')['success'])
+        uploader.rename.assert_called_once_with('pv/u/photo', 'pv/u/moved', resource_type='image', invalidate=True)
+
+    def test_replacement_overwrites_in_place(self):
+        uploader = mock.Mock(**{'upload.return_value': self.result})
+        with mock.patch.object(cloudinary_config, 'get_cloudinary', return_value=SimpleNamespace(uploader=uploader)):
+            cloudinary_config.update_file('pv/u/photo', new_file=b'png')
+        self.assertTrue(uploader.upload.call_args.kwargs['overwrite'])
+        uploader.destroy.assert_not_called()
+
+class ForkHooksTests(SimpleTestCase):
+    def test_after_fork_resets_inherited_state(self):
+        parent_condition = ai_scheduler._condition
+        with mock.patch.object(supabase_config, '_client', object()):
+            after_fork()
+            self.assertIsNone(supabase_config._client)
+        self.assertIsNot(ai_scheduler._condition, parent_condition)
+
+    @unittest.skipUnless(hasattr(os, 'register_at_fork'), "os.register_at_fork is not available")
+    def test_forked_child_runs_after_fork(self):
+        register_fork_hooks()
+        parent_condition = ai_scheduler._condition
+        pid = os.fork()
+        if pid == 0:
+            os._exit(0 if ai_scheduler._condition is not parent_condition else 1)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+
+
+class RestoreConversationTests(SimpleTestCase):
+    conversation = {'id': 7, 'user_id': 'user-1', 'is_archived': True}
+
+    def restore(self, **select):
+        with mock.patch.object(ConversationArchive, 'select_by_fields', **select), \
+                mock.patch.object(ConversationArchive, 'delete_by_field_in_list') as delete_archive, \
+                mock.patch.object(Conversation, 'update_by_id') as update_conversation, \
+                mock.patch.object(Prompt, 'insert_many', return_value=[]), \
+                mock.patch.object(CloudinaryFile, 'insert_many', return_value=[]):
+            restored = ArchiveService.restore_conversation(dict(self.conversation))
+        return restored, delete_archive, update_conversation
+
+    def test_failed_archive_read_keeps_the_snapshot(self):
+        restored, delete_archive, update_conversation = self.restore(side_effect=Exception("PostgREST error"))
+        self.assertFalse(restored)
+        update_conversation.assert_not_called()
+        delete_archive.assert_not_called()
+
+    def test_missing_archive_row_is_a_failure(self):
+        restored, delete_archive, update_conversation = self.restore(return_value=[])
+        self.assertFalse(restored)
+        update_conversation.assert_not_called()
+        delete_archive.assert_not_called()
+
+    def test_snapshot_round_trip(self):
+        prompts = [{'id': 1, 'text': 'Remove the background', 'response': None}]
+        files = [{'id': 2, 'prompt_id': 1, 'bytes': 2048}]
+        decoded = ArchiveService.decode_snapshot(ArchiveService.encode_snapshot(prompts, files))
+        self.assertEqual(decoded['prompts'], prompts)
+        self.assertEqual(decoded['files'], files)
+
+
+@override_settings(AI_CALLBACK_SECRET='callback-secret')
+class AICallbackTests(SimpleTestCase):
+    def callback_request(self, prompt_id, signed_prompt_id):
+        body = json.dumps({'done': True}).encode()
+        timestamp = str(int(time.time()))
+        return RequestFactory().post(
+            f"/ai/callback/{prompt_id}/", data=body, content_type='application/json',
+            HTTP_X_AI_TIMESTAMP=timestamp,
+            HTTP_X_AI_SIGNATURE=AICallbackService.sign(body, timestamp, signed_prompt_id),
+        )
+
+    def test_signature_is_bound_to_the_prompt(self):
+        self.assertTrue(AICallbackService.verify(self.callback_request(1, 1), 1))
+        # A valid callback of prompt 1 replayed against prompt 2
+        self.assertFalse(AICallbackService.verify(self.callback_request(2, 1), 2))
+
+    def test_pending_prompts_expire_after_the_callback_timeout(self):
+        now = datetime.now(timezone.utc)
+        stale = {'id': 1, 'response': None,
+                 'dispatched_at': (now - timedelta(seconds=CALLBACK_TIMEOUT + 60)).isoformat()}
+        recent = {'id': 2, 'response': None, 'dispatched_at': now.isoformat()}
+        with mock.patch.object(Prompt, 'update_by_id', return_value={'id': 1}) as update:
+            self.assertEqual(AICallbackService.expire_pending([stale, recent]), 1)
+        update.assert_called_once()
+        self.assertTrue(stale['response'])
+        self.assertIsNone(recent['response'])
+
+    def test_final_callback_stores_both_durations(self):
+        dispatched = (datetime.now(timezone.utc) - timedelta(seconds=3)).isoformat()
+        steps = [{'step_type': 'segmentation', 'duration': 1.5}]
+        with mock.patch.object(Prompt, 'select_by_id', return_value={'id': 1, 'conversation_id': 2, 'dispatched_at': dispatched}), \
+                mock.patch.object(Conversation, 'select_by_id', return_value={'id': 2, 'user_id': 'u1'}), \
+                mock.patch.object(Prompt, 'update_by_id') as update, \
+                mock.patch('rest_app.services.ai_callback_service.SupabaseFileService') as files, \
+                mock.patch('rest_app.services.ai_callback_service.ContentVersionService'):
+            self.assertTrue(AICallbackService.handle(1, {'steps': steps, 'done': True, 'duration_ms': 2500}))
+        self.assertAlmostEqual(files.create_step_files.call_args.kwargs['elapsed_ms'], 3000, delta=500)
+        updates = update.call_args.args[1]
+        self.assertEqual(updates['service_duration_ms'], 2500)
+        self.assertAlmostEqual(updates['duration_ms'], 3000, delta=500)
+
+
+LOCAL_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests-default'},
+    'state': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests-state'},
+}
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class IdempotencyServiceTests(SimpleTestCase):
+    key = 'submission-0001'
+
+    def tearDown(self):
+        IdempotencyService.release('user-1', self.key)
+
+    def test_only_the_first_claim_wins(self):
+        self.assertTrue(IdempotencyService.claim('user-1', self.key))
+        self.assertFalse(IdempotencyService.claim('user-1', self.key))
+        # Keys are per user
+        self.assertTrue(IdempotencyService.claim('user-2', self.key))
+        IdempotencyService.release('user-2', self.key)
+
+    def test_released_key_can_be_claimed_again(self):
+        IdempotencyService.claim('user-1', self.key)
+        IdempotencyService.release('user-1', self.key)
+        self.assertTrue(IdempotencyService.claim('user-1', self.key))
+
+    def test_duplicate_gets_the_recorded_result(self):
+        IdempotencyService.claim('user-1', self.key)
+        IdempotencyService.record('user-1', self.key, status='in_flight', conversation_id=3, prompt_id=4)
+        result = IdempotencyService.wait_for_result('user-1', self.key, timeout=0)
+        self.assertEqual(result['conversation_id'], 3)
+
+    def test_duplicate_gives_up_on_a_pending_claim(self):
+        IdempotencyService.claim('user-1', self.key)
+        self.assertIsNone(IdempotencyService.wait_for_result('user-1', self.key, timeout=0.3))
+
+    def test_invalid_keys_are_rejected(self):
+        self.assertFalse(IdempotencyService.is_valid_key('short'))
+        self.assertFalse(IdempotencyService.is_valid_key('no spaces allowed here'))
+        self.assertTrue(IdempotencyService.is_valid_key(self.key))
+
+
+class FairAISchedulerTests(SimpleTestCase):
+    plan_limits = {
+        'default': {'rate_per_minute': 60, 'burst': 2, 'max_concurrent': 1, 'weight': 1},
+        'pro': {'rate_per_minute': 60, 'burst': 2, 'max_concurrent': 2, 'weight': 3},
+    }
+
+    def scheduler(self, max_concurrent=1):
+        return FairAIScheduler(max_concurrent=max_concurrent, plan_limits=self.plan_limits)
+
+    def acquire_in_thread(self, scheduler, user_id, acquired, plan='default'):
+        def run():
+            acquired.append((user_id, scheduler.acquire(user_id, plan, timeout=5)))
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    def wait_for_waiters(self, scheduler, count):
+        deadline = time.monotonic() + 2
+        while len(scheduler._waiting) < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(len(scheduler._waiting), count)
+
+    def test_token_bucket_allows_a_burst_then_throttles(self):
+        bucket = TokenBucket(rate=1.0, capacity=2)
+        self.assertTrue(bucket.take()[0])
+        self.assertTrue(bucket.take()[0])
+        allowed, retry_after = bucket.take()
+        self.assertFalse(allowed)
+        self.assertGreater(retry_after, 0)
+
+    def test_users_take_turns(self):
+        scheduler = self.scheduler()
+        running = scheduler.acquire('alice', timeout=1)
+        acquired = []
+        # Alice queues a second prompt before Bob queues his first
+        first = self.acquire_in_thread(scheduler, 'alice', acquired)
+        self.wait_for_waiters(scheduler, 1)
+        second = self.acquire_in_thread(scheduler, 'bob', acquired)
+        self.wait_for_waiters(scheduler, 2)
+
+        scheduler.release(running)
+        deadline = time.monotonic() + 2
+        while not acquired and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(acquired[0][0], 'bob')
+        scheduler.release(acquired[0][1])
+        first.join(2)
+        second.join(2)
+        self.assertEqual([user for user, _ in acquired], ['bob', 'alice'])
+
+    def test_every_freed_slot_is_handed_out(self):
+        scheduler = self.scheduler(max_concurrent=2)
+        running = [scheduler.acquire('alice', 'pro', timeout=1), scheduler.acquire('alice', 'pro', timeout=1)]
+        acquired = []
+        threads = [self.acquire_in_thread(scheduler, user, acquired) for user in ('bob', 'carol')]
+        self.wait_for_waiters(scheduler, 2)
+
+        # Both slots free up at once, both waiters must get one without waiting for another release
+        for ticket in running:
+            scheduler.release(ticket)
+        for thread in threads:
+            thread.join(2)
+        self.assertEqual(sorted(user for user, _ in acquired), ['bob', 'carol'])
+
+    def test_queue_timeout(self):
+        scheduler = self.scheduler()
+        scheduler.acquire('alice', timeout=1)
+        with self.assertRaises(AIQueueTimeout):
+            scheduler.acquire('bob', timeout=0.1)
+        self.assertFalse(scheduler.status('bob')['queued'])
+
+
+def png_bytes(pixels):
+    """PNG encoding of a grayscale uint8 array"""
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+class ImageHashTests(SimpleTestCase):
+    def setUp(self):
+        import numpy as np
+
+        rng = np.random.default_rng(0)
+        # Smooth structure (a blurred random field) hashes stably across resizes
+        field = rng.random((16, 16))
+        self.image = np.kron(field, np.ones((16, 16)))
+        self.other = np.kron(rng.random((16, 16)), np.ones((16, 16)))
+
+    def hashes(self, *images):
+        import numpy as np
+        from rest_app.utils.image_hash import dhash_batch, phash_batch, prepare_pixels
+
+        pixels = [prepare_pixels(png_bytes((image * 255).astype(np.uint8))) for image in images]
+        return phash_batch([p[0] for p in pixels]), dhash_batch([p[1] for p in pixels])
+
+    def test_resized_copy_is_close_and_other_image_is_far(self):
+        import numpy as np
+        from rest_app.utils.image_hash import hamming_distance
+
+        resized = np.kron(self.image, np.ones((2, 2)))
+        (original, copy, other), (d_original, d_copy, _) = self.hashes(self.image, resized, self.other)
+        self.assertLessEqual(hamming_distance(original, copy), 4)
+        self.assertLessEqual(hamming_distance(d_original, d_copy), 4)
+        self.assertGreater(hamming_distance(original, other), 16)
+
+    def test_batch_matches_single_hashes(self):
+        batch, _ = self.hashes(self.image, self.other)
+        self.assertEqual(batch, self.hashes(self.image)[0] + self.hashes(self.other)[0])
+
+    def test_hex_round_trip(self):
+        from rest_app.utils.image_hash import from_hex, to_hex
+
+        for value in (0, 1, 2 ** 64 - 1, 0x0123456789abcdef):
+            self.assertEqual(len(to_hex(value)), 16)
+            self.assertEqual(from_hex(to_hex(value)), value)
+
+
+class MultiIndexHashTableTests(SimpleTestCase):
+    def test_search_matches_a_linear_scan(self):
+        rng = random.Random(0)
+        table = MultiIndexHashTable()
+        values = {}
+        base = rng.getrandbits(64)
+        for key in range(500):
+            # Half the hashes are near base, so every radius finds something
+            value = rng.getrandbits(64) if key % 2 else base ^ sum(1 << rng.randrange(64) for _ in range(rng.randrange(12)))
+            values[key] = value
+            table.add(key, value)
+
+        for radius in (0, 4, 10, 16):
+            expected = sorted(
+                ((key, bin(base ^ value).count('1')) for key, value in values.items()
+                 if bin(base ^ value).count('1') <= radius),
+                key=lambda match: (match[1], match[0]),
+            )
+            self.assertEqual(table.search(base, radius), expected)
+
+    def test_excluded_key_is_left_out(self):
+        table = MultiIndexHashTable()
+        table.add('a', 0b1011)
+        table.add('b', 0b1010)
+        self.assertEqual(table.search(0b1011, 2, exclude='a'), [('b', 1)])
+        self.assertEqual(len(table), 2)
+
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+
+class ExportTests(SimpleTestCase):
+    conversations = [
+        {'id': 1, 'user_id': 'u1', 'title': 'first', 'created_at': '2024-01-01'},
+        {'id': 2, 'user_id': 'u1', 'title': 'archived', 'created_at': '2024-01-02', 'is_archived': True},
+    ]
+    prompts = [{'id': 10, 'conversation_id': 1, 'text': 'hello', 'response': None}]
+
+    def export(self, files=(), archives=(), **file_read):
+        file_read = file_read or {'return_value': list(files)}
+        with mock.patch.object(Conversation, 'iter_by_fields', return_value=iter(self.conversations)), \
+                mock.patch.object(Prompt, 'iter_pages_by_fields', return_value=iter([self.prompts])), \
+                mock.patch.object(CloudinaryFile, 'select_by_field_in_list', **file_read) as select_files, \
+                mock.patch.object(ConversationArchive, 'select_by_fields', return_value=list(archives)) as select_archive:
+            records = list(SupabaseExportService.iter_user_records('u1'))
+        self.assertTrue(select_files.call_args.kwargs['raise_errors'])
+        self.assertTrue(select_archive.call_args.kwargs['raise_errors'])
+        return records
+
+    def test_records_include_archived_snapshots(self):
+        snapshot = ArchiveService.encode_snapshot([{'id': 20}], [{'id': 30}])
+        records = self.export(files=[{'id': 11, 'prompt_id': 10}], archives=[{'snapshot': snapshot}])
+        self.assertEqual(
+            [(record_type, record['id']) for record_type, record in records],
+            [('conversation', 1), ('prompt', 10), ('file', 11), ('conversation', 2), ('prompt', 20), ('file', 30)],
+        )
+
+    def test_failed_file_read_fails_the_export(self):
+        with self.assertRaises(RuntimeError):
+            self.export(side_effect=RuntimeError('supabase down'))
+
+    @unittest.skipIf(pq is None, "pyarrow is not installed")
+    def test_parquet_keeps_columns_missing_from_the_first_rows(self):
+        # The first conversation has no is_archived key, the second sets it
+        with tempfile.TemporaryDirectory() as output_dir, \
+                mock.patch.object(SupabaseExportService, 'iter_user_records', return_value=iter(
+                    [('conversation', c) for c in self.conversations]
+                )):
+            counts = SupabaseExportService.write_parquet('u1', output_dir, page_size=1)
+            table = pq.read_table(os.path.join(output_dir, 'conversations.parquet'))
+        self.assertEqual(counts, {'conversation': 2})
+        self.assertIn('restored_at', table.column_names)
+        self.assertEqual(table.column('is_archived').to_pylist(), [None, 'true'])
+
+
+# A disposable Postgres database: its public schema is dropped before every test
+MIGRATION_TEST_DB_URL = os.environ.get('MIGRATION_TEST_DB_URL')
+
+
+@unittest.skipUnless(MIGRATION_TEST_DB_URL, "MIGRATION_TEST_DB_URL is not set")
+class MigrationTests(SimpleTestCase):
+    def setUp(self):
+        import psycopg2
+
+        if MIGRATION_TEST_DB_URL == migrator.SUPABASE_DB_URL:
+            self.fail("MIGRATION_TEST_DB_URL is SUPABASE_DB_URL, refusing to drop its schema")
+        self.connection = psycopg2.connect(MIGRATION_TEST_DB_URL)
+        self.addCleanup(self.connection.close)
+        self.execute(
+            "DROP SCHEMA public CASCADE; CREATE SCHEMA public;",
+            f"CREATE TABLE {migrator.get_table_name(migrator.Account)} (id uuid PRIMARY KEY);",
+        )
+
+    def execute(self, *statements):
+        with self.connection, self.connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
+            return cursor.fetchall() if cursor.description else None
+
+    def migrate(self):
+        # Every planned statement is logged, keep it out of the test output
+        with self.assertLogs(migrator.logger, 'INFO'):
+            self.assertTrue(migrator.migrate_all_models(db_url=MIGRATION_TEST_DB_URL))
+
+    def plan(self, model):
+        with self.connection, self.connection.cursor() as cursor:
+            return [
+                statement for statement in migrator.plan_table_changes(cursor, model)
+                if not statement.startswith("CREATE INDEX IF NOT EXISTS")
+            ]
+
+    def drift(self):
+        with self.connection, self.connection.cursor() as cursor:
+            return migrator.find_schema_drift(cursor, migrator.MODELS_TO_MIGRATE)
+
+    def test_check_migrations_command_passes(self):
+        with self.assertLogs(migrator.logger, 'INFO'):
+            call_command('check_migrations', MIGRATION_TEST_DB_URL, stdout=io.StringIO(), stderr=io.StringIO())
+
+    def test_rerun_plans_nothing_and_finds_no_drift(self):
+        self.assertEqual(len(self.drift()), len(migrator.MODELS_TO_MIGRATE) + len(migrator.RPC_FUNCTIONS))
+        self.migrate()
+        self.migrate()
+        self.assertEqual(self.drift(), [])
+        for model in migrator.MODELS_TO_MIGRATE:
+            self.assertEqual(self.plan(model), [], model.__name__)
+
+    def test_missing_column_and_index_are_added_without_losing_rows(self):
+        self.migrate()
+        self.execute(
+            "INSERT INTO accounts (id) VALUES ('00000000-0000-0000-0000-000000000001');",
+            "INSERT INTO conversations (user_id, title, created_at) "
+            "VALUES ('00000000-0000-0000-0000-000000000001', 'kept', now());",
+            "ALTER TABLE conversations DROP COLUMN restored_at, ADD COLUMN legacy text;",
+            "DROP INDEX conversations_user_created_idx;",
+        )
+        self.assertEqual(sorted(self.drift()), [
+            "column conversations.restored_at is missing",
+            "index conversations_user_created_idx on conversations is missing",
+        ])
+        self.assertEqual(self.plan(Conversation), [
+            "ALTER TABLE conversations ADD COLUMN IF NOT EXISTS restored_at timestamp with time zone;",
+        ])
+
+        self.migrate()
+        self.assertEqual(self.drift(), [])
+        # Additive only: the row and the column unknown to the model are still there
+        self.assertEqual(self.execute("SELECT title, legacy FROM conversations;"), [('kept', None)])
+
+    def test_search_prompts_ranks_the_users_matches(self):
+        self.migrate()
+        owner, other = '00000000-0000-0000-0000-000000000001', '00000000-0000-0000-0000-000000000002'
+        self.execute(
+            f"INSERT INTO accounts (id) VALUES ('{owner}'), ('{other}');",
+            f"INSERT INTO conversations (id, user_id, title, created_at) VALUES "
+            f"(1, '{owner}', 'cats', now()), (2, '{other}', 'theirs', now());",
+            "INSERT INTO prompts (id, conversation_id, text, response, created_at) VALUES "
+            "(1, 1, 'segment the cat', 'found one cat and a cat toy', now()), "
+            "(2, 1, 'remove the dog', 'the cat stays', now()), "
+            "(3, 1, 'detect cars', null, now()), "
+            "(4, 2, 'segment the cat', null, now());",
+        )
+        rows = self.execute(f"SELECT id, headline FROM search_prompts('{owner}', 'cat -dog');")
+        self.assertEqual([row[0] for row in rows], [1])
+        self.assertIn('[[mark]]cat[[/mark]]', rows[0][1])
+        self.assertEqual(
+            [row[0] for row in self.execute(f"SELECT id FROM search_prompts('{owner}', 'cat', 1, 1);")], [2]
+        )
+
+    def test_recompute_usage_buckets_by_utc_day(self):
+        self.migrate()
+        owner = '00000000-0000-0000-0000-000000000001'
+        self.execute(
+            # UTC+14: a session-local day would move 23:00 UTC to the next day
+            "SET TIME ZONE 'Pacific/Kiritimati';",
+            f"INSERT INTO accounts (id) VALUES ('{owner}');",
+            f"INSERT INTO conversations (id, user_id, title, created_at) VALUES (1, '{owner}', 'late', now());",
+            "INSERT INTO prompts (id, conversation_id, text, created_at) VALUES "
+            "(1, 1, 'late prompt', '2024-03-01 23:00+00'), (2, 1, 'next prompt', '2024-03-02 01:00+00');",
+            "INSERT INTO files (user_id, prompt_id, public_id, filename, url, resource_type, step_type, step_index, bytes) "
+            f"VALUES ('{owner}', 1, 'a', 'a.png', 'https://x/a', 'image', 'output', 0, 10), "
+            f"('{owner}', 1, 'b', 'b.png', 'https://x/b', 'image', 'segmentation', 1, 5);",
+            f"SELECT recompute_usage('{owner}');",
+        )
+        self.assertEqual(
+            self.execute("SELECT day::text, prompts, images, steps, bytes_stored FROM usage_daily ORDER BY day;"),
+            [('2024-03-01', 1, 1, 1, 15), ('2024-03-02', 1, 0, 0, 0)],
+        )
+        self.assertEqual(self.execute("SELECT prompts, images, steps, bytes_stored FROM usage_totals;"), [(2, 1, 1, 15)])
+
+    def test_step_latency_report_percentiles(self):
+        self.migrate()
+        owner = '00000000-0000-0000-0000-000000000001'
+        files = ", ".join(
+            f"('{owner}', 1, 'f{i}', 'f.png', 'https://x/f', 'image', 'segmentation', {i}, {ms}, {ms + 50})"
+            for i, ms in enumerate((100, 200, 300, 400))
+        )
+        self.execute(
+            f"INSERT INTO accounts (id) VALUES ('{owner}');",
+            f"INSERT INTO conversations (id, user_id, title, created_at) VALUES (1, '{owner}', 't', now());",
+            "INSERT INTO prompts (id, conversation_id, text, created_at, duration_ms, service_duration_ms) "
+            "VALUES (1, 1, 'p', '2024-03-01 12:00+00', 2000, NULL);",
+            "INSERT INTO files (user_id, prompt_id, public_id, filename, url, resource_type, step_type, step_index, "
+            f"duration_ms, elapsed_ms) VALUES {files};",
+        )
+        rows = self.execute(
+            "SELECT step_type, samples, service_p50_ms, service_p95_ms, client_p50_ms, client_p95_ms "
+            "FROM step_latency_report('2024-01-01', 'month');"
+        )
+        self.assertEqual(rows, [
+            ('segmentation', 4, 250.0, 385.0, 300.0, 435.0),
+            # The service reported no total, only the measured time is summarized
+            ('total', 1, None, None, 2000.0, 2000.0),
+        ])
+
+
+
+class BulkDeletionTests(SimpleTestCase):
+    """delete_user_data against an in-memory `files` table and Cloudinary"""
+
+    def setUp(self):
+        self.rows = [
+            {'id': i, 'user_id': 'u1', 'public_id': f"pv/u1/steps/{i}", 'resource_type': 'image'}
+            for i in range(1, 8)
+        ]
+        # Cloudinary keeps failing for these assets
+        self.stuck = {'pv/u1/steps/2', 'pv/u1/steps/6'}
+        self.read_error = None
+        self.reads = 0
+        self.cloudinary_calls = []
+
+        patches = [
+            mock.patch.object(CloudinaryFile, 'iter_pages_by_fields', side_effect=self.iter_pages),
+            mock.patch.object(CloudinaryFile, 'delete_by_field_in_list', side_effect=self.delete_rows),
+            mock.patch('rest_app.services.deletion_service.delete_files', side_effect=self.destroy),
+            mock.patch('rest_app.services.deletion_service.delete_files_by_prefix',
+                       return_value={'success': True, 'deleted': {}, 'partial': False}),
+            mock.patch('rest_app.services.deletion_service.ContentVersionService'),
+            mock.patch('rest_app.services.deletion_service.UsageService'),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        conversations = mock.patch.object(Conversation, 'delete_by_field_in_list', return_value=3)
+        self.delete_conversations = conversations.start()
+        self.addCleanup(conversations.stop)
+
+    def iter_pages(self, fields, page_size):
+        # Keyset paging over the live rows, as the mixin does
+        last_id = 0
+        while True:
+            self.reads += 1
+            if self.read_error:
+                raise self.read_error
+            page = [r for r in self.rows if r['id'] > last_id][:page_size]
+            if not page:
+                return
+            yield page
+            last_id = page[-1]['id']
+
+    def delete_rows(self, field_name, values):
+        before = len(self.rows)
+        self.rows = [r for r in self.rows if r[field_name] not in values]
+        return before - len(self.rows)
+
+    def destroy(self, public_ids, resource_type):
+        self.assertLessEqual(len(public_ids), 100)
+        self.cloudinary_calls.append(list(public_ids))
+        return {'success': True, 'deleted': {
+            public_id: 'rate_limited' if public_id in self.stuck else 'deleted' for public_id in public_ids
+        }}
+
+    def test_failed_rows_are_counted_once(self):
+        result = BulkDeletionService.delete_user_data('u1', page_size=3)
+        self.assertEqual(result, {'success': False, 'deleted': 5, 'failed': 2})
+        # Every asset was tried exactly once and the failed rows are kept for a rerun
+        self.assertEqual(sorted(len(c) for c in self.cloudinary_calls), [1, 3, 3])
+        self.assertEqual([r['id'] for r in self.rows], [2, 6])
+        self.delete_conversations.assert_not_called()
+
+    def test_rerun_finishes_once_cloudinary_recovers(self):
+        BulkDeletionService.delete_user_data('u1', page_size=3)
+        self.stuck = set()
+        result = BulkDeletionService.delete_user_data('u1', page_size=3)
+        self.assertEqual(result, {'success': True, 'deleted': 2, 'failed': 0})
+        self.delete_conversations.assert_called_once_with('user_id', ['u1'])
+
+    def test_read_error_keeps_the_user_data(self):
+        self.read_error = RuntimeError('supabase down')
+        result = BulkDeletionService.delete_user_data('u1')
+        self.assertFalse(result['success'])
+        self.assertEqual(len(self.rows), 7)
+        self.delete_conversations.assert_not_called()
+
+
+
+
+class ConversationUpdatesTests(SimpleTestCase):
+    def poll(self, cursor, prompts, files):
+        request = RequestFactory().get('/updates', {'cursor': cursor})
+        request.session = {'user_id': 'u1'}
+        with mock.patch.object(Conversation, 'select_by_id', return_value={'id': 3, 'user_id': 'u1'}), \
+                mock.patch.object(Prompt, 'select_by_fields', return_value=prompts), \
+                mock.patch.object(CloudinaryFile, 'select_by_field_in_list', return_value=files) as select_files, \
+                mock.patch.object(CloudinaryFile, 'select_by_fields') as select_user_files:
+            response = conversation_updates_view(request, 3)
+        select_user_files.assert_not_called()
+        select_files.assert_called_once_with('prompt_id', [p['id'] for p in prompts], order_by='id')
+        return json.loads(response.content)
+
+    def test_cursor_waits_for_pending_prompts_and_skips_sent_files(self):
+        done = {'id': 5, 'text': 'first', 'response': '"ok"'}
+        pending = {'id': 6, 'text': 'second', 'response': None}
+        data = self.poll('4.10', [done, pending], [
+            {'id': 9, 'prompt_id': 5}, {'id': 12, 'prompt_id': 5}, {'id': 13, 'prompt_id': 6},
+        ])
+        self.assertEqual([p['id'] for p in data['prompts']], [5, 6])
+        self.assertEqual([f['id'] for f in data['files']], [12, 13])
+        # The pending prompt stays behind the cursor, the files do not
+        self.assertEqual(data['cursor'], '5.13')
+
+        answered = dict(pending, response='"done"')
+        data = self.poll(data['cursor'], [answered], [{'id': 13, 'prompt_id': 6}, {'id': 14, 'prompt_id': 6}])
+        self.assertEqual([f['id'] for f in data['files']], [14])
+        self.assertEqual(data['cursor'], '6.14')
+
+    def test_nothing_new_keeps_the_cursor(self):
+        self.assertEqual(self.poll('6.14', [], [])['cursor'], '6.14')
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class FolderListingTests(SimpleTestCase):
+    pages = {
+        None: {'resources': [{'public_id': 'a'}, {'public_id': 'b'}], 'next_cursor': 'page-2'},
+        'page-2': {'resources': [{'public_id': 'c'}]},
+    }
+
+    def setUp(self):
+        cache.clear()
+        self.resources = mock.Mock(side_effect=lambda **options: self.pages[options.get('next_cursor')])
+        patcher = mock.patch.object(
+            cloudinary_config, 'get_cloudinary', return_value=SimpleNamespace(api=SimpleNamespace(resources=self.resources))
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_pages_are_cached_per_cursor(self):
+        first = cloudinary_config.get_files_in_folder('pv/u1', max_results=2)
+        self.assertEqual(first['next_cursor'], 'page-2')
+        self.assertEqual(cloudinary_config.get_files_in_folder('pv/u1', max_results=2), first)
+        self.assertEqual(self.resources.call_count, 1)
+
+        second = cloudinary_config.get_files_in_folder('pv/u1', max_results=2, next_cursor='page-2')
+        self.assertEqual([f['public_id'] for f in second['files']], ['c'])
+        self.assertIsNone(second['next_cursor'])
+        self.assertEqual(self.resources.call_count, 2)
+
+    def test_page_size_is_capped(self):
+        cloudinary_config.get_files_in_folder('pv/u1', max_results=10_000)
+        self.assertEqual(self.resources.call_args.kwargs['max_results'], cloudinary_config.LISTING_MAX_PAGE_SIZE)
+
+    def test_failures_are_not_cached(self):
+        self.resources.side_effect = Exception("rate limited")
+        self.assertFalse(cloudinary_config.get_files_in_folder('pv/u1')['success'])
+        self.resources.side_effect = lambda **options: self.pages[options.get('next_cursor')]
+        self.assertTrue(cloudinary_config.get_files_in_folder('pv/u1')['success'])
+
+    def test_iteration_follows_the_cursor(self):
+        files = cloudinary_config.iter_files_in_folder('pv/u1', page_size=2)
+        self.assertEqual([f['public_id'] for f in files], ['a', 'b', 'c'])
+
+
+class LazyClientTests(SimpleTestCase):
+    def test_sdks_are_not_imported_with_the_app(self):
+        code = (
+            "import sys, django; django.setup(); "
+            "import rest_app.urls, rest_app.services.deletion_service, rest_app.services.export_service; "
+            "print(sorted(m for m in ('supabase', 'cloudinary', 'numpy') if m in sys.modules))"
+        )
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE='promptvision_app.settings')
+        output = subprocess.run([sys.executable, '-c', code], env=env, capture_output=True, text=True, check=True)
+        self.assertEqual(output.stdout.strip(), '[]')
+
+    def test_client_is_built_once_per_process(self):
+        with mock.patch.object(supabase_config, '_client', None), \
+                mock.patch.object(supabase_config, '_client_pid', None), \
+                mock.patch.object(supabase_config, 'get_new_supabase_client', side_effect=object) as build, \
+                mock.patch('os.getpid', return_value=100):
+            first = supabase_config.get_supabase_client()
+            self.assertIs(supabase_config.get_supabase_client(), first)
+            self.assertEqual(build.call_count, 1)
+
+            # A forked child gets its own client
+            os.getpid.return_value = 101
+            self.assertIsNot(supabase_config.get_supabase_client(), first)
+            self.assertEqual(build.call_count, 2)
+
+
+class PromptSearchTests(SimpleTestCase):
+    def search(self, rows, **kwargs):
+        rpc = mock.Mock(**{'return_value.execute.return_value': SimpleNamespace(data=rows)})
+        with mock.patch('rest_app.services.search_service.get_supabase_client', return_value=SimpleNamespace(rpc=rpc)):
+            return PromptSearchService.search('u1', 'cat', **kwargs), rpc
+
+    def test_extra_row_only_flags_a_next_page(self):
+        result, rpc = self.search([{'id': i} for i in range(3)], page=2, page_size=2)
+        self.assertEqual(result, {'results': [{'id': 0}, {'id': 1}], 'has_next': True})
+        rpc.assert_called_once_with('search_prompts', {'p_user_id': 'u1', 'p_query': 'cat', 'p_limit': 3, 'p_offset': 2})
+        self.assertFalse(self.search([{'id': 0}], page_size=2)[0]['has_next'])
+
+    def test_blank_query_does_not_hit_the_database(self):
+        with mock.patch('rest_app.services.search_service.get_supabase_client') as client:
+            self.assertEqual(PromptSearchService.search('u1', '   '), {'results': [], 'has_next': False})
+        client.assert_not_called()
+
+    def test_highlight_escapes_everything_but_the_marks(self):
+        self.assertEqual(
+            PromptSearchService.render_highlight('<b>a</b> [[mark]]cat[[/mark]]'),
+            '&lt;b&gt;a&lt;/b&gt; <mark>cat</mark>',
+        )
+
+
+def asset_url(public_id, version=1, transformations=''):
+    return f"https://res.cloudinary.com/demo/image/upload/{transformations}v{version}/{public_id}.png"
+
+
+class FakeDownload:
+    """requests.get stand-in serving `size` bytes per URL, optionally blocking until released"""
+
+    def __init__(self, size=100):
+        self.size = size
+        self.urls = []
+        self.release = threading.Event()
+        self.release.set()
+        self.error = None
+
+    def __call__(self, url, stream=False, timeout=None):
+        self.urls.append(url)
+        self.release.wait(5)
+        if self.error:
+            raise self.error
+        body = url.encode().ljust(self.size, b'.')
+        return mock.MagicMock(**{
+            'content': body,
+            '__enter__.return_value.iter_content.return_value': [body[:10], body[10:]],
+        })
+
+
+class AssetCacheTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.download = FakeDownload()
+        patcher = mock.patch('rest_app.utils.asset_cache.requests.get', side_effect=self.download)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Room for two entries of 100 bytes
+        self.cache = AssetCache(directory=directory.name, max_bytes=250)
+
+    def cached_files(self):
+        return sorted(path.name for path in self.cache.directory.rglob('*') if path.is_file())
+
+    def test_keys_follow_version_and_delivery_options(self):
+        self.assertIsNone(cache_key("https://res.cloudinary.com/demo/image/upload/photo.png"))
+        self.assertEqual(cache_key(asset_url('photo') + '?_a=1'), cache_key(asset_url('photo')))
+        self.assertNotEqual(cache_key(asset_url('photo', version=2)), cache_key(asset_url('photo')))
+        self.assertNotEqual(cache_key(asset_url('photo', transformations='w_100/')), cache_key(asset_url('photo')))
+
+    def test_hits_are_served_from_disk(self):
+        body = self.cache.read(asset_url('photo'))
+        self.assertEqual(self.cache.read(asset_url('photo')), body)
+        self.assertEqual(len(self.download.urls), 1)
+
+    def test_unversioned_urls_bypass_the_cache(self):
+        url = "https://example.com/photo.png"
+        self.cache.read(url)
+        self.cache.read(url)
+        self.assertEqual(len(self.download.urls), 2)
+        self.assertEqual(self.cached_files(), [])
+
+    def test_concurrent_misses_share_one_download(self):
+        self.download.release.clear()
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.cache.get_path(asset_url('photo'))))
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+        self.download.release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(len(self.download.urls), 1)
+        self.assertEqual(len(set(results)), 1)
+
+    def test_failed_fill_leaves_nothing_behind(self):
+        self.download.error = RuntimeError("connection reset")
+        with self.assertRaises(RuntimeError):
+            self.cache.get_path(asset_url('photo'))
+        self.assertEqual(self.cached_files(), [])
+
+    def test_least_recently_used_entry_is_evicted(self):
+        first, second = self.cache.get_path(asset_url('first')), self.cache.get_path(asset_url('second'))
+        os.utime(first, (1000, 1000))
+        os.utime(second, (2000, 2000))
+        # A hit refreshes the first entry, so the second is now the oldest
+        self.cache.get_path(asset_url('first'))
+        self.cache.get_path(asset_url('third'))
+        self.assertTrue(first.exists())
+        self.assertFalse(second.exists())
+        self.assertEqual(len(self.cached_files()), 2)
+
+
+class UsageServiceTests(SimpleTestCase):
+    # 03:00 UTC is still the previous day in Los Angeles
+    now = datetime(2024, 3, 1, 3, 0, tzinfo=timezone.utc)
+
+    def record(self, method, *args, **kwargs):
+        rpc = mock.Mock()
+        with mock.patch('rest_app.services.usage_service.get_supabase_client', return_value=SimpleNamespace(rpc=rpc)), \
+                mock.patch('django.utils.timezone.now', return_value=self.now), \
+                override_settings(TIME_ZONE='America/Los_Angeles'):
+            recorded = method(*args, **kwargs)
+        return recorded, rpc
+
+    def test_days_are_utc_whatever_the_time_zone(self):
+        recorded, rpc = self.record(UsageService.record, 'u1', prompts=1)
+        self.assertTrue(recorded)
+        self.assertEqual(rpc.call_args.args[1]['p_day'], '2024-03-01')
+
+    def test_files_count_images_steps_and_bytes(self):
+        files = [
+            {'step_type': 'input', 'bytes': 1},
+            {'step_type': 'segmentation', 'bytes': 2},
+            {'step_type': 'output', 'bytes': 4},
+            {'step_type': 'output', 'bytes': None},
+        ]
+        _, rpc = self.record(UsageService.record_files, 'u1', files)
+        self.assertEqual(rpc.call_args.args[1], {
+            'p_user_id': 'u1', 'p_day': '2024-03-01', 'p_prompts': 0, 'p_images': 2, 'p_steps': 1, 'p_bytes': 7,
+        })
+        # Deleting only gives the storage back
+        _, rpc = self.record(UsageService.record_files, 'u1', files, sign=-1)
+        self.assertEqual((rpc.call_args.args[1]['p_images'], rpc.call_args.args[1]['p_bytes']), (0, -7))
+
+    def test_nothing_to_record_skips_the_database(self):
+        recorded, rpc = self.record(UsageService.record, 'u1')
+        self.assertFalse(recorded)
+        rpc.assert_not_called()
+
+
+class LatencyServiceTests(SimpleTestCase):
+    def test_reported_duration_sources(self):
+        self.assertEqual(LatencyService.reported_duration_ms({'duration_ms': 1500.4}), 1500)
+        self.assertEqual(LatencyService.reported_duration_ms({'duration': '1.25'}), 1250)
+        self.assertEqual(LatencyService.reported_duration_ms({'reasoning_info': {'duration': 2}}), 2000)
+        # Invalid or negative values fall through to the next source
+        self.assertEqual(LatencyService.reported_duration_ms({'duration_ms': 'n/a', 'duration': 0.5}), 500)
+        self.assertIsNone(LatencyService.reported_duration_ms({'duration_ms': -1}))
+        self.assertIsNone(LatencyService.reported_duration_ms('1000'))
+
+    def test_elapsed_since_dispatch(self):
+        dispatched = datetime.now(timezone.utc) - timedelta(seconds=2)
+        self.assertAlmostEqual(LatencyService.elapsed_since_ms(dispatched.isoformat()), 2000, delta=500)
+        # Naive timestamps are UTC
+        self.assertAlmostEqual(LatencyService.elapsed_since_ms(dispatched.replace(tzinfo=None)), 2000, delta=500)
+        # Clock skew never gives a negative time
+        self.assertEqual(LatencyService.elapsed_since_ms(datetime.now(timezone.utc) + timedelta(minutes=1)), 0)
+        self.assertIsNone(LatencyService.elapsed_since_ms(None))
+        self.assertIsNone(LatencyService.elapsed_since_ms('not a date'))
+
+    def test_report_rejects_unknown_buckets(self):
+        with self.assertRaises(ValueError):
+            LatencyService.report(bucket='minute; DROP TABLE prompts')
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class PageCacheTests(SimpleTestCase):
+    conversations = [
+        {'id': 2, 'user_id': 'u1', 'is_archived': True},
+        {'id': 1, 'user_id': 'u1', 'is_archived': False},
+    ]
+
+    def setUp(self):
+        cache.clear()
+        self.loads = []
+
+        async def select_conversations(**kwargs):
+            self.loads.append('conversations')
+            await asyncio.sleep(0.05)
+            return list(self.conversations)
+
+        async def select_conversation(conversation_id):
+            self.loads.append(('conversation', conversation_id))
+            return next(c for c in self.conversations if c['id'] == conversation_id)
+
+        patches = [
+            mock.patch.object(Conversation, 'aselect_by_fields', side_effect=select_conversations),
+            mock.patch.object(Conversation, 'aselect_by_id', side_effect=select_conversation),
+            mock.patch.object(Prompt, 'aselect_by_fields', return_value=[{'id': 10}]),
+            mock.patch.object(CloudinaryFile, 'aselect_by_field_in_list', return_value=[{'id': 20, 'prompt_id': 10}]),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_entries_are_reused_until_a_version_bump(self):
+        self.assertEqual(PageCacheService.get_conversations('u1'), self.conversations)
+        PageCacheService.get_conversations('u1')
+        self.assertEqual(self.loads, ['conversations'])
+
+        ContentVersionService.bump_user('u1')
+        PageCacheService.get_conversations('u1')
+        self.assertEqual(self.loads, ['conversations', 'conversations'])
+
+    def test_bundle_is_keyed_by_the_conversation_version(self):
+        bundle = PageCacheService.get_conversation_bundle('u1', 1)
+        self.assertEqual(bundle['files'], [{'id': 20, 'prompt_id': 10}])
+        PageCacheService.get_conversation_bundle('u1', 1)
+        ContentVersionService.bump_conversation(1)
+        PageCacheService.get_conversation_bundle('u1', 1)
+        self.assertEqual(self.loads, [('conversation', 1), ('conversation', 1)])
+
+    def test_failed_loads_are_not_cached(self):
+        Conversation.aselect_by_fields.side_effect = RuntimeError('supabase down')
+        self.assertEqual(PageCacheService.get_conversations('u1'), [])
+        Conversation.aselect_by_fields.side_effect = None
+        Conversation.aselect_by_fields.return_value = self.conversations
+        self.assertEqual(PageCacheService.get_conversations('u1'), self.conversations)
+
+    def test_warm_fills_the_list_and_latest_active_conversation(self):
+        PageCacheService.warm('u1')
+        self.assertEqual(self.loads, ['conversations', ('conversation', 1)])
+        PageCacheService.get_detail_page('u1', 1)
+        self.assertEqual(len(self.loads), 2)
+
+    def test_concurrent_fills_share_one_load(self):
+        threads = [threading.Thread(target=PageCacheService.get_conversations, args=('u1',)) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(self.loads, ['conversations'])
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class PageETagTests(SimpleTestCase):
+    def get(self, path='/', csrf='token-1', **headers):
+        request = RequestFactory().get(path, **headers)
+        request.session = {'user_id': 'u1'}
+        request.COOKIES['csrftoken'] = csrf
+        request._messages = CookieStorage(request)
+        return request
+
+    def test_unchanged_page_is_not_modified(self):
+        etag = f'"{conversation_list_etag(self.get())}"'
+        with mock.patch.object(PageCacheService, 'get_conversations') as get_conversations:
+            response = conversation_list_view(self.get(HTTP_IF_NONE_MATCH=etag))
+        self.assertEqual(response.status_code, 304)
+        get_conversations.assert_not_called()
+
+    def test_etag_follows_versions_and_session(self):
+        etag = conversation_detail_etag(self.get(), 1)
+        self.assertEqual(conversation_detail_etag(self.get(), 1), etag)
+        # A login rotates the CSRF cookie embedded in the page
+        self.assertNotEqual(conversation_detail_etag(self.get(csrf='token-2'), 1), etag)
+        ContentVersionService.bump_conversation(1)
+        self.assertNotEqual(conversation_detail_etag(self.get(), 1), etag)
+        etag = conversation_detail_etag(self.get(), 1)
+        # The sidebar is part of the page
+        ContentVersionService.bump_user('u1')
+        self.assertNotEqual(conversation_detail_etag(self.get(), 1), etag)
+
+    def test_pending_messages_disable_conditional_responses(self):
+        request = self.get()
+        request._messages.add(20, "Saved")
+        self.assertIsNone(conversation_detail_etag(request, 1))
+
+
+class FakeQuery:
+    """The subset of the PostgREST query builder used by SupabaseModelMixin, over in-memory rows"""
+
+    def __init__(self, client, table):
+        self.client, self.table = client, table
+        self.filters, self.orders = [], []
+        self.bounds = (0, None)
+        self.changes = None
+
+    def select(self, columns):
+        return self
+
+    def update(self, changes):
+        self.changes = changes
+        return self
+
+    def _filter(self, description, predicate):
+        self.filters.append((description, predicate))
+        return self
+
+    # PostgREST receives filter values as URL text and casts them to the column type
+    def eq(self, field, value):
+        return self._filter(('eq', field, value), lambda row: str(row.get(field)) == str(value))
+
+    def gt(self, field, value):
+        return self._filter(('gt', field, value), lambda row: row.get(field) is not None and row[field] > value)
+
+    def lt(self, field, value):
+        return self._filter(('lt', field, value), lambda row: row.get(field) is not None and row[field] < value)
+
+    def is_(self, field, value):
+        return self._filter(('is', field, value), lambda row: row.get(field) is None)
+
+    def in_(self, field, values):
+        return self._filter(('in', field, tuple(values)), lambda row: str(row.get(field)) in map(str, values))
+
+    def order(self, field, desc=False):
+        self.orders.append((field, desc))
+        return self
+
+    def limit(self, count):
+        self.bounds = (0, count)
+        return self
+
+    def range(self, start, end):
+        self.bounds = (start, end - start + 1)
+        return self
+
+    def execute(self):
+        self.client.requests.append((self.table, [description for description, _ in self.filters], self.bounds))
+        if self.client.error:
+            raise self.client.error
+        rows = [row for row in self.client.tables[self.table] if all(p(row) for _, p in self.filters)]
+        if self.changes is not None:
+            for row in rows:
+                row.update(self.changes)
+        # Postgres puts NULLs last ascending, first descending
+        for field, desc in reversed(self.orders):
+            rows.sort(key=lambda row: (row.get(field) is None, row.get(field) or 0), reverse=desc)
+        start, count = self.bounds
+        count = min(count or self.client.max_rows, self.client.max_rows)
+        return SimpleNamespace(data=[dict(row) for row in rows[start:start + count]])
+
+
+class FakeSupabase:
+    def __init__(self, max_rows=10_000, **tables):
+        self.tables = tables
+        self.max_rows = max_rows
+        self.requests = []
+        self.error = None
+
+    def table(self, name):
+        return FakeQuery(self, name)
+
+
+def patch_supabase(test, client):
+    patcher = mock.patch('rest_app.models.model.get_supabase_client', return_value=client)
+    patcher.start()
+    test.addCleanup(patcher.stop)
+    return client
+
+
+class InListQueryTests(SimpleTestCase):
+    def setUp(self):
+        rows = [{'id': i, 'prompt_id': i % 250, 'step_index': None if i % 7 == 0 else i % 11} for i in range(1, 501)]
+        self.client = patch_supabase(self, FakeSupabase(files=rows))
+
+    def test_chunks_merge_like_one_ordered_query(self):
+        values = list(range(250))
+        for desc in (False, True):
+            rows = CloudinaryFile.select_by_field_in_list('prompt_id', values, order_by='step_index', desc=desc)
+            steps = [row['step_index'] for row in rows]
+            non_null = sorted(s for s in steps if s is not None)
+            nulls = [None] * steps.count(None)
+            self.assertEqual(steps, nulls + non_null[::-1] if desc else non_null + nulls)
+            self.assertEqual(len(rows), 500)
+        # 250 values in IN filters of at most 100 values
+        sizes = [len(filters[0][2]) for _, filters, _ in self.client.requests[:3]]
+        self.assertEqual(sorted(sizes), [50, 100, 100])
+
+    def test_unordered_results_follow_the_chunks(self):
+        rows = CloudinaryFile.select_by_field_in_list('id', list(range(300, 0, -1)) + [300])
+        chunk_of = {value: i // 100 for i, value in enumerate(range(300, 0, -1))}
+        self.assertEqual(len(rows), 300)
+        self.assertEqual([chunk_of[row['id']] for row in rows], sorted(chunk_of[row['id']] for row in rows))
+
+    def test_empty_list_matches_nothing_without_a_request(self):
+        self.assertEqual(CloudinaryFile.select_by_field_in_list('id', []), [])
+        self.assertEqual(self.client.requests, [])
+
+    def test_failed_chunk_fails_the_whole_read(self):
+        self.client.error = RuntimeError('supabase down')
+        self.assertEqual(CloudinaryFile.select_by_field_in_list('id', list(range(250))), [])
+        with self.assertRaises(RuntimeError):
+            CloudinaryFile.select_by_field_in_list('id', list(range(250)), raise_errors=True)
+
+
+class AsyncFakeQuery(FakeQuery):
+    async def execute(self):
+        client = self.client
+        client.in_flight += 1
+        client.max_in_flight = max(client.max_in_flight, client.in_flight)
+        try:
+            await asyncio.sleep(client.latency)
+            return super().execute()
+        finally:
+            client.in_flight -= 1
+
+
+class AsyncFakeSupabase(FakeSupabase):
+    """FakeSupabase with awaitable queries taking `latency` seconds each"""
+    latency = 0.05
+    in_flight = max_in_flight = 0
+
+    def table(self, name):
+        return AsyncFakeQuery(self, name)
+
+
+class AsyncQueryTests(SimpleTestCase):
+    def setUp(self):
+        self.client = AsyncFakeSupabase(
+            conversations=[{'id': 1, 'user_id': 'u1'}],
+            prompts=[{'id': i, 'conversation_id': 1, 'created_at': f"2024-01-{i:02d}"} for i in range(1, 6)],
+            files=[{'id': i, 'prompt_id': i % 150, 'step_index': i % 4} for i in range(1, 301)],
+        )
+        patcher = mock.patch('rest_app.models.model.get_async_supabase_client', new=mock.AsyncMock(return_value=self.client))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_gathered_queries_overlap_and_keep_argument_order(self):
+        started = time.monotonic()
+        conversation, prompts, missing = run_queries(
+            Conversation.aselect_by_id(1),
+            Prompt.aselect_by_fields(fields={'conversation_id': 1}, order_by='created_at', desc=True),
+            Conversation.aselect_by_id(2),
+        )
+        self.assertLess(time.monotonic() - started, 3 * self.client.latency)
+        self.assertEqual(self.client.max_in_flight, 3)
+        self.assertEqual(conversation['id'], 1)
+        self.assertEqual([p['id'] for p in prompts], [5, 4, 3, 2, 1])
+        self.assertIsNone(missing)
+
+    def test_in_list_chunks_are_fetched_concurrently_and_merged(self):
+        sync_client = patch_supabase(self, FakeSupabase(**self.client.tables))
+        values = list(range(150))
+        rows, = run_queries(CloudinaryFile.aselect_by_field_in_list('prompt_id', values, order_by='step_index'))
+        self.assertEqual(self.client.max_in_flight, 2)
+        self.assertEqual(rows, CloudinaryFile.select_by_field_in_list('prompt_id', values, order_by='step_index'))
+        self.assertEqual(len(sync_client.requests), 2)
+
+    def test_errors_are_handled_like_the_sync_methods(self):
+        self.client.error = RuntimeError('supabase down')
+        self.assertEqual(run_queries(Prompt.aselect_by_fields(fields={'conversation_id': 1})), [[]])
+        with self.assertRaises(RuntimeError):
+            run_queries(Prompt.aselect_by_fields(fields={'conversation_id': 1}, raise_errors=True))
+
+    def test_gather_queries_from_async_code(self):
+        async def view():
+            return await gather_queries(Conversation.aselect_by_id(1), Prompt.aselect_by_fields(limit=2))
+
+        conversation, prompts = asyncio.run(view())
+        self.assertEqual((conversation['id'], len(prompts)), (1, 2))
+
+
+class PagedIterationTests(SimpleTestCase):
+    def setUp(self):
+        # Many ties on created_at, broken by id
+        self.rows = [{'id': i, 'user_id': 'u1', 'created_at': f"2024-01-{i % 3 + 1:02d}"} for i in range(1, 26)]
+        self.client = patch_supabase(self, FakeSupabase(conversations=self.rows))
+
+    def test_id_order_pages_by_keyset(self):
+        pages = list(Conversation.iter_pages_by_fields(fields={'user_id': 'u1'}, page_size=10))
+        self.assertEqual([len(page) for page in pages], [10, 10, 5])
+        self.assertEqual([row['id'] for page in pages for row in page], list(range(1, 26)))
+        # No offsets: each page starts after the last id seen, and an empty page ends it
+        self.assertEqual([bounds for _, _, bounds in self.client.requests], [(0, 10)] * 4)
+        self.assertEqual([filters[-1] for _, filters, _ in self.client.requests[1:]],
+                         [('gt', 'id', 10), ('gt', 'id', 20), ('gt', 'id', 25)])
+
+    def test_descending_keyset(self):
+        ids = [row['id'] for row in Conversation.iter_by_fields(order_by='id', desc=True, page_size=10)]
+        self.assertEqual(ids, list(range(25, 0, -1)))
+        self.assertEqual(self.client.requests[1][1][-1], ('lt', 'id', 16))
+
+    def test_rows_deleted_meanwhile_do_not_shift_keyset_pages(self):
+        seen = []
+        for page in Conversation.iter_pages_by_fields(page_size=10):
+            seen.extend(row['id'] for row in page)
+            # Deleting what was just read would make an offset skip the next rows
+            self.client.tables['conversations'] = [r for r in self.client.tables['conversations'] if r['id'] not in seen]
+        self.assertEqual(seen, list(range(1, 26)))
+
+    def test_other_orders_page_by_range_with_id_tie_break(self):
+        rows = list(Conversation.iter_by_fields(order_by='created_at', page_size=10))
+        self.assertEqual(rows, sorted(self.rows, key=lambda row: (row['created_at'], row['id'])))
+        self.assertEqual([bounds for _, _, bounds in self.client.requests], [(0, 10), (10, 10), (20, 10), (25, 10)])
+
+    def test_pages_truncated_by_max_rows_do_not_end_iteration(self):
+        self.client.max_rows = 4
+        ids = [row['id'] for row in Conversation.iter_by_fields(order_by='created_at', page_size=10)]
+        self.assertEqual(sorted(ids), list(range(1, 26)))
+        self.assertEqual(len(ids), 25)
+
+    def test_read_errors_are_raised(self):
+        self.client.error = RuntimeError('supabase down')
+        with self.assertRaises(RuntimeError):
+            list(Conversation.iter_by_fields())
+
+
+class RequestLoaderTests(SimpleTestCase):
+    def setUp(self):
+        tables = {
+            'conversations': [{'id': i, 'user_id': 'u1', 'title': f"t{i}"} for i in range(1, 6)],
+            'prompts': [{'id': i, 'conversation_id': 1} for i in range(1, 4)],
+        }
+        self.client = patch_supabase(self, FakeSupabase(**tables))
+        self.async_client = AsyncFakeSupabase(**tables)
+        patcher = mock.patch('rest_app.models.model.get_async_supabase_client',
+                             new=mock.AsyncMock(return_value=self.async_client))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        scope = request_scope()
+        scope.__enter__()
+        self.addCleanup(scope.__exit__, None, None, None)
+
+    def test_rows_are_fetched_once_per_request(self):
+        Conversation.select_by_fields(fields={'user_id': 'u1'})
+        # Served from the identity map filled by the list read
+        self.assertEqual(Conversation.select_by_id(3)['title'], 't3')
+        Conversation.select_by_fields(fields={'user_id': 'u1'})
+        self.assertEqual(len(self.client.requests), 1)
+
+    def test_missing_ids_are_batched_into_one_query(self):
+        Conversation.select_by_id(1)
+        rows = Conversation.select_many_by_id([1, 2, 3, 99])
+        self.assertEqual(sorted(rows), [1, 2, 3])
+        self.assertEqual(self.client.requests[-1][1], [('in', 'id', (2, 3, 99))])
+        self.assertEqual(len(self.client.requests), 2)
+
+    def test_gathered_lookups_share_one_in_query(self):
+        rows = run_queries(*(Conversation.aselect_by_id(i) for i in (1, 2, 2, 99)))
+        self.assertEqual([row and row['id'] for row in rows], [1, 2, 2, None])
+        self.assertEqual(len(self.async_client.requests), 1)
+
+    def test_identical_queries_in_flight_share_one_fetch(self):
+        first, second = run_queries(
+            Prompt.aselect_by_fields(fields={'conversation_id': 1}),
+            Prompt.aselect_by_fields(fields={'conversation_id': 1}),
+        )
+        self.assertEqual(first, second)
+        self.assertEqual(len(self.async_client.requests), 1)
+
+    def test_failed_reads_are_not_remembered(self):
+        self.client.error = RuntimeError('supabase down')
+        self.assertEqual(Prompt.select_by_fields(fields={'conversation_id': 1}), [])
+        self.client.error = None
+        self.assertEqual(len(Prompt.select_by_fields(fields={'conversation_id': 1})), 3)
+
+        self.async_client.error = RuntimeError('supabase down')
+        self.assertEqual(run_queries(Prompt.aselect_by_fields(limit=1)), [[]])
+        self.async_client.error = None
+        self.assertEqual(len(run_queries(Prompt.aselect_by_fields(limit=1))[0]), 1)
+
+    def test_writes_and_mutations_do_not_leak(self):
+        Conversation.select_by_id(1)['title'] = 'mutated'
+        self.assertEqual(Conversation.select_by_id(1)['title'], 't1')
+        Conversation.update_by_id(1, {'title': 'renamed'})
+        self.assertEqual(Conversation.select_by_id(1)['title'], 'renamed')
@@ -2,7 +2,9 @@ from django.urls import path
 from rest_app.views import (
     home_view, login_view, register_view, user_home_view, logout_view,
     upload_file_view, delete_file_view, list_folder_files_view,
-    conversation_list_view, conversation_detail_view, send_prompt_view, send_output_email_view
+    conversation_list_view, conversation_detail_view, conversation_updates_view, send_prompt_view, send_output_email_view,
+    export_history_view, upload_signature_view, ai_queue_status_view, ai_callback_view, search_prompts_view,
+    similar_outputs_view, usage_stats_view
 )
 
 urlpatterns = [
@@ -16,6 +18,14 @@ urlpatterns = [
     # path('list-folder-files/', list_folder_files_view, name='list_folder_files'),
     path("main/", conversation_list_view, name="conversation_list"),
     path("main/conversation/<int:conversation_id>/", conversation_detail_view, name="conversation_detail"),
+    path("main/conversation/<int:conversation_id>/updates/", conversation_updates_view, name="conversation_updates"),
     path("main/send-prompt/", send_prompt_view, name="send_prompt"),
+    path("main/upload-signature/", upload_signature_view, name="upload_signature"),
+    path("main/queue-status/", ai_queue_status_view, name="ai_queue_status"),
+    path("ai/callback/<int:prompt_id>/", ai_callback_view, name="ai_callback"),
     path('send_output_email/', send_output_email_view, name='send_output_email'),
+    path("main/export/", export_history_view, name="export_history"),
+    path("main/search/", search_prompts_view, name="search_prompts"),
+    path("main/files/<int:file_id>/similar/", similar_outputs_view, name="similar_outputs"),
+    path("main/usage/", usage_stats_view, name="usage_stats"),
 ] 
\ No newline at end of file
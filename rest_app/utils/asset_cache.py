@@ -0,0 +1,200 @@
+"""
+Bounded on-disk LRU cache of Cloudinary asset bytes.
+
+Entries are keyed by the delivery path of the asset (resource type, delivery
+type, transformations, public_id, format) and its version. A versioned URL
+always designates the same bytes, so entries never go stale. Unversioned URLs
+may change behind our back and are downloaded directly.
+
+- Streaming fill: downloads are written chunk by chunk to a temporary file and
+  atomically renamed into place, so readers never see a partial entry.
+- Coalescing: concurrent requests for the same missing entry in a process wait
+  for a single download.
+- Eviction: when the directory grows past its size limit, the least recently
+  used entries (oldest mtime, refreshed on every hit) are deleted. The
+  directory can be shared by several worker processes.
+"""
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from pathlib import Path
+import requests
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DOWNLOAD_TIMEOUT = 30
+CHUNK_SIZE = 64 * 1024
+# Eviction frees space down to this fraction of the limit, so it does not run on every fill
+EVICTION_TARGET = 0.9
+TEMP_PREFIX = '.tmp-'
+# Temporary files older than this belong to fills that were interrupted
+STALE_TEMP_SECONDS = 3600
+
+# https://res.cloudinary.com/<cloud>/<resource_type>/<type>/[<transformations>/]v<version>/<public_id>[.<format>]
+CLOUDINARY_URL_PATTERN = re.compile(
+    r'^https?://res\.cloudinary\.com/(?P<cloud>[^/]+)/(?P<resource_type>[^/]+)/(?P<type>[^/]+)/'
+    r'(?:(?P<transformations>.+?)/)?v(?P<version>\d+)/(?P<public_id>.+)$'
+)
+
+
+def cache_key(url):
+    """
+    Cache key of an asset URL: a hash of its public_id, version and delivery
+    options, or None if the URL is not a versioned Cloudinary URL
+    """
+    match = CLOUDINARY_URL_PATTERN.match(url.split('?', 1)[0])
+    if not match:
+        return None
+    parts = match.groupdict()
+    identity = '|'.join(parts[name] or '' for name in
+                        ('cloud', 'resource_type', 'type', 'transformations', 'public_id', 'version'))
+    return hashlib.sha256(identity.encode()).hexdigest()
+
+
+class AssetCache:
+    def __init__(self, directory=None, max_bytes=None):
+        self.directory = Path(directory or getattr(settings, 'ASSET_CACHE_DIR', settings.BASE_DIR / 'asset_cache'))
+        self.max_bytes = max_bytes or getattr(settings, 'ASSET_CACHE_MAX_BYTES', 512 * 1024 * 1024)
+        self.after_fork()
+
+    def after_fork(self):
+        """Fresh locks, e.g. in a forked worker (another thread may have held them)"""
+        self._lock = threading.Lock()
+        self._fill_locks = {}
+        # Bytes written since the last eviction check, to avoid scanning on every fill
+        self._written_since_check = self.max_bytes
+
+    def _path(self, key):
+        # Two-level fan-out keeps directories small
+        return self.directory / key[:2] / key
+
+    def _download(self, url, timeout):
+        response = requests.get(url, timeout=timeout)
+        response.raise_for_status()
+        return response.content
+
+    def _fill(self, url, path, timeout):
+        """Stream an asset into the cache"""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.parent / f"{TEMP_PREFIX}{uuid.uuid4().hex}"
+        size = 0
+        try:
+            with requests.get(url, stream=True, timeout=timeout) as response:
+                response.raise_for_status()
+                with open(temp_path, 'wb') as temp_file:
+                    for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                        temp_file.write(chunk)
+                        size += len(chunk)
+            os.replace(temp_path, path)
+        except BaseException:
+            temp_path.unlink(missing_ok=True)
+            raise
+
+        with self._lock:
+            self._written_since_check += size
+            check = self._written_since_check > self.max_bytes * (1 - EVICTION_TARGET)
+            if check:
+                self._written_since_check = 0
+        if check:
+            self.evict()
+
+    def get_path(self, url, timeout=DOWNLOAD_TIMEOUT):
+        """
+        Local path of an asset, downloading it on a miss
+
+        Returns:
+            Path of the cached file, or None if the URL cannot be cached
+
+        Raises:
+            requests.RequestException if the download fails
+        """
+        key = cache_key(url)
+        if key is None:
+            return None
+        path = self._path(key)
+
+        if self._touch(path):
+            return path
+
+        with self._lock:
+            fill_lock = self._fill_locks.setdefault(key, threading.Lock())
+        try:
+            with fill_lock:
+                # Another thread may have filled it while we waited
+                if not self._touch(path):
+                    self._fill(url, path, timeout)
+        finally:
+            with self._lock:
+                self._fill_locks.pop(key, None)
+        return path
+
+    def _touch(self, path):
+        """Mark an entry as recently used; False if it is not cached"""
+        try:
+            os.utime(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def read(self, url, timeout=DOWNLOAD_TIMEOUT):
+        """
+        Bytes of an asset, from the cache when possible
+
+        Raises:
+            requests.RequestException if the download fails
+        """
+        path = self.get_path(url, timeout=timeout)
+        if path is not None:
+            try:
+                return path.read_bytes()
+            except FileNotFoundError:
+                # Evicted by another process in between
+                logger.debug(f"Asset cache entry of {url} evicted before it was read")
+        return self._download(url, timeout)
+
+    def evict(self):
+        """
+        Delete the least recently used entries until the cache is back under
+        its size limit, along with temporary files of interrupted fills.
+
+        Returns:
+            Number of bytes freed
+        """
+        entries, total = [], 0
+        if not self.directory.exists():
+            return 0
+        for shard in os.scandir(self.directory):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                if entry.name.startswith(TEMP_PREFIX):
+                    if time.time() - stat.st_mtime > STALE_TEMP_SECONDS:
+                        Path(entry.path).unlink(missing_ok=True)
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+
+        if total <= self.max_bytes:
+            return 0
+
+        freed = 0
+        target = self.max_bytes * EVICTION_TARGET
+        for _, size, path in sorted(entries):
+            if total - freed <= target:
+                break
+            Path(path).unlink(missing_ok=True)
+            freed += size
+        logger.info(f"Asset cache evicted {freed} bytes")
+        return freed
+
+
+asset_cache = AssetCache()
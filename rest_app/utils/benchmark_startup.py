@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+"""
+Import-time benchmark of the app.
+
+Starts fresh interpreters that set up Django and import the URLconf (which
+pulls in every view, service and config module), the same work a worker does
+before serving its first request. Reports the wall-clock time and the slowest
+imports measured with `python -X importtime`, and whether the Supabase and
+Cloudinary SDKs were loaded eagerly.
+
+Usage:
+    python rest_app/utils/benchmark_startup.py [--runs N] [--top N]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+STARTUP_CODE = (
+    "import os, django;"
+    "os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'promptvision_app.settings');"
+    "django.setup();"
+    "import promptvision_app.urls"
+)
+# SDKs that should stay off the import path until first use
+LAZY_PACKAGES = ('supabase', 'cloudinary')
+
+
+def parse_importtime(stderr):
+    """
+    Parse `-X importtime` output
+
+    Returns:
+        Dictionary of module name to cumulative import time in microseconds
+    """
+    timings = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        # import time: <self us> | <cumulative us> | <indented module name>
+        _, cumulative_us, name = line[len('import time:'):].split('|', 2)
+        timings[name.strip()] = int(cumulative_us)
+    return timings
+
+
+def run_once():
+    """
+    Start one interpreter
+
+    Returns:
+        Tuple of (wall-clock seconds, import timings)
+    """
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', STARTUP_CODE],
+        cwd=project_root,
+        capture_output=True,
+        text=True,
+    )
+    elapsed = time.perf_counter() - started
+    if result.returncode != 0:
+        sys.exit(f"Startup failed:\n{result.stderr[-2000:]}")
+    return elapsed, parse_importtime(result.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the app's cold start import time")
+    parser.add_argument('--runs', type=int, default=5, help='Number of fresh interpreters to start')
+    parser.add_argument('--top', type=int, default=15, help='Number of slowest top-level imports to list')
+    args = parser.parse_args()
+
+    durations, timings = [], {}
+    for _ in range(args.runs):
+        elapsed, timings = run_once()
+        durations.append(elapsed)
+
+    print(f"Startup over {args.runs} runs: median {statistics.median(durations) * 1000:.0f} ms, "
+          f"min {min(durations) * 1000:.0f} ms, max {max(durations) * 1000:.0f} ms")
+
+    print("\nSlowest top-level imports (last run, cumulative):")
+    top_level = {}
+    for name, cumulative_us in timings.items():
+        package = name.split('.')[0]
+        top_level[package] = max(top_level.get(package, 0), cumulative_us)
+    for package, cumulative_us in sorted(top_level.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"  {cumulative_us / 1000:8.1f} ms  {package}")
+
+    print("\nLazily loaded SDKs:")
+    for package in LAZY_PACKAGES:
+        state = 'imported at startup' if package in top_level else 'not imported'
+        print(f"  {package}: {state}")
+
+
+if __name__ == '__main__':
+    main()
@@ -6,10 +6,8 @@ import inspect
 import django
 from django.db import models
 from django.apps import apps
-from dotenv import load_dotenv
 import logging
-from supabase import create_client
-import time
+import psycopg2
 
 # Add the project root directory to the Python path
 # This is needed to correctly import Django settings
@@ -27,26 +25,27 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Load environment variables
-load_dotenv()
-
-# Get Supabase credentials
-SUPABASE_URL = os.getenv('SUPABASE_HOST_URL')
-SUPABASE_KEY = os.getenv('SUPABASE_API_SECRET')
-
-# Initialize Supabase client
-supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
-
-# Setup Django
+# Setup Django (settings load the environment variables)
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'promptvision_app.settings')
 django.setup()
 
+from django.conf import settings
+
+# Direct Postgres connection string of the Supabase database
+# (Project Settings -> Database), or a local Postgres for testing
+SUPABASE_DB_URL = settings.SUPABASE_DB_URL
+
 ############ NOTE: UPDATE THIS LIST WITH ALL MODELS TO MIGRATE ############
-from rest_app.models import Account, CloudinaryFile, Conversation, Prompt
+from rest_app.models import Account, CloudinaryFile, Conversation, Prompt, ConversationArchive, UsageDaily, UsageTotals
 # MODELS_TO_MIGRATE = [Account, Conversation, Prompt, CloudinaryFile]
-MODELS_TO_MIGRATE = [Conversation, Prompt, CloudinaryFile]
+MODELS_TO_MIGRATE = [Conversation, Prompt, CloudinaryFile, ConversationArchive, UsageDaily, UsageTotals]
 ###########################################################################
 
+# Text search configuration of the full-text indexes and queries
+SEARCH_CONFIG = 'english'
+# ts_headline markers around matched words, turned into <mark> by the app
+HIGHLIGHT_START = '[[mark]]'
+HIGHLIGHT_STOP = '[[/mark]]'
 
 
 def django_type_to_postgres(field, model=None):
@@ -58,18 +57,20 @@ def django_type_to_postgres(field, model=None):
         if max_length:
             return f"varchar({max_length})"
         return "text"
-    elif isinstance(field, models.IntegerField):
-        return "integer"
+    # BigIntegerField and SmallIntegerField subclass IntegerField, check them first
     elif isinstance(field, models.BigIntegerField):
         return "bigint"
     elif isinstance(field, models.SmallIntegerField):
         return "smallint"
+    elif isinstance(field, models.IntegerField):
+        return "integer"
     elif isinstance(field, models.BooleanField):
         return "boolean"
-    # elif isinstance(field, models.DateField):
-    #     return "date"
     elif isinstance(field, models.DateTimeField):
         return "timestamp with time zone"
+    # DateTimeField subclasses DateField, check it first
+    elif isinstance(field, models.DateField):
+        return "date"
     elif isinstance(field, models.TimeField):
         return "time"
     elif isinstance(field, models.DecimalField):
@@ -88,79 +89,28 @@ def django_type_to_postgres(field, model=None):
     # Add more field types as needed
     return "text"  # Default to text for unknown types
 
-def execute_sql(sql):
-    """Execute raw SQL using Supabase REST API"""
-    try:
-        # Using the rpc function to execute raw SQL
-        result = supabase.rpc(
-            'exec_sql', 
-            {'sql_query': sql}
-        ).execute()
-        return True, result
-    except Exception as e:
-        return False, str(e)
-
-def check_rpc_function():
-    """Check if the exec_sql RPC function exists in Supabase, create if not"""
-    logger.info("Checking for SQL execution function in Supabase...")
-    
-    create_function_sql = """
-    CREATE OR REPLACE FUNCTION exec_sql(sql_query TEXT)
-    RETURNS JSONB
-    LANGUAGE plpgsql
-    SECURITY DEFINER
-    AS $$
-    DECLARE
-        result JSONB;
-    BEGIN
-        EXECUTE sql_query;
-        result := '{"status": "success"}'::JSONB;
-        RETURN result;
-    EXCEPTION WHEN OTHERS THEN
-        result := jsonb_build_object(
-            'status', 'error',
-            'message', SQLERRM,
-            'detail', SQLSTATE
-        );
-        RETURN result;
-    END;
-    $$;
-    """
-    
-    # We can't easily check if the function exists through the API
-    # So we'll try to create/replace it
-    try:
-        # This requires superuser access in Supabase
-        # You'll need to run this SQL in the Supabase dashboard/SQL editor first
-        success, result = execute_sql(create_function_sql)
-        if success:
-            logger.info("SQL execution function created or updated successfully")
-        else:
-            logger.warning(f"Could not create SQL function: {result}")
-            logger.warning("You may need to create this function manually in the Supabase dashboard SQL editor")
-    except Exception as e:
-        logger.warning(f"Error checking RPC function: {str(e)}")
-        logger.warning("Please run the following SQL in the Supabase dashboard SQL editor:")
-        logger.warning(create_function_sql)
-
-def create_or_replace_table(model):
-    """Create or replace a table in Supabase based on Django model"""
+def get_table_name(model):
+    """Return the Supabase table name for a Django model"""
     # Use the table_name defined in the model if available
     if hasattr(model, 'table_name') and model.table_name:
-        table_name = model.table_name
+        return model.table_name
     # Otherwise, use the model name converted to lowercase
-    else:
-        table_name = model.__name__.lower()
-    
-    logger.info(f"Processing model: {model.__name__} (table: {table_name})")
-    
-    # Generate column definitions for Supabase
+    return model.__name__.lower()
+
+def build_table_spec(model):
+    """
+    Build the column and foreign key definitions for a Django model
+
+    Returns:
+        Tuple of (columns, foreign_keys) where each entry is a dictionary
+    """
     columns = []
     foreign_keys = []
-    
+    table_name = get_table_name(model)
+
     # First, check if this is the Account model
     is_account_model = model.__name__ == 'Account'
-    
+
     # Add UUID primary key for Account model
     if is_account_model:
         columns.append({
@@ -170,7 +120,7 @@ def create_or_replace_table(model):
             "nullable": False,
             "default": "auth.uid()"
         })
-    
+
     # Process each field
     for field in model._meta.fields:
         # Skip if its the ID field for the Account model, we already handled it
@@ -179,151 +129,541 @@ def create_or_replace_table(model):
 
         field_type = django_type_to_postgres(field, model)
         field_dict = {
-            "name": field.name if not isinstance(field, models.ForeignKey) else f"{field.name}_id",
+            "name": field.column,
             "type": field_type,
             "nullable": field.null,
         }
-        
+
         # Add default for BooleanField
         if isinstance(field, models.BooleanField) and field.default is not models.NOT_PROVIDED:
             field_dict["default"] = "true" if field.default else "false"
-            
+
+        # Add default for numeric fields (counters)
+        if isinstance(field, (models.IntegerField, models.FloatField)) and not isinstance(field, models.AutoField) \
+                and field.default is not models.NOT_PROVIDED and not callable(field.default):
+            field_dict["default"] = str(field.default)
+
         # Handle auto fields
         if isinstance(field, models.AutoField) or isinstance(field, models.BigAutoField):
             field_dict["primary"] = True
-            
+
         # Handle foreign keys
         if isinstance(field, models.ForeignKey):
-            related_model = field.related_model
-            related_table = related_model.table_name if hasattr(related_model, 'table_name') and related_model.table_name else related_model.__name__.lower()
-            
+            related_table = get_table_name(field.related_model)
+
             # If the related model is Account, ensure we use UUID type
-            field_type = "uuid" if related_model.__name__ == "Account" else field_type
+            field_type = "uuid" if field.related_model.__name__ == "Account" else field_type
             field_dict["type"] = field_type
-            
+
             foreign_keys.append({
-                "column": f"{field.name}_id",
+                "name": f"{table_name}_{field.column}_fkey",
+                "column": field.column,
                 "references": related_table,
                 "ref_column": "id"
             })
-            
+
         columns.append(field_dict)
-    
-    # Generate SQL for dropping the table if it exists
-    sql_drop = f"DROP TABLE IF EXISTS {table_name} CASCADE;"
-    
-    # Generate SQL for creating the table
-    sql_create = f"CREATE TABLE {table_name} (\n"
-    
-    # Add column definitions
-    for i, col in enumerate(columns):
-        sql_create += f"  {col['name']} {col['type']}"
-        
-        if col.get("primary", False):
-            sql_create += " PRIMARY KEY"
-            
-        if not col.get("nullable", True):
-            sql_create += " NOT NULL"
-            
-        if "default" in col:
-            sql_create += f" DEFAULT {col['default']}"
-            
-        if i < len(columns) - 1 or foreign_keys:
-            sql_create += ","
-            
-        sql_create += "\n"
-    
-    # Add foreign key constraints
-    for i, fk in enumerate(foreign_keys):
-        sql_create += f"  CONSTRAINT {table_name}_{fk['column']}_fkey FOREIGN KEY ({fk['column']}) REFERENCES {fk['references']}({fk['ref_column']}) ON DELETE CASCADE"
-        
-        if i < len(foreign_keys) - 1:
-            sql_create += ","
-            
-        sql_create += "\n"
-    
-    sql_create += ");"
-    
-    # Execute the SQL to create the table
-    try:
-        # First drop the table if it exists
-        execute_sql(sql_drop)
-        
-        # Then create the table
-        result = execute_sql(sql_create)
-        logger.info(f"Table {table_name} created successfully")
-        
-        # Add timestamp trigger for updated_at field
+
+    return columns, foreign_keys
+
+def build_unique_specs(model):
+    """
+    Build unique constraint definitions from the model's Meta.constraints
+
+    Returns:
+        List of dictionaries with the constraint name and its columns
+    """
+    uniques = []
+    for constraint in model._meta.constraints:
+        if isinstance(constraint, models.UniqueConstraint) and constraint.fields:
+            uniques.append({
+                "name": constraint.name,
+                "columns": [model._meta.get_field(name).column for name in constraint.fields],
+            })
+    return uniques
+
+def build_index_specs(model):
+    """
+    Build index definitions from the model's Meta.indexes.
+
+    Each model declares indexes matching the filters and orderings it is
+    queried with through SupabaseModelMixin (e.g. select_by_fields on
+    user_id ordered by created_at).
+
+    Returns:
+        List of dictionaries with the index name and its columns
+    """
+    indexes = []
+    for index in model._meta.indexes:
+        columns = []
+        for field_name, order in index.fields_orders:
+            column = model._meta.get_field(field_name).column
+            columns.append(f"{column} {order}".strip())
+        indexes.append({
+            "name": index.name,
+            "columns": columns,
+        })
+    return indexes
+
+def build_search_document_sql(model, alias=None):
+    """
+    The tsvector expression searched for a model with `search_fields`, each
+    field weighted A, B, ... in declaration order. The GIN index and the
+    queries must use the same expression for the index to be picked.
+    """
+    prefix = f"{alias}." if alias else ""
+    parts = []
+    for weight, field_name in zip('ABCD', model.search_fields):
+        column = model._meta.get_field(field_name).column
+        parts.append(f"setweight(to_tsvector('{SEARCH_CONFIG}', coalesce({prefix}{column}, '')), '{weight}')")
+    return " || ".join(parts)
+
+def build_search_index_sql(model):
+    """Generate the GIN expression index backing full-text search on a model"""
+    table_name = get_table_name(model)
+    return f"CREATE INDEX IF NOT EXISTS {table_name}_search_idx ON {table_name} USING GIN (({build_search_document_sql(model)}));"
+
+def build_search_prompts_function_sql():
+    """
+    Generate the search_prompts RPC: a user's prompts matching a web-style
+    query (quoted phrases, OR, -word), best matches first, with a highlighted
+    excerpt of the prompt and response
+    """
+    document = build_search_document_sql(Prompt, alias='p')
+    return f"""
+    CREATE OR REPLACE FUNCTION search_prompts(p_user_id uuid, p_query text, p_limit integer DEFAULT 20, p_offset integer DEFAULT 0)
+    RETURNS TABLE (
+        id bigint, conversation_id bigint, conversation_title varchar, text text,
+        created_at timestamp with time zone, rank real, headline text
+    )
+    LANGUAGE sql STABLE AS $$
+        WITH query AS (
+            SELECT websearch_to_tsquery('{SEARCH_CONFIG}', p_query) AS q
+        ), matches AS (
+            SELECT p.id, p.conversation_id, c.title AS conversation_title, p.text, p.response, p.created_at,
+                   ts_rank_cd({document}, query.q) AS rank
+            FROM prompts p
+            JOIN conversations c ON c.id = p.conversation_id
+            CROSS JOIN query
+            WHERE c.user_id = p_user_id AND {document} @@ query.q
+            ORDER BY rank DESC, p.created_at DESC
+            LIMIT p_limit OFFSET p_offset
+        )
+        -- Excerpts are only built for the returned page
+        SELECT m.id, m.conversation_id, m.conversation_title, m.text, m.created_at, m.rank,
+               ts_headline('{SEARCH_CONFIG}', coalesce(m.text, '') || ' ' || coalesce(m.response, ''), query.q,
+                           'StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_STOP}, MaxFragments=2')
+        FROM matches m
+        CROSS JOIN query
+        ORDER BY m.rank DESC, m.created_at DESC;
+    $$;
+    """
+
+USAGE_COUNTERS = ['prompts', 'images', 'steps', 'bytes_stored']
+
+def build_increment_usage_function_sql():
+    """
+    Generate the increment_usage RPC: adds deltas to a user's daily and total
+    usage counters in one atomic statement each (upserts, so concurrent
+    requests never lose an update)
+    """
+    counters = ", ".join(USAGE_COUNTERS)
+    values = "p_prompts, p_images, p_steps, p_bytes"
+    daily_updates = ", ".join(f"{c} = usage_daily.{c} + EXCLUDED.{c}" for c in USAGE_COUNTERS)
+    total_updates = ", ".join(f"{c} = usage_totals.{c} + EXCLUDED.{c}" for c in USAGE_COUNTERS)
+    return f"""
+    CREATE OR REPLACE FUNCTION increment_usage(
+        p_user_id uuid, p_day date, p_prompts integer DEFAULT 0, p_images integer DEFAULT 0,
+        p_steps integer DEFAULT 0, p_bytes bigint DEFAULT 0
+    )
+    RETURNS void
+    LANGUAGE sql AS $$
+        INSERT INTO usage_daily (user_id, day, {counters})
+        VALUES (p_user_id, p_day, {values})
+        ON CONFLICT (user_id, day) DO UPDATE SET {daily_updates};
+
+        INSERT INTO usage_totals (user_id, {counters}, updated_at)
+        VALUES (p_user_id, {values}, now())
+        ON CONFLICT (user_id) DO UPDATE SET {total_updates}, updated_at = now();
+    $$;
+    """
+
+def build_recompute_usage_function_sql():
+    """
+    Generate the recompute_usage RPC: rebuilds a user's usage counters from the
+    prompts and files tables (backfill). Files are counted on the day of their prompt,
+    files uploaded outside a prompt on the current day. Days are UTC, like the
+    ones UsageService records, whatever the session time zone.
+    """
+    counters = ", ".join(USAGE_COUNTERS)
+    return f"""
+    CREATE OR REPLACE FUNCTION recompute_usage(p_user_id uuid)
+    RETURNS void
+    LANGUAGE sql AS $$
+        DELETE FROM usage_daily WHERE user_id = p_user_id;
+        DELETE FROM usage_totals WHERE user_id = p_user_id;
+
+        INSERT INTO usage_daily (user_id, day, {counters})
+        SELECT p_user_id, day, sum(prompts), sum(images), sum(steps), sum(bytes_stored)
+        FROM (
+            SELECT (p.created_at AT TIME ZONE 'UTC')::date AS day, 1 AS prompts, 0 AS images, 0 AS steps, 0::bigint AS bytes_stored
+            FROM prompts p JOIN conversations c ON c.id = p.conversation_id
+            WHERE c.user_id = p_user_id
+            UNION ALL
+            SELECT coalesce((p.created_at AT TIME ZONE 'UTC')::date, (now() AT TIME ZONE 'UTC')::date), 0,
+                   coalesce(f.step_type = 'output', false)::int,
+                   coalesce(f.step_type NOT IN ('input', 'output'), false)::int,
+                   coalesce(f.bytes, 0)
+            FROM files f LEFT JOIN prompts p ON p.id = f.prompt_id
+            WHERE f.user_id = p_user_id
+        ) activity
+        GROUP BY day;
+
+        INSERT INTO usage_totals (user_id, {counters}, updated_at)
+        SELECT p_user_id, coalesce(sum(prompts), 0), coalesce(sum(images), 0),
+               coalesce(sum(steps), 0), coalesce(sum(bytes_stored), 0), now()
+        FROM usage_daily WHERE user_id = p_user_id;
+    $$;
+    """
+
+def build_step_latency_report_function_sql():
+    """
+    Generate the step_latency_report RPC: p50/p95 of the AI step durations per
+    time bucket and step_type, plus the whole call as step_type 'total'.
+    `service` columns are durations reported by the AI service, `client`
+    columns the times we measured from dispatch.
+    """
+    return """
+    CREATE OR REPLACE FUNCTION step_latency_report(p_since timestamp with time zone, p_bucket text DEFAULT 'day')
+    RETURNS TABLE (
+        bucket timestamp with time zone, step_type varchar, samples bigint,
+        service_p50_ms double precision, service_p95_ms double precision,
+        client_p50_ms double precision, client_p95_ms double precision
+    )
+    LANGUAGE sql STABLE AS $$
+        WITH timings AS (
+            SELECT date_trunc(p_bucket, p.created_at) AS bucket, f.step_type::varchar AS step_type,
+                   f.duration_ms AS service_ms, f.elapsed_ms AS client_ms
+            FROM files f
+            JOIN prompts p ON p.id = f.prompt_id
+            WHERE p.created_at >= p_since AND f.step_type <> 'input'
+              AND (f.duration_ms IS NOT NULL OR f.elapsed_ms IS NOT NULL)
+            UNION ALL
+            SELECT date_trunc(p_bucket, p.created_at), 'total'::varchar, p.service_duration_ms, p.duration_ms
+            FROM prompts p
+            WHERE p.created_at >= p_since
+              AND (p.service_duration_ms IS NOT NULL OR p.duration_ms IS NOT NULL)
+        )
+        -- percentile_cont skips NULLs, so each column only uses the rows that have it
+        SELECT bucket, step_type, count(*),
+               percentile_cont(0.5) WITHIN GROUP (ORDER BY service_ms),
+               percentile_cont(0.95) WITHIN GROUP (ORDER BY service_ms),
+               percentile_cont(0.5) WITHIN GROUP (ORDER BY client_ms),
+               percentile_cont(0.95) WITHIN GROUP (ORDER BY client_ms)
+        FROM timings
+        GROUP BY bucket, step_type
+        ORDER BY bucket, step_type;
+    $$;
+    """
+
+# Names of the functions created by build_function_sqls
+RPC_FUNCTIONS = ['search_prompts', 'increment_usage', 'recompute_usage', 'step_latency_report']
+
+def build_function_sqls():
+    """SQL functions exposed to the app as Supabase RPCs, (re)created on every run"""
+    return [
+        build_search_prompts_function_sql(),
+        build_increment_usage_function_sql(),
+        build_recompute_usage_function_sql(),
+        build_step_latency_report_function_sql(),
+    ]
+
+def column_definition_sql(col):
+    """Render a single column definition"""
+    sql = f"{col['name']} {col['type']}"
+
+    if col.get("primary", False):
+        sql += " PRIMARY KEY"
+
+    if not col.get("nullable", True):
+        sql += " NOT NULL"
+
+    if "default" in col:
+        sql += f" DEFAULT {col['default']}"
+
+    return sql
+
+def foreign_key_sql(fk):
+    """Render a foreign key constraint definition"""
+    return f"CONSTRAINT {fk['name']} FOREIGN KEY ({fk['column']}) REFERENCES {fk['references']}({fk['ref_column']}) ON DELETE CASCADE"
+
+def unique_constraint_sql(unique):
+    """Render a unique constraint definition"""
+    return f"CONSTRAINT {unique['name']} UNIQUE ({', '.join(unique['columns'])})"
+
+def build_create_table_sql(table_name, columns, foreign_keys, uniques=()):
+    """Generate the CREATE TABLE statement for a new table"""
+    definitions = [column_definition_sql(col) for col in columns]
+    definitions += [foreign_key_sql(fk) for fk in foreign_keys]
+    definitions += [unique_constraint_sql(unique) for unique in uniques]
+    return f"CREATE TABLE {table_name} (\n  " + ",\n  ".join(definitions) + "\n);"
+
+def build_timestamp_trigger_sql(table_name):
+    """Generate the trigger keeping an updated_at column current"""
+    return f"""
+    CREATE OR REPLACE FUNCTION update_{table_name}_timestamp()
+    RETURNS TRIGGER AS $$
+    BEGIN
+        NEW.updated_at = current_timestamp;
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS set_{table_name}_timestamp ON {table_name};
+
+    CREATE TRIGGER set_{table_name}_timestamp
+    BEFORE UPDATE ON {table_name}
+    FOR EACH ROW
+    EXECUTE FUNCTION update_{table_name}_timestamp();
+    """
+
+def get_live_columns(cursor, table_name):
+    """
+    Read the live column definitions of a table
+
+    Returns:
+        Dictionary of column name to data type, or None if the table does not exist
+    """
+    cursor.execute(
+        """
+        SELECT column_name, data_type
+        FROM information_schema.columns
+        WHERE table_schema = 'public' AND table_name = %s
+        """,
+        (table_name,)
+    )
+    rows = cursor.fetchall()
+    if not rows:
+        return None
+    return {name: data_type for name, data_type in rows}
+
+def get_live_constraints(cursor, table_name):
+    """Return the names of the constraints defined on a table"""
+    cursor.execute(
+        """
+        SELECT constraint_name
+        FROM information_schema.table_constraints
+        WHERE table_schema = 'public' AND table_name = %s
+        """,
+        (table_name,)
+    )
+    return {row[0] for row in cursor.fetchall()}
+
+def get_live_indexes(cursor, table_name):
+    """Return the names of the indexes defined on a table"""
+    cursor.execute(
+        "SELECT indexname FROM pg_indexes WHERE schemaname = 'public' AND tablename = %s",
+        (table_name,)
+    )
+    return {row[0] for row in cursor.fetchall()}
+
+def get_live_functions(cursor):
+    """Return the names of the functions defined in the public schema"""
+    cursor.execute(
+        """
+        SELECT p.proname
+        FROM pg_proc p JOIN pg_namespace n ON n.oid = p.pronamespace
+        WHERE n.nspname = 'public'
+        """
+    )
+    return {row[0] for row in cursor.fetchall()}
+
+def plan_table_changes(cursor, model):
+    """
+    Diff the live table against the model and return the additive statements
+    needed to bring it up to date. Nothing is ever dropped: columns that exist
+    live but not on the model are only reported.
+
+    Returns:
+        List of SQL statements
+    """
+    table_name = get_table_name(model)
+    columns, foreign_keys = build_table_spec(model)
+    uniques = build_unique_specs(model)
+    live_columns = get_live_columns(cursor, table_name)
+    statements = []
+
+    if live_columns is None:
+        logger.info(f"Table {table_name} does not exist, it will be created")
+        statements.append(build_create_table_sql(table_name, columns, foreign_keys, uniques))
         if any(col['name'] == 'updated_at' for col in columns):
-            sql_trigger = f"""
-            CREATE OR REPLACE FUNCTION update_{table_name}_timestamp()
-            RETURNS TRIGGER AS $$
-            BEGIN
-                NEW.updated_at = current_timestamp;
-                RETURN NEW;
-            END;
-            $$ LANGUAGE plpgsql;
-
-            DROP TRIGGER IF EXISTS set_{table_name}_timestamp ON {table_name};
-            
-            CREATE TRIGGER set_{table_name}_timestamp
-            BEFORE UPDATE ON {table_name}
-            FOR EACH ROW
-            EXECUTE FUNCTION update_{table_name}_timestamp();
-            """
-            execute_sql(sql_trigger)
-            logger.info(f"Created update timestamp trigger for {table_name}")
-        
-        return True
-    except Exception as e:
-        logger.error(f"Failed to create table {table_name}: {str(e)}")
-        return False
+            statements.append(build_timestamp_trigger_sql(table_name))
+    else:
+        live_constraints = get_live_constraints(cursor, table_name)
+
+        for col in columns:
+            if col['name'] in live_columns:
+                continue
+
+            new_col = dict(col)
+            # A NOT NULL column without a default cannot be added to a populated table
+            if not new_col.get("nullable", True) and "default" not in new_col:
+                logger.warning(f"Adding {table_name}.{col['name']} as nullable, backfill it before enforcing NOT NULL")
+                new_col["nullable"] = True
+            new_col.pop("primary", None)
+            statements.append(f"ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS {column_definition_sql(new_col)};")
+
+        for fk in foreign_keys:
+            if fk['name'] not in live_constraints:
+                statements.append(f"ALTER TABLE {table_name} ADD {foreign_key_sql(fk)};")
+
+        # Fails (and rolls the run back) if existing rows violate it
+        for unique in uniques:
+            if unique['name'] not in live_constraints:
+                statements.append(f"ALTER TABLE {table_name} ADD {unique_constraint_sql(unique)};")
+
+        model_columns = {col['name'] for col in columns}
+        for extra_column in sorted(set(live_columns) - model_columns):
+            logger.info(f"Column {table_name}.{extra_column} is not on the model, leaving it untouched")
+
+    for index in build_index_specs(model):
+        statements.append(f"CREATE INDEX IF NOT EXISTS {index['name']} ON {table_name} ({', '.join(index['columns'])});")
+
+    if getattr(model, 'search_fields', None):
+        statements.append(build_search_index_sql(model))
+
+    return statements
+
+def find_schema_drift(cursor, all_models):
+    """
+    Compare the live schema with the models: tables, columns, constraints,
+    indexes and RPC functions the migrator should have created. Column types
+    are not compared, information_schema spells them differently.
 
-def migrate_all_models():
-    """Migrate all Django models to Supabase"""
+    Returns:
+        List of human-readable problems, empty when the schema is up to date
+    """
+    problems = []
+    for model in all_models:
+        table_name = get_table_name(model)
+        live_columns = get_live_columns(cursor, table_name)
+        if live_columns is None:
+            problems.append(f"table {table_name} is missing")
+            continue
+
+        columns, foreign_keys = build_table_spec(model)
+        for col in columns:
+            if col['name'] not in live_columns:
+                problems.append(f"column {table_name}.{col['name']} is missing")
+
+        live_constraints = {name.lower() for name in get_live_constraints(cursor, table_name)}
+        for constraint in foreign_keys + build_unique_specs(model):
+            if constraint['name'].lower() not in live_constraints:
+                problems.append(f"constraint {constraint['name']} on {table_name} is missing")
+
+        expected_indexes = [index['name'] for index in build_index_specs(model)]
+        if getattr(model, 'search_fields', None):
+            expected_indexes.append(f"{table_name}_search_idx")
+        live_indexes = {name.lower() for name in get_live_indexes(cursor, table_name)}
+        for index_name in expected_indexes:
+            if index_name.lower() not in live_indexes:
+                problems.append(f"index {index_name} on {table_name} is missing")
+
+    live_functions = get_live_functions(cursor)
+    for function_name in RPC_FUNCTIONS:
+        if function_name not in live_functions:
+            problems.append(f"function {function_name} is missing")
+
+    return problems
+
+def sort_models_by_dependencies(all_models):
+    """
+    Order models so that referenced tables are created first (depth-first
+    topological sort). References to models outside the list, such as the
+    Supabase-managed accounts table, and self-references are ignored.
+
+    Raises:
+        ValueError if the foreign keys between the models form a cycle
+    """
+    sorted_models = []
+    visiting, done = set(), set()
+
+    def visit(model, path):
+        if model in done:
+            return
+        if model in visiting:
+            cycle = path[path.index(model):] + [model]
+            raise ValueError(f"Foreign key cycle between models: {' -> '.join(m.__name__ for m in cycle)}")
+        visiting.add(model)
+        for field in model._meta.fields:
+            if isinstance(field, models.ForeignKey) and field.related_model is not model \
+                    and field.related_model in all_models:
+                visit(field.related_model, path + [model])
+        visiting.discard(model)
+        done.add(model)
+        sorted_models.append(model)
+
+    for model in all_models:
+        visit(model, [])
+    return sorted_models
+
+def migrate_all_models(dry_run=False, db_url=None):
+    """
+    Migrate all Django models to Supabase (or to db_url, e.g. a scratch database).
+
+    The live schema is diffed against the models and only additive changes
+    (new tables, columns, foreign keys and indexes) are applied, then the RPC
+    functions are replaced, all inside a single transaction: either every
+    statement succeeds or nothing changes.
+    """
     logger.info("Starting migration of Django models to Supabase")
-    
-    if not SUPABASE_URL or not SUPABASE_KEY:
-        logger.error("Supabase credentials not found in environment variables")
+
+    db_url = db_url or SUPABASE_DB_URL
+    if not db_url:
+        logger.error("SUPABASE_DB_URL not found in environment variables")
         return False
 
-    # Check/create the SQL execution function
-    check_rpc_function()
-    
     # Use the predefined models list
     all_models = MODELS_TO_MIGRATE
     logger.info(f"Using {len(all_models)} predefined models")
-    
+
     if len(all_models) == 0:
         logger.warning("No models found. Check your model paths and imports.")
         return False
-    
-    # Sort models by dependencies (CustomUser first, then models that depend on it)
-    sorted_models = []
-    dependency_models = set()
-    
-    # First pass: find models with dependencies
-    for model in all_models:
-        for field in model._meta.fields:
-            if isinstance(field, models.ForeignKey):
-                dependency_models.add(field.related_model)
-    
-    # Second pass: add dependencies first, then the rest
-    for model in all_models:
-        if model in dependency_models:
-            sorted_models.append(model)
-    
-    # Add the remaining models
-    for model in all_models:
-        if model not in sorted_models:
-            sorted_models.append(model)
-    
-    # Create tables for each model in order
-    for model in sorted_models:
-        create_or_replace_table(model)
-    
+
+    try:
+        ordered_models = sort_models_by_dependencies(all_models)
+    except ValueError as e:
+        logger.error(str(e))
+        return False
+
+    connection = psycopg2.connect(db_url)
+    try:
+        with connection:
+            with connection.cursor() as cursor:
+                for model in ordered_models:
+                    logger.info(f"Processing model: {model.__name__} (table: {get_table_name(model)})")
+                    for statement in plan_table_changes(cursor, model):
+                        logger.info(statement)
+                        if not dry_run:
+                            cursor.execute(statement)
+
+                for statement in build_function_sqls():
+                    logger.info(statement)
+                    if not dry_run:
+                        cursor.execute(statement)
+
+                if dry_run:
+                    connection.rollback()
+                    logger.info("Dry run, no changes applied")
+    except Exception as e:
+        logger.error(f"Migration failed, all changes rolled back: {str(e)}")
+        return False
+    finally:
+        connection.close()
+
     logger.info("Migration complete!")
     return True
 
 if __name__ == "__main__":
-    migrate_all_models() 
\ No newline at end of file
+    migrate_all_models(dry_run='--dry-run' in sys.argv[1:])
@@ -1,3 +1,9 @@
 from .auth_views import home_view, login_view, register_view, user_home_view, logout_view
 from .file_views import upload_file_view, delete_file_view, list_folder_files_view 
-from .main_views import conversation_list_view, conversation_detail_view, send_prompt_view, send_output_email_view
\ No newline at end of file
+from .main_views import (
+    conversation_list_view, conversation_detail_view, conversation_updates_view, send_prompt_view, send_output_email_view, upload_signature_view,
+    ai_queue_status_view, ai_callback_view
+)
+from .export_views import export_history_view
+from .search_views import search_prompts_view, similar_outputs_view
+from .usage_views import usage_stats_view
@@ -6,6 +6,8 @@ from rest_app.forms import CustomUserCreationForm, CustomAuthenticationForm, Fil
 from rest_app.models import Account
 from rest_app.services.auth_service import SupabaseAuthService
 from rest_app.services.file_service import SupabaseFileService
+from rest_app.services.page_cache_service import PageCacheService
+from rest_app.services.scheduler_service import DEFAULT_PLAN
 from rest_app.utils.decorators import public_only
 
 def home_view(request):
@@ -28,8 +30,12 @@ def login_view(request):
                 request.session["user_email"] = user.email
                 request.session["supabase_access_token"] = tokens.get('supabase_access_token')
                 request.session["supabase_refresh_token"] = tokens.get('supabase_refresh_token')
+                # app_metadata is only writable with the service role, users cannot upgrade themselves
+                request.session["user_plan"] = (getattr(user, 'app_metadata', None) or {}).get('plan', DEFAULT_PLAN)
                 request.session.save()
-                
+
+                # The landing page renders from warm data by the time the redirect is followed
+                PageCacheService.warm_in_background(user.id)
                 return redirect(settings.LOGIN_REDIRECT_URL)
             else:
                 messages.error(request, error or 'Authentication failed')
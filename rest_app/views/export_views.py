@@ -0,0 +1,18 @@
+from datetime import datetime
+from django.http import StreamingHttpResponse, HttpResponse
+from rest_app.services.export_service import SupabaseExportService
+
+
+def export_history_view(request):
+    """Stream the logged-in user's full history as a downloadable JSONL file"""
+    if request.method != "GET":
+        return HttpResponse(status=405)
+
+    user_id = request.session.get("user_id")
+    response = StreamingHttpResponse(
+        SupabaseExportService.iter_jsonl(user_id),
+        content_type="application/x-ndjson",
+    )
+    filename = f"promptvision_history_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.jsonl"
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
@@ -4,6 +4,7 @@ from rest_app.config.cloudinary_config import upload_file, delete_file, get_file
 from rest_app.forms import FileUploadForm
 from rest_app.models import CloudinaryFile
 from rest_app.services.file_service import SupabaseFileService
+from rest_app.services.usage_service import UsageService
 import os
 from django.conf import settings
 from datetime import datetime
@@ -51,13 +52,15 @@ def upload_file_view(request):
                     'url': result['url'],
                     'resource_type': result['resource_type'],
                     'format': result.get('format', ''),
-                    'folder': folder
+                    'folder': folder,
+                    'bytes': result.get('bytes')
                 }
                 
                 # Create file record in Supabase
                 created_file = SupabaseFileService.create_file(user_id, file_data)
                 
                 if created_file:
+                    UsageService.record(user_id, bytes_stored=result.get('bytes') or 0)
                     messages.success(request, "File uploaded successfully!")
                 else:
                     messages.warning(request, "File uploaded to Cloudinary but record creation failed.")
@@ -1,67 +1,158 @@
 from datetime import datetime
+import hashlib
 import requests
-import os
 import json
-from uuid import uuid4
+import time
 from django.shortcuts import render, redirect
 from django.contrib import messages
 from django.conf import settings
 from django.core.mail import EmailMessage
 from django.template.loader import render_to_string
-from django.http import HttpResponse
+from django.http import HttpResponse, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition
+from django.utils.cache import patch_cache_control
 
 from rest_app.models import Conversation, Prompt, CloudinaryFile
 from rest_app.forms import FileUploadForm
-from rest_app.config.cloudinary_config import upload_file
+from rest_app.config.cloudinary_config import upload_file, generate_upload_signature, verify_direct_upload
 from rest_app.services.file_service import SupabaseFileService
+from rest_app.services.idempotency_service import IdempotencyService
+from rest_app.services.scheduler_service import ai_scheduler, DEFAULT_PLAN
+from rest_app.services.ai_callback_service import AICallbackService, FAILED_RESPONSE
+from rest_app.services.archive_service import ArchiveService
+from rest_app.services.latency_service import LatencyService
+from rest_app.services.page_cache_service import PageCacheService
+from rest_app.services.usage_service import UsageService
+from rest_app.services.version_service import ContentVersionService
+from rest_app.utils.asset_cache import asset_cache
 from rest_app.utils.utils import remove_text_after
 
+# Seconds to wait for the AI service to accept a callback-mode job
+AI_DISPATCH_TIMEOUT = 30
+
+
+def prepare_prompt(prompt):
+    """Decode the AI response and strip the image URL appended to the prompt text"""
+    prompt = dict(prompt)
+    if isinstance(prompt.get("response"), str):
+        prompt["response"] = json.loads(prompt["response"])
+    if prompt.get("text"):
+        prompt["text"] = remove_text_after(prompt["text"], " Here is the image URL:")
+    return prompt
+
+
+def prepare_file(file):
+    """Decode reasoning_info and add a download_url for output images"""
+    # ✅ Parse reasoning_info text to JSON object
+    reasoning_info = file.get("reasoning_info")
+    if reasoning_info:
+        try:
+            file["reasoning_info"] = json.loads(reasoning_info)
+        except (json.JSONDecodeError, TypeError):
+            file["reasoning_info"] = {}
+
+    # Automatically prepare download_url if output image
+    if file.get("step_type", "input") == "output" and file.get("url"):
+        original_url = file["url"]
+        download_url = original_url.replace("/upload/", "/upload/fl_attachment/")
+        file["download_url"] = download_url
+    return file
+
+
+def latest_file_id(user_id):
+    """Id of the user's most recent file (0 if none), where a fresh updates cursor starts"""
+    latest = CloudinaryFile.select_by_fields(fields={"user_id": user_id}, order_by="id", desc=True, limit=1)
+    return latest[0]["id"] if latest else 0
+
+
+def build_updates_cursor(prompts, files, prompt_cursor=0, file_cursor=0):
+    """
+    Cursor of the conversation updates API: "<prompt id>.<file id>", advanced past
+    the given prompts and files. Prompts still waiting for their AI response stay
+    behind the cursor, so they are sent again until the response arrives. Failed
+    AI calls store an error response, so they do not stay pending.
+    """
+    pending_ids = [p["id"] for p in prompts if not p.get("response")]
+    if pending_ids:
+        prompt_cursor = min(pending_ids) - 1
+    else:
+        prompt_cursor = max([prompt_cursor] + [p["id"] for p in prompts])
+    file_cursor = max([file_cursor] + [f["id"] for f in files])
+    return f"{prompt_cursor}.{file_cursor}"
+
+
+def page_etag(request, *parts):
+    """
+    ETag of a main page for the current session, built from content versions.
+    None (no conditional handling) while flash messages are waiting to be shown.
+    """
+    if len(messages.get_messages(request)):
+        return None
+    # The CSRF cookie rotates on login, and the page embeds a token derived from it
+    csrf_cookie = request.COOKIES.get(settings.CSRF_COOKIE_NAME, "")
+    raw = "|".join(str(part) for part in (request.session.get("user_id"), csrf_cookie) + parts)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def conversation_list_etag(request):
+    user_id = request.session.get("user_id")
+    return page_etag(request, "list", ContentVersionService.user_version(user_id))
+
+
+def conversation_detail_etag(request, conversation_id):
+    user_id = request.session.get("user_id")
+    return page_etag(
+        request, "detail", conversation_id,
+        ContentVersionService.user_version(user_id),
+        ContentVersionService.conversation_version(conversation_id),
+    )
 
+
+@condition(etag_func=conversation_list_etag)
 def conversation_list_view(request):
     user_id = request.session.get("user_id")
-    conversations = Conversation.select_by_fields(fields={"user_id": user_id}, order_by="created_at", desc=True)
-    return render(request, "main.html", {
-        "conversations": conversations,
+    response = render(request, "main.html", {
+        "conversations": PageCacheService.get_conversations(user_id),
         "upload_form": FileUploadForm(),
     })
+    # Always revalidate, the ETag makes unchanged pages a cheap 304
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
 
 
+@condition(etag_func=conversation_detail_etag)
 def conversation_detail_view(request, conversation_id):
     user_id = request.session.get("user_id")
-    conversation = Conversation.select_by_id(conversation_id)
+    # The conversation and the sidebar list are independent, read concurrently
+    bundle, conversations = PageCacheService.get_detail_page(user_id, conversation_id)
+    conversation = bundle["conversation"] if bundle else None
 
-    if conversation.get("user_id") != user_id:
+    if not conversation or conversation.get("user_id") != user_id:
         messages.error(request, "You do not have permission to view this conversation.")
         return redirect("conversation_list")
 
-    prompts = Prompt.select_by_fields(fields={"conversation_id": conversation_id}, order_by="created_at")
-    prompts = [
-        {**obj, "response": json.loads(obj["response"]), "text": remove_text_after(obj["text"], " Here is the image URL:")}
-        if "text" and "response" in obj else obj
-        for obj in prompts
-    ]
+    # Archived conversations are moved back to the hot tables when opened
+    if conversation.get("is_archived"):
+        if not ArchiveService.restore_conversation(conversation):
+            messages.error(request, "This conversation could not be restored from the archive, please try again.")
+            return redirect("conversation_list")
+        # Restoring bumped the versions, this reads the restored rows
+        bundle, conversations = PageCacheService.get_detail_page(user_id, conversation_id)
+        if not bundle:
+            messages.error(request, "This conversation could not be loaded, please try again.")
+            return redirect("conversation_list")
+        conversation = bundle["conversation"]
+
+    prompts = [prepare_prompt(obj) for obj in bundle["prompts"]]
 
     steps, input_outputs = {}, {}
-    prompt_ids = [p["id"] for p in prompts]
-    files = CloudinaryFile.select_by_field_in_list("prompt_id", prompt_ids)
+    files = bundle["files"]
 
     for file in files:
         pid = file.get("prompt_id")
         input_type = file.get("step_type", "input")
-
-        # ✅ Parse reasoning_info text to JSON object
-        reasoning_info = file.get("reasoning_info")
-        if reasoning_info:
-            try:
-                file["reasoning_info"] = json.loads(reasoning_info)
-            except (json.JSONDecodeError, TypeError):
-                file["reasoning_info"] = {}
-
-        # Automatically prepare download_url if output image
-        if input_type == "output" and file.get("url"):
-            original_url = file["url"]
-            download_url = original_url.replace("/upload/", "/upload/fl_attachment/")
-            file["download_url"] = download_url
+        prepare_file(file)
 
         # Input/Output images for Chat Panel
         if input_type in ["input", "output"]:
@@ -74,13 +165,55 @@ def conversation_detail_view(request, conversation_id):
                 steps[pid] = []
             steps[pid].append(file)
 
-    return render(request, "main.html", {
+    response = render(request, "main.html", {
         "selected_conversation": conversation,
         "prompts": prompts,
-        "conversations": Conversation.select_by_fields(fields={"user_id": user_id}, order_by="created_at", desc=True),
+        "conversations": conversations,
         "steps": steps,
         "input_outputs": input_outputs,
         "upload_form": FileUploadForm(),
+        # The updates API scans all of the user's files after the cursor: without files
+        # here, start after the user's latest one rather than at the very first
+        "updates_cursor": build_updates_cursor(prompts, files, file_cursor=0 if files else latest_file_id(user_id)),
+    })
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def conversation_updates_view(request, conversation_id):
+    """
+    Prompts and files added to a conversation after a cursor, so the page can
+    append them in place instead of being reloaded.
+
+    GET ?cursor=<prompt id>.<file id> (rendered with the page, then as returned by the previous call)
+    """
+    user_id = request.session.get("user_id")
+    conversation = Conversation.select_by_id(conversation_id)
+    if not conversation or conversation.get("user_id") != user_id:
+        return JsonResponse({"error": "Conversation not found."}, status=404)
+
+    try:
+        prompt_cursor, file_cursor = (int(part) for part in request.GET.get("cursor", "").split("."))
+    except ValueError:
+        return JsonResponse({"error": "Invalid cursor."}, status=400)
+
+    prompts = Prompt.select_by_fields(
+        fields={"conversation_id": conversation_id}, order_by="id", greater_than={"id": prompt_cursor}
+    )
+    # Runs whose callback never came would otherwise stay pending, and be polled, forever
+    if AICallbackService.expire_pending(prompts):
+        ContentVersionService.bump_conversation(conversation_id)
+
+    # Steps are stored before the response, so new files only belong to prompts past the cursor or still pending
+    new_files = [
+        f for f in CloudinaryFile.select_by_field_in_list("prompt_id", [p["id"] for p in prompts], order_by="id")
+        if f["id"] > file_cursor
+    ]
+
+    return JsonResponse({
+        "prompts": [prepare_prompt(p) for p in prompts],
+        "files": [prepare_file(f) for f in new_files],
+        "cursor": build_updates_cursor(prompts, new_files, prompt_cursor, file_cursor),
     })
 
 
@@ -93,6 +226,66 @@ def send_prompt_view(request):
     uploaded_file = request.FILES.get("file")
     conversation_id = request.POST.get("conversation_id")
 
+    # Image uploaded directly from the browser to Cloudinary
+    direct_upload = None
+    if not uploaded_file and request.POST.get("direct_upload_public_id"):
+        direct_upload = verify_direct_upload(
+            request.POST.get("direct_upload_public_id"),
+            request.POST.get("direct_upload_version"),
+            request.POST.get("direct_upload_signature"),
+            folder=f"{user_id}/inputs",
+            file_format=request.POST.get("direct_upload_format", ""),
+        )
+        if not direct_upload['success']:
+            messages.error(request, f"Image upload rejected: {direct_upload['error']}")
+            if conversation_id:
+                return redirect("conversation_detail", conversation_id=conversation_id)
+            return redirect(settings.LOGIN_REDIRECT_URL)
+
+    # Duplicate submissions (double click, browser retry) attach to the first run
+    idempotency_key = request.POST.get("idempotency_key")
+    if not IdempotencyService.is_valid_key(idempotency_key):
+        idempotency_key = None
+    if idempotency_key and not IdempotencyService.claim(user_id, idempotency_key):
+        existing = IdempotencyService.wait_for_result(user_id, idempotency_key)
+        if existing and existing.get("conversation_id"):
+            return redirect("conversation_detail", conversation_id=existing["conversation_id"])
+        return redirect(settings.LOGIN_REDIRECT_URL)
+
+    # Per-user rate limit, checked before any work is done
+    user_plan = request.session.get("user_plan", DEFAULT_PLAN)
+    allowed, retry_after = ai_scheduler.consume_token(user_id, user_plan)
+    if not allowed:
+        if idempotency_key:
+            IdempotencyService.release(user_id, idempotency_key)
+        messages.error(request, f"You are sending prompts too quickly. Please try again in {int(retry_after) + 1} seconds.")
+        if conversation_id:
+            return redirect("conversation_detail", conversation_id=conversation_id)
+        return redirect(settings.LOGIN_REDIRECT_URL)
+
+    try:
+        return submit_prompt(
+            request, user_id, user_plan, conversation_id, prompt_text, uploaded_file, direct_upload, idempotency_key
+        )
+    except Exception as e:
+        # The key must not stay claimed by a run that never finished: a retry gets a clean slate
+        if idempotency_key:
+            IdempotencyService.release(user_id, idempotency_key)
+        messages.error(request, f"Your prompt could not be sent: {str(e)}")
+        if conversation_id:
+            return redirect("conversation_detail", conversation_id=conversation_id)
+        return redirect(settings.LOGIN_REDIRECT_URL)
+
+
+def submit_prompt(request, user_id, user_plan, conversation_id, prompt_text, uploaded_file, direct_upload,
+                  idempotency_key):
+    """
+    Store a prompt (and its conversation and input image), then run it through
+    the AI service. Called by send_prompt_view once the submission is admitted.
+
+    Raises:
+        RuntimeError if the conversation or the prompt could not be stored
+    """
     # Create new conversation if needed
     if not conversation_id:
         conv_data = {
@@ -101,7 +294,10 @@ def send_prompt_view(request):
             "created_at": datetime.utcnow().isoformat(),
         }
         conversation = Conversation.insert(conv_data)
+        if not conversation:
+            raise RuntimeError("the conversation could not be created")
         conversation_id = conversation["id"]
+        ContentVersionService.bump_user(user_id)
     else:
         conversation = Conversation.select_by_id(conversation_id)
 
@@ -112,8 +308,17 @@ def send_prompt_view(request):
         "created_at": datetime.utcnow().isoformat(),
     }
     prompt = Prompt.insert(prompt_data)
+    if not prompt:
+        raise RuntimeError("the prompt could not be stored")
+    ContentVersionService.bump_conversation(conversation_id)
+
+    if idempotency_key:
+        IdempotencyService.record(
+            user_id, idempotency_key, status="in_flight", conversation_id=conversation_id, prompt_id=prompt["id"]
+        )
 
     input_image_url = None
+    input_bytes = 0
 
     # Handle image upload
     if uploaded_file:
@@ -122,6 +327,7 @@ def send_prompt_view(request):
         upload_result = upload_file(uploaded_file, folder=cloud_folder, public_id=public_id)
         if upload_result['success']:
             input_image_url = upload_result['url']
+            input_bytes = upload_result.get('bytes') or 0
             SupabaseFileService.create_file(user_id, {
                 'public_id': upload_result['public_id'],
                 'filename': uploaded_file.name,
@@ -132,12 +338,33 @@ def send_prompt_view(request):
                 'prompt_id': prompt['id'],
                 'user_id': user_id,
                 'step_type': 'input',
-                'step_index': 0
+                'step_index': 0,
+                'bytes': upload_result.get('bytes')
             })
+    elif direct_upload:
+        input_image_url = direct_upload['url']
+        input_bytes = direct_upload.get('bytes') or 0
+        SupabaseFileService.create_file(user_id, {
+            'public_id': direct_upload['public_id'],
+            'filename': request.POST.get("direct_upload_filename", ""),
+            'url': direct_upload['url'],
+            'resource_type': direct_upload['resource_type'],
+            'format': direct_upload['format'],
+            'folder': f"{user_id}/inputs",
+            'prompt_id': prompt['id'],
+            'user_id': user_id,
+            'step_type': 'input',
+            'step_index': 0,
+            'bytes': direct_upload.get('bytes')
+        })
+
+    # Steps and outputs are counted as they are saved (create_step_files)
+    UsageService.record(user_id, prompts=1, bytes_stored=input_bytes)
 
     # Call AI API
+    dispatched = False
     try:
-        api_url = os.getenv("AI_INPAINT_API_URL")
+        api_url = settings.AI_INPAINT_API_URL
         print(f"AI API URL: {api_url}")
         payload = {
             "user_id": user_id,
@@ -147,37 +374,97 @@ def send_prompt_view(request):
             "input_image_url": input_image_url
         }
         
-        response = requests.post(api_url, json=payload, timeout=9999)
-        result_data = response.json()
-
-        # Update prompt with AI response
-        Prompt.update_by_id(prompt["id"], {"response": json.dumps(result_data.get("final_response", "")), "text": f"{prompt_text} Here is the image URL: {input_image_url}"})
-
-        # Save visual steps and final output images to supabase
-        for i, step in enumerate(result_data.get("steps", [])):
-            step_type = step.get("step_type", f"step_{i+1}")
-            folder_type = "outputs" if step_type == "output" else "steps"
-            cloud_folder = f"{user_id}/{folder_type}"
+        if AICallbackService.is_enabled():
+            # The AI service acknowledges right away and POSTs steps to the callback URL,
+            # so this worker is not tied up for the whole run
+            payload["callback_url"] = AICallbackService.build_callback_url(request, prompt["id"])
+            ticket = ai_scheduler.acquire(user_id, user_plan)
+            # Stored before dispatching: callbacks measure step latency from it
+            Prompt.update_by_id(prompt["id"], {
+                "text": f"{prompt_text} Here is the image URL: {input_image_url}",
+                "dispatched_at": datetime.utcnow().isoformat(),
+            })
+            # The slot covers the dispatch only: the final callback may reach any
+            # worker, so a slot held until then could only be freed by a timeout
+            try:
+                response = requests.post(api_url, json=payload, timeout=AI_DISPATCH_TIMEOUT)
+                response.raise_for_status()
+            finally:
+                ai_scheduler.release(ticket)
+            dispatched = True
 
-            SupabaseFileService.create_file(user_id, {
-                "public_id": step["public_id"] if "public_id" in step else "",
-                "filename": step["filename"] if "filename" in step else "",
-                "url": step["url"] if "url" in step else "",
-                "resource_type": step["resource_type"] if "resource_type" in step else "",
-                "format": step.get("format", "") if "format" in step else "",
-                "folder": cloud_folder,
-                "prompt_id": prompt["id"],
-                "user_id": user_id,
-                "step_type": step_type,
-                "step_index": i + 1,
-                "reasoning_info": json.dumps(step.get("reasoning_info", {})) if "reasoning_info" in step else None
+            messages.info(request, "Your request is being processed, results will appear shortly.")
+        else:
+            # Wait for a fair share of the AI service
+            with ai_scheduler.job(user_id, user_plan):
+                dispatched_at = datetime.utcnow().isoformat()
+                started = time.perf_counter()
+                response = requests.post(api_url, json=payload, timeout=9999)
+                duration_ms = int((time.perf_counter() - started) * 1000)
+            result_data = response.json()
+
+            # Update prompt with AI response and timing
+            Prompt.update_by_id(prompt["id"], {
+                "response": json.dumps(result_data.get("final_response", "")),
+                "text": f"{prompt_text} Here is the image URL: {input_image_url}",
+                "dispatched_at": dispatched_at,
+                "duration_ms": duration_ms,
+                "service_duration_ms": LatencyService.reported_duration_ms(result_data),
             })
+            dispatched = True
+
+            # Save visual steps and final output images to supabase (all received when the call returned)
+            SupabaseFileService.create_step_files(user_id, prompt["id"], result_data.get("steps", []), elapsed_ms=duration_ms)
 
     except Exception as e:
         messages.error(request, f"AI API Error: {str(e)}")
+        # Otherwise the prompt looks pending forever and is resent by every updates poll
+        if not dispatched:
+            Prompt.update_by_id(prompt["id"], {
+                "response": json.dumps(FAILED_RESPONSE),
+            })
+
+    ContentVersionService.bump_conversation(conversation_id)
+
+    if idempotency_key:
+        IdempotencyService.record(
+            user_id, idempotency_key, status="completed", conversation_id=conversation_id, prompt_id=prompt["id"]
+        )
 
     return redirect("conversation_detail", conversation_id=conversation_id)
 
+def upload_signature_view(request):
+    """Issue short-lived signed parameters for a browser upload to the user's inputs folder"""
+    if request.method != "POST":
+        return HttpResponse(status=405)
+
+    user_id = request.session.get("user_id")
+    return JsonResponse(generate_upload_signature(f"{user_id}/inputs"))
+
+@csrf_exempt
+def ai_callback_view(request, prompt_id):
+    """Receive steps and the final response of an AI run, signed with AI_CALLBACK_SECRET"""
+    if request.method != "POST":
+        return HttpResponse(status=405)
+
+    if not AICallbackService.verify(request, prompt_id):
+        return HttpResponse("Invalid signature.", status=403)
+
+    try:
+        payload = json.loads(request.body)
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return HttpResponse("Invalid JSON.", status=400)
+
+    if not AICallbackService.handle(prompt_id, payload):
+        return HttpResponse("Unknown prompt.", status=404)
+
+    return JsonResponse({"status": "ok"})
+
+def ai_queue_status_view(request):
+    """Queue position and estimated wait of the user's pending AI job"""
+    user_id = request.session.get("user_id")
+    return JsonResponse(ai_scheduler.status(user_id))
+
 def send_output_email_view(request):
     if request.method == "POST":
         user_email = request.session.get("user_email")
@@ -194,8 +481,12 @@ def send_output_email_view(request):
             "user_email": user_email,
         })
 
-        # Download image content
-        image_content = requests.get(image_url).content
+        # Image content, downloaded once per asset version
+        try:
+            image_content = asset_cache.read(image_url)
+        except requests.RequestException:
+            messages.error(request, "Could not retrieve the output image, please try again.")
+            return redirect(request.META.get('HTTP_REFERER', '/'))
 
         # Create email
         email = EmailMessage(
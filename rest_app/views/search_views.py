@@ -0,0 +1,79 @@
+from django.http import HttpResponse, JsonResponse
+from django.urls import reverse
+from rest_app.models import Prompt
+from rest_app.services.search_service import PromptSearchService
+from rest_app.services.similarity_service import ImageSimilarityService, SIMILAR_RADIUS
+
+
+def search_prompts_view(request):
+    """
+    Full-text search over the logged-in user's prompts and AI responses
+
+    GET ?q=<query>&page=<1-based page>
+    """
+    if request.method != "GET":
+        return HttpResponse(status=405)
+
+    try:
+        page = max(int(request.GET.get("page", 1)), 1)
+    except ValueError:
+        return JsonResponse({"error": "Invalid page."}, status=400)
+
+    user_id = request.session.get("user_id")
+    found = PromptSearchService.search(user_id, request.GET.get("q", ""), page=page)
+    if found is None:
+        return JsonResponse({"error": "Search is unavailable, please try again."}, status=503)
+
+    results = []
+    for row in found["results"]:
+        url = reverse("conversation_detail", kwargs={"conversation_id": row["conversation_id"]})
+        results.append({
+            "prompt_id": row["id"],
+            "conversation_id": row["conversation_id"],
+            "conversation_title": row.get("conversation_title") or "",
+            "created_at": row.get("created_at"),
+            "highlight": PromptSearchService.render_highlight(row.get("headline")),
+            "url": f"{url}#prompt-{row['id']}",
+        })
+
+    return JsonResponse({"results": results, "page": page, "has_next": found["has_next"]})
+
+
+def similar_outputs_view(request, file_id):
+    """
+    Output images of the logged-in user that look like the given one
+
+    GET ?radius=<max pHash Hamming distance>
+    """
+    if request.method != "GET":
+        return HttpResponse(status=405)
+
+    try:
+        radius = int(request.GET.get("radius", SIMILAR_RADIUS))
+    except ValueError:
+        return JsonResponse({"error": "Invalid radius."}, status=400)
+
+    user_id = request.session.get("user_id")
+    similar = ImageSimilarityService.find_similar(user_id, file_id, radius=max(radius, 0))
+    if similar is None:
+        return JsonResponse({"error": "Image not found."}, status=404)
+
+    # Link each image to the prompt that produced it
+    prompt_ids = list({f["prompt_id"] for f in similar if f.get("prompt_id")})
+    conversations = {pid: p["conversation_id"] for pid, p in Prompt.select_many_by_id(prompt_ids).items()}
+
+    results = []
+    for f in similar:
+        conversation_id = conversations.get(f.get("prompt_id"))
+        url = None
+        if conversation_id:
+            url = reverse("conversation_detail", kwargs={"conversation_id": conversation_id}) + f"#prompt-{f['prompt_id']}"
+        results.append({
+            "file_id": f["id"],
+            "image_url": f["url"],
+            "distance": f["distance"],
+            "near_duplicate": f["near_duplicate"],
+            "url": url,
+        })
+
+    return JsonResponse({"results": results})
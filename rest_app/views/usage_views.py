@@ -0,0 +1,20 @@
+from django.http import HttpResponse, JsonResponse
+from rest_app.services.usage_service import UsageService, USAGE_DAYS
+
+
+def usage_stats_view(request):
+    """
+    Usage dashboard data of the logged-in user: lifetime totals and daily counters
+
+    GET ?days=<number of past days>
+    """
+    if request.method != "GET":
+        return HttpResponse(status=405)
+
+    try:
+        days = int(request.GET.get("days", USAGE_DAYS))
+    except ValueError:
+        return JsonResponse({"error": "Invalid days."}, status=400)
+
+    user_id = request.session.get("user_id")
+    return JsonResponse(UsageService.get_stats(user_id, days=days))